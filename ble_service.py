@@ -6,36 +6,168 @@ Adds file transfer support for OTA updates via BLE
 
 import bluetooth
 import struct
+import time
+from array import array
+from binascii import unhexlify
 from micropython import const
 
+import ota
+from ota import FileSink, CRC32_SIZE, SHA256_SIZE
+from flow_meters import RATE_WINDOW_US
+
 _SERVICE_UUID = bluetooth.UUID(0x181A)
 _FLOW_CHAR_UUID = bluetooth.UUID(0x2A6E)
 _CONTROL_CHAR_UUID = bluetooth.UUID(0x2A6F)
 _VERSION_CHAR_UUID = bluetooth.UUID(0x2A26)
 _FILE_TRANSFER_UUID = bluetooth.UUID(0x2A6D)
 _FILE_CONTROL_UUID = bluetooth.UUID(0x2A6C)
+_ALERT_CHAR_UUID = bluetooth.UUID(0x2A6B)
+_TELEMETRY_CHAR_UUID = bluetooth.UUID(0x2A6A)
+_FILE_DATA_UUID = bluetooth.UUID(0x2A69)
+_MANIFEST_CHAR_UUID = bluetooth.UUID(0x2A68)
+_BOOT_CHAR_UUID = bluetooth.UUID(0x2A67)
+_DIAG_CHAR_UUID = bluetooth.UUID(0x2A66)
 
 _FLAG_READ = const(0x0002)
+_FLAG_WRITE_NO_RESPONSE = const(0x0004)
 _FLAG_WRITE = const(0x0008)
 _FLAG_NOTIFY = const(0x0010)
 
+# Flow notify cadence (ms): min spacing while counts are moving, min spacing for a
+# change after an idle spell, and the keepalive when nothing changes at all
+NOTIFY_ACTIVE_MS = 100
+NOTIFY_IDLE_MS = 500
+NOTIFY_KEEPALIVE_MS = 5000
+# Counts changed within this long -> pumps considered running (active cadence). Derived
+# from the rate window of rate_fn (FlowMeters.get_rate_gpm reads 0 once no edge came
+# for RATE_WINDOW_US), plus a poll's worth of slack, so the frame sent on going idle
+# carries zero rates.
+_ACTIVE_HOLD_MS = RATE_WINDOW_US // 1000 + 1000
+
+# Flow notify formats, chosen per connection with control cmd 0x06
+FORMAT_LEGACY = const(1)  # 8 x <I counts on the flow characteristic (32 bytes)
+FORMAT_V2 = const(2)  # telemetry frame below on the telemetry characteristic
+# v2 is only accepted once the connection's ATT MTU fits the frame; otherwise the
+# connection stays on legacy. The control characteristic then reads
+# <u8 0x06><u8 format in effect><u16 ATT MTU>, so select v2 after the MTU exchange.
+
+# Telemetry frame v2, little-endian, 62 bytes (needs ATT MTU >= 65):
+#   0  u8      frame version (2)
+#   1  u8      channel count (8)
+#   2  u16     sequence, per connection; a gap means dropped notifications
+#   4  u32     device uptime ms (ticks_ms, wraps at 2**30)
+#   8  8 x u32 pulse counts
+#  40  8 x u16 flow rate, gal/min x 100
+#  56  4 x u8  tank percent full/remaining (config.TANK_ORDER), 255 = unknown
+#  60  u8      pump alert bits (same as the alert characteristic)
+#  61  u8      reserved
+_TELEMETRY_VERSION = const(2)
+_TELEMETRY_SIZE = const(62)
+_PREFERRED_MTU = const(247)
+
+# File transfers (file control cmd 0x01 legacy, 0x04 v2) may end the start command with
+# the expected digest, 4 bytes CRC32 (<I) or 32 bytes SHA-256; a file that does not match
+# is rejected at cmd 0x02. If the client disconnects, the partial file is kept and
+# re-sending the same start command (same name, size and digest) resumes it. The file
+# control value reads <u8 0x05><u32 offset> after a start or cmd 0x05 (resume point),
+# then 0x01 / 0x00 for installed / rejected after cmd 0x02. A name ending in ".z" is a
+# zlib stream (tools/make_release.py): size and digest cover the compressed bytes, and
+# once verified it is inflated into the name without ".z". A name ending in ".d" (or
+# ".d.z") is a delta patch for the installed file (ota.apply_patch); it is rejected if
+# that file is not the patch's base, and the app then sends the full file.
+#
+# Firmware bundles (ota.py): cmd 0x06 empties the staging directory, each file is then
+# sent as "ota_new/<name>" and the manifest as "ota_new/manifest.json"
+# ({"release": ..., "files": {name: {"size": n, "sha256": hex}}}). Cmd 0x07 verifies
+# every staged file, swaps them all in and reboots into a trial boot that rolls back
+# automatically unless the new release reaches "System ready".
+#
+# File transfer v2 (file cmd 0x04): chunks are written without response to the file
+# data characteristic as <u32 offset><payload>, up to MTU - 7 payload bytes. Chunks must
+# arrive in order; the device keeps no out-of-order data (go-back-N). Status frames are
+# notified on the same characteristic, <BBHI>:
+#   0  u8   status: 0x01 ack, 0x02 nak (gap seen: resend from offset), 0x03 error (aborted)
+#   1  u8   ack window: an ack follows every this many chunks and the final chunk
+#   2  u16  max chunk payload for this connection
+#   4  u32  next expected offset; every byte before it has been written
+_XFER_ACK = const(0x01)
+_XFER_NAK = const(0x02)
+_XFER_ERROR = const(0x03)
+FILE_ACK_WINDOW = 8
+_ATT_DEFAULT_MTU = const(23)
+
+# Device manifest (ota.device_manifest), one installed file per read. Write <u8 index>
+# to select an entry (the value is empty until the first write), then read
+# <BBI8sB> + name + version:
+#   0  u8   index (0xFF: index out of range)
+#   1  u8   file count
+#   2  u32  size in bytes
+#   6  8s   first 8 bytes of the file's SHA-256
+#  14  u8   name length, followed by the name and then the version string
+_MANIFEST_ENTRY = "<BBI8sB"
+_MANIFEST_BUF = const(96)
+
+# Boot timeline (boottime.py), readable once the device is up: ASCII
+# "phase=ms;..." with ms counted from power-on, ending "ready=<ms>"
+_BOOT_BUF = const(160)
+
+# Runtime diagnostics (diagnostics.py frame: heap, GC, pulse edges/rejects, loop jitter,
+# notify failures, uptime), refreshed and notified by housekeeping
+_DIAG_BUF = const(96)
+
 class BLEService:
-    def __init__(self, ble, flow_meters, version="4-18-2026-v1.2"):
+    def __init__(self, ble, flow_meters, version="4-18-2026-v1.2",
+                 notify_active_ms=NOTIFY_ACTIVE_MS, notify_idle_ms=NOTIFY_IDLE_MS,
+                 notify_keepalive_ms=NOTIFY_KEEPALIVE_MS, rate_fn=None, level_fn=None,
+                 manifest_fn=None):
         self._ble = ble
         self._flow_meters = flow_meters
         self._version = version
         self._connections = set()
+        # conn_handle -> [period override ms (0 = adaptive), last notify ms, last seq sent,
+        #                 format, telemetry frame sequence]
+        self._notify_state = {}
+        self._notify_active_ms = notify_active_ms
+        self._notify_idle_ms = notify_idle_ms
+        self._notify_keepalive_ms = notify_keepalive_ms
         self._flow_handle = None
         self._control_handle = None
         self._version_handle = None
         self._file_transfer_handle = None
         self._file_control_handle = None
+        self._alert_handle = None
+        self._alert_bits = 0
+        self._telemetry_handle = None
+        # Called before any deliberate machine.reset() (e.g. to checkpoint counters)
+        self.before_reset = None
+        # Telemetry sources: rate_fn(meter) -> gal/min, level_fn(tank index, counts) -> percent
+        self._rate_fn = rate_fn
+        self._level_fn = level_fn
+        # manifest_fn() -> {name: {"version", "size", "sha256"}} of installed files
+        self._manifest_fn = manifest_fn
         
-        self._file_transfer_active = False
-        self._file_name = None
-        self._file_data = bytearray()
-        self._file_size = 0
-        self._bytes_received = 0
+        # Active upload: an ota.FileSink streaming to "<name>.part", or None
+        self._file_sink = None
+        self._progress = bytearray(4)
+        # Transfer state: client connection, v2 protocol (else legacy), ack window,
+        # chunks since the last ack, nak already sent for the current gap
+        self._xfer_conn = None
+        self._xfer_v2 = False
+        self._xfer_window = FILE_ACK_WINDOW
+        self._xfer_unacked = 0
+        self._xfer_nak = False
+        self._xfer_status = bytearray(8)
+        self._mtu = {}
+        # gatts_notify calls that raised (disconnect races, full ATT queue)
+        self.notify_failures = 0
+
+        # Reused on every notify so the 100 ms loop does not allocate
+        self._flow_counts = array("L", [0] * 8)
+        self._flow_data = bytearray(32)
+        self._flow_seq = -1
+        self._last_change_ms = time.ticks_ms()
+        self._active = False
+        self._telemetry = bytearray(_TELEMETRY_SIZE)
         
         self._register_services()
         self._ble.irq(self._irq)
@@ -45,39 +177,85 @@ class BLEService:
     
     def _register_services(self):
         flow_char = (_FLOW_CHAR_UUID, _FLAG_READ | _FLAG_NOTIFY)
-        control_char = (_CONTROL_CHAR_UUID, _FLAG_WRITE)
+        control_char = (_CONTROL_CHAR_UUID, _FLAG_READ | _FLAG_WRITE)
         version_char = (_VERSION_CHAR_UUID, _FLAG_READ)
         file_transfer_char = (_FILE_TRANSFER_UUID, _FLAG_READ | _FLAG_WRITE)
-        file_control_char = (_FILE_CONTROL_UUID, _FLAG_WRITE)
+        file_control_char = (_FILE_CONTROL_UUID, _FLAG_READ | _FLAG_WRITE)
+        # Pump mismatch alerts: 1 byte, tank k in config.TANK_ORDER -> bit 2k (only pump 1
+        # running) / bit 2k+1 (only pump 2 running). Notified on every raise/clear.
+        alert_char = (_ALERT_CHAR_UUID, _FLAG_READ | _FLAG_NOTIFY)
+        telemetry_char = (_TELEMETRY_CHAR_UUID, _FLAG_READ | _FLAG_NOTIFY)
+        file_data_char = (_FILE_DATA_UUID, _FLAG_WRITE_NO_RESPONSE | _FLAG_NOTIFY)
+        manifest_char = (_MANIFEST_CHAR_UUID, _FLAG_READ | _FLAG_WRITE)
+        boot_char = (_BOOT_CHAR_UUID, _FLAG_READ)
+        diag_char = (_DIAG_CHAR_UUID, _FLAG_READ | _FLAG_NOTIFY)
         
-        service = (_SERVICE_UUID, (flow_char, control_char, version_char, file_transfer_char, file_control_char))
+        service = (_SERVICE_UUID, (flow_char, control_char, version_char, file_transfer_char, file_control_char,
+                                   alert_char, telemetry_char, file_data_char, manifest_char,
+                                   boot_char, diag_char))
         
         ((self._flow_handle, self._control_handle, self._version_handle, 
-          self._file_transfer_handle, self._file_control_handle),) = self._ble.gatts_register_services((service,))
+          self._file_transfer_handle, self._file_control_handle,
+          self._alert_handle, self._telemetry_handle, self._file_data_handle,
+          self._manifest_handle, self._boot_handle, self._diag_handle),) = self._ble.gatts_register_services((service,))
+        self._ble.gatts_write(self._alert_handle, bytes([0]))
+        self._ble.gatts_set_buffer(self._telemetry_handle, _TELEMETRY_SIZE)
+        # Default value buffers are 20 bytes; v2 chunks fill a whole ATT payload
+        self._ble.gatts_set_buffer(self._file_data_handle, _PREFERRED_MTU - 3)
+        self._ble.gatts_set_buffer(self._manifest_handle, _MANIFEST_BUF)
+        self._ble.gatts_set_buffer(self._boot_handle, _BOOT_BUF)
+        self._ble.gatts_set_buffer(self._diag_handle, _DIAG_BUF)
+        try:
+            self._ble.config(mtu=_PREFERRED_MTU)
+        except Exception as e:
+            print(f"BLE MTU not set: {e}")
     
     def _irq(self, event, data):
         if event == 1:
             conn_handle, _, _ = data
             self._connections.add(conn_handle)
+            self._notify_state[conn_handle] = [0, time.ticks_ms(), -1, FORMAT_LEGACY, 0]
+            self._mtu[conn_handle] = _ATT_DEFAULT_MTU
             print(f"BLE client connected: {conn_handle}")
+            try:
+                self._ble.gattc_exchange_mtu(conn_handle)
+            except Exception:
+                pass  # the client usually starts the exchange itself
             
         elif event == 2:
             conn_handle, _, _ = data
             self._connections.discard(conn_handle)
+            self._notify_state.pop(conn_handle, None)
+            self._mtu.pop(conn_handle, None)
             print(f"BLE client disconnected: {conn_handle}")
+            if self._file_sink and conn_handle == self._xfer_conn:
+                # Keep the partial file; re-sending the start command resumes it
+                self._file_sink.suspend()
+                self._file_sink = None
             
         elif event == 3:
             conn_handle, attr_handle = data
             value = self._ble.gatts_read(attr_handle)
             
             if attr_handle == self._control_handle:
-                self._handle_control_command(value)
+                self._handle_control_command(value, conn_handle)
+            elif attr_handle == self._file_data_handle:
+                self._handle_file_data(value)
             elif attr_handle == self._file_control_handle:
-                self._handle_file_control(value)
+                self._handle_file_control(value, conn_handle)
             elif attr_handle == self._file_transfer_handle:
                 self._handle_file_chunk(value)
+            elif attr_handle == self._manifest_handle:
+                if len(value) >= 1:
+                    self._select_manifest_entry(value[0])
+        
+        elif event == 21:
+            conn_handle, mtu = data
+            if conn_handle in self._mtu:
+                self._mtu[conn_handle] = mtu
+            print(f"BLE MTU {mtu} for {conn_handle}")
     
-    def _handle_control_command(self, data):
+    def _handle_control_command(self, data, conn_handle=None):
         if len(data) < 1:
             return
             
@@ -95,95 +273,349 @@ class BLEService:
                     print(f"Command: Reset meter {meter_id}")
                     self._flow_meters.reset_meter(meter_id)
 
+        elif cmd == 0x05:
+            # Per-connection notify period: <u16 ms>, 0 = adaptive default
+            if len(data) >= 3 and conn_handle in self._notify_state:
+                period = struct.unpack('<H', data[1:3])[0]
+                self._notify_state[conn_handle][0] = period
+                print(f"Command: Notify period {period} ms for {conn_handle}")
+
+        elif cmd == 0x06:
+            # Per-connection notify format: 1 = legacy counts, 2 = v2 telemetry frame
+            if len(data) >= 2 and conn_handle in self._notify_state:
+                if data[1] in (FORMAT_LEGACY, FORMAT_V2):
+                    st = self._notify_state[conn_handle]
+                    fmt = data[1]
+                    mtu = self._mtu.get(conn_handle, _ATT_DEFAULT_MTU)
+                    if fmt == FORMAT_V2 and mtu - 3 < _TELEMETRY_SIZE:
+                        # Notifications would be cut to MTU - 3 bytes
+                        print(f"Command: Notify format 2 refused for {conn_handle} (MTU {mtu})")
+                        fmt = FORMAT_LEGACY
+                    else:
+                        print(f"Command: Notify format {fmt} for {conn_handle}")
+                    st[3] = fmt
+                    st[2] = -1  # send a frame in the new format right away
+                    self._ble.gatts_write(self._control_handle, struct.pack('<BBH', 0x06, fmt, mtu))
+
         elif cmd == 0x04:
             # Next boot: main.py runs WiFi web UI once (wifi_once.flag). config.MODE stays "ble".
             print("Command: Schedule one-shot WiFi boot")
             try:
                 with open("wifi_once.flag", "w") as f:
                     f.write("1")
-                import time
                 import machine
 
+                self._prepare_reset()
                 time.sleep_ms(500)
                 machine.reset()
             except Exception as e:
                 print(f"wifi_once schedule error: {e}")
 
-    def _handle_file_control(self, data):
+    def _handle_file_control(self, data, conn_handle=None):
         if len(data) < 1:
             return
             
         cmd = data[0]
         
         if cmd == 0x01:
+            # <u32 size> <u8 name len> <name> [<digest>]
             if len(data) >= 6:
                 file_size = struct.unpack('<I', data[1:5])[0]
                 filename_len = data[5]
                 filename = data[6:6+filename_len].decode('utf-8')
+                self._start_transfer(filename, file_size, self._parse_digest(data, 6 + filename_len),
+                                     conn_handle, False)
                 
-                self._file_transfer_active = True
-                self._file_name = filename
-                self._file_size = file_size
-                self._file_data = bytearray()
-                self._bytes_received = 0
+        elif cmd == 0x04:
+            # Transfer v2: <u32 size> <u8 ack window> <u8 name len> <name> [<digest>]
+            if len(data) >= 7:
+                file_size = struct.unpack('<I', data[1:5])[0]
+                self._xfer_window = data[5] or FILE_ACK_WINDOW
+                filename_len = data[6]
+                filename = data[7:7+filename_len].decode('utf-8')
+                self._start_transfer(filename, file_size, self._parse_digest(data, 7 + filename_len),
+                                     conn_handle, True)
                 
-                print(f"Starting file transfer: {filename} ({file_size} bytes)")
+        elif cmd == 0x05:
+            # Resume point of the current transfer -> file control value <u8 0x05><u32 offset>
+            offset = self._file_sink.received if self._file_sink else 0
+            self._ble.gatts_write(self._file_control_handle, struct.pack('<BI', 0x05, offset))
+            if self._file_sink and self._xfer_v2:
+                self._send_xfer_status(_XFER_ACK, offset)
+            print(f"File transfer resume offset: {offset}")
                 
         elif cmd == 0x02:
-            if self._file_transfer_active:
-                print(f"File transfer complete: {self._file_name} ({self._bytes_received} bytes)")
-                
+            sink = self._file_sink
+            if sink:
+                self._file_sink = None
+                print(f"File transfer complete: {sink.target} ({sink.received} bytes)")
                 try:
-                    with open(self._file_name, 'wb') as f:
-                        f.write(self._file_data)
-                    print(f"File saved: {self._file_name}")
-                    self._ble.gatts_write(self._file_control_handle, bytes([0x01]))
+                    ok = sink.finish()
                 except Exception as e:
                     print(f"Error saving file: {e}")
-                    self._ble.gatts_write(self._file_control_handle, bytes([0x00]))
+                    sink.abort()
+                    ok = False
+                self._ble.gatts_write(self._file_control_handle, bytes([0x01 if ok else 0x00]))
                 
-                self._file_transfer_active = False
-                self._file_name = None
-                self._file_data = bytearray()
-                self._file_size = 0
-                self._bytes_received = 0
+        elif cmd == 0x06:
+            # Begin a firmware bundle: files then go to "ota_new/<name>", manifest last
+            try:
+                ota.begin_bundle()
+                self._ble.gatts_write(self._file_control_handle, bytes([0x01]))
+            except OSError as e:
+                print(f"Bundle start failed: {e}")
+                self._ble.gatts_write(self._file_control_handle, bytes([0x00]))
+                
+        elif cmd == 0x07:
+            # Commit the staged bundle: verify against its manifest, swap in, trial reboot
+            try:
+                ok, msg = ota.commit_bundle()
+            except Exception as e:
+                ok, msg = False, str(e)
+                print(f"Bundle commit failed: {e}")
+            self._ble.gatts_write(self._file_control_handle, bytes([0x01 if ok else 0x00]))
+            if ok:
+                import machine
+                self._prepare_reset()
+                time.sleep_ms(500)
+                machine.reset()
                 
         elif cmd == 0x03:
             print("Restart command received - rebooting in 3 seconds...")
-            import time
             import machine
+            self._prepare_reset()
             time.sleep(3)
             machine.reset()
     
+    def _parse_digest(self, data, pos):
+        """Optional expected digest after the filename: 4 bytes = CRC32, 32 = SHA-256"""
+        if len(data) - pos in (CRC32_SIZE, SHA256_SIZE):
+            return bytes(data[pos:])
+        return None
+    
+    def _start_transfer(self, filename, file_size, digest, conn_handle, v2):
+        """Open a sink for a new upload, resuming a suspended one with the same size and digest"""
+        if self._file_sink:
+            self._file_sink.abort()
+            self._file_sink = None
+        self._xfer_conn = conn_handle
+        self._xfer_v2 = v2
+        self._xfer_unacked = 0
+        self._xfer_nak = False
+        try:
+            self._file_sink = FileSink(filename, file_size, digest)
+        except (OSError, ValueError) as e:
+            print(f"Cannot start file transfer: {e}")
+            if v2:
+                self._send_xfer_status(_XFER_ERROR, 0)
+            self._ble.gatts_write(self._file_control_handle, bytes([0x00]))
+            return
+        
+        offset = self._file_sink.received
+        if v2:
+            print(f"Starting file transfer v2: {filename} ({file_size} bytes, "
+                  f"{self._xfer_max_payload()} B chunks, ack every {self._xfer_window})")
+            self._send_xfer_status(_XFER_ACK, offset)
+        else:
+            print(f"Starting file transfer: {filename} ({file_size} bytes)")
+        self._ble.gatts_write(self._file_control_handle, struct.pack('<BI', 0x05, offset))
+    
+    def _prepare_reset(self):
+        if self.before_reset:
+            try:
+                self.before_reset()
+            except Exception as e:
+                print(f"before_reset error: {e}")
+
     def _handle_file_chunk(self, data):
-        if not self._file_transfer_active:
+        sink = self._file_sink
+        if not sink or self._xfer_v2:
             return
         
-        self._file_data.extend(data)
-        self._bytes_received += len(data)
+        before = sink.received
+        try:
+            ok = sink.write(data)
+        except OSError as e:
+            print(f"File write error: {e}")
+            sink.abort()
+            ok = False
+        if not ok:
+            self._file_sink = None
+            self._ble.gatts_write(self._file_control_handle, bytes([0x00]))
+            return
         
-        progress = int((self._bytes_received / self._file_size) * 100) if self._file_size > 0 else 0
-        self._ble.gatts_write(self._file_transfer_handle, struct.pack('<I', progress))
+        received = sink.received
+        progress = received * 100 // sink.size if sink.size > 0 else 0
+        struct.pack_into('<I', self._progress, 0, progress)
+        self._ble.gatts_write(self._file_transfer_handle, self._progress)
+        
+        if received // 1024 != before // 1024:
+            print(f"Received {received}/{sink.size} bytes ({progress}%)")
+    
+    def _xfer_max_payload(self):
+        mtu = self._mtu.get(self._xfer_conn, _ATT_DEFAULT_MTU)
+        return min(mtu, _PREFERRED_MTU) - 3 - 4
+    
+    def _send_xfer_status(self, status, offset):
+        buf = self._xfer_status
+        struct.pack_into('<BBHI', buf, 0, status, self._xfer_window, self._xfer_max_payload(), offset)
+        try:
+            self._ble.gatts_notify(self._xfer_conn, self._file_data_handle, buf)
+        except Exception as e:
+            self.notify_failures += 1
+            print(f"Transfer status notify failed: {e}")
+    
+    def _handle_file_data(self, data):
+        """Transfer v2 chunk: <u32 offset><payload>, written without response"""
+        sink = self._file_sink
+        if not sink or not self._xfer_v2 or len(data) < 4:
+            return
+        
+        offset = struct.unpack_from('<I', data, 0)[0]
+        expected = sink.received
+        if offset != expected:
+            if offset > expected:
+                # A chunk went missing: everything after it is dropped until the resend
+                if not self._xfer_nak:
+                    self._xfer_nak = True
+                    self._send_xfer_status(_XFER_NAK, expected)
+                return
+            # Duplicate of data already written (resend after a lost ack)
+            self._xfer_unacked += 1
+            if self._xfer_unacked >= self._xfer_window:
+                self._xfer_unacked = 0
+                self._send_xfer_status(_XFER_ACK, expected)
+            return
+        
+        self._xfer_nak = False
+        try:
+            ok = sink.write(memoryview(data)[4:])
+        except OSError as e:
+            print(f"File write error: {e}")
+            sink.abort()
+            ok = False
+        if not ok:
+            self._send_xfer_status(_XFER_ERROR, expected)
+            self._file_sink = None
+            return
         
-        if self._bytes_received % 1024 == 0:
-            print(f"Received {self._bytes_received}/{self._file_size} bytes ({progress}%)")
+        self._xfer_unacked += 1
+        if self._xfer_unacked >= self._xfer_window or sink.received == sink.size:
+            self._xfer_unacked = 0
+            self._send_xfer_status(_XFER_ACK, sink.received)
     
+    def _pack_telemetry(self):
+        """Fill the preallocated v2 frame from the current snapshot (sequence set per send)"""
+        buf = self._telemetry
+        counts = self._flow_counts
+        struct.pack_into('<BBHI', buf, 0, _TELEMETRY_VERSION, 8, 0, time.ticks_ms())
+        for i in range(8):
+            struct.pack_into('<I', buf, 8 + i * 4, counts[i])
+            rate = int(self._rate_fn(i) * 100) if self._rate_fn else 0
+            struct.pack_into('<H', buf, 40 + i * 2, max(0, min(rate, 0xFFFF)))
+        for k in range(4):
+            buf[56 + k] = self._level_fn(k, counts) if self._level_fn else 0xFF
+        buf[60] = self._alert_bits
+        buf[61] = 0
+        self._ble.gatts_write(self._telemetry_handle, buf)
+
     def update_flow_values(self):
+        """
+        Notify flow data, change-driven: a connection is sent its frame when counts
+        changed and its period has elapsed (fast while counts are moving, slower after
+        an idle spell), when pumps go idle, or when the keepalive expires. Call often;
+        it is cheap when idle.
+        """
         if not self._connections:
             return
         
-        data = bytearray(32)
-        for i in range(8):
-            count = self._flow_meters.get_count(i)
-            struct.pack_into('<I', data, i * 4, count)
+        now = time.ticks_ms()
+        counts = self._flow_counts
+        data = self._flow_data
+        seq = self._flow_meters.snapshot_into(counts)
+        if seq != self._flow_seq:
+            idle_ms = time.ticks_diff(now, self._last_change_ms)
+            self._flow_seq = seq
+            self._last_change_ms = now
+            for i in range(8):
+                struct.pack_into('<I', data, i * 4, counts[i])
+            self._ble.gatts_write(self._flow_handle, data)
+        else:
+            idle_ms = time.ticks_diff(now, self._last_change_ms)
+        active = idle_ms < _ACTIVE_HOLD_MS
+        # Going idle changes rates without changing counts; push one last frame
+        went_idle = self._active and not active
+        self._active = active
         
-        # Notify all connected clients
+        # Notify connected clients that are due
+        packed = False
+        for conn_handle, st in self._notify_state.items():
+            elapsed = time.ticks_diff(now, st[1])
+            if st[2] != seq:
+                period = st[0] or (self._notify_active_ms if active else self._notify_idle_ms)
+            else:
+                period = self._notify_keepalive_ms
+            if st[2] != -1 and elapsed < period and not went_idle:
+                continue
+            if st[3] == FORMAT_V2:
+                if not packed:
+                    self._pack_telemetry()
+                    packed = True
+                st[4] = (st[4] + 1) & 0xFFFF
+                struct.pack_into('<H', self._telemetry, 2, st[4])
+                handle, frame = self._telemetry_handle, self._telemetry
+            else:
+                handle, frame = self._flow_handle, data
+            try:
+                self._ble.gatts_notify(conn_handle, handle, frame)
+            except Exception:
+                self.notify_failures += 1
+            st[1] = now
+            st[2] = seq
+    
+    def set_alerts(self, bits):
+        """Publish the pump alert bitfield and notify connected clients if it changed"""
+        bits &= 0xFF
+        if bits == self._alert_bits:
+            return
+        self._alert_bits = bits
+        value = bytes([bits])
+        self._ble.gatts_write(self._alert_handle, value)
         for conn_handle in self._connections:
             try:
-                self._ble.gatts_notify(conn_handle, self._flow_handle, data)
-            except:
-                pass
+                self._ble.gatts_notify(conn_handle, self._alert_handle, value)
+            except Exception:
+                self.notify_failures += 1
     
+    def _select_manifest_entry(self, index):
+        """Put manifest entry index (files in name order) into the manifest value"""
+        entries = self._manifest_fn() if self._manifest_fn else {}
+        names = sorted(entries)
+        if index >= len(names):
+            self._ble.gatts_write(self._manifest_handle, struct.pack(_MANIFEST_ENTRY, 0xFF, len(names), 0, b"", 0))
+            return
+        name = names[index]
+        e = entries[name]
+        digest = b""
+        if e.get("sha256"):
+            digest = unhexlify(e["sha256"][:16])
+        name_b = name.encode()
+        value = struct.pack(_MANIFEST_ENTRY, index, len(names), e.get("size", 0), digest, len(name_b))
+        value += name_b + str(e.get("version", "")).encode()
+        self._ble.gatts_write(self._manifest_handle, value[:_MANIFEST_BUF])
+
+    def set_diagnostics(self, frame):
+        """Publish a diagnostics frame and notify connected clients"""
+        self._ble.gatts_write(self._diag_handle, frame)
+        for conn_handle in self._connections:
+            try:
+                self._ble.gatts_notify(conn_handle, self._diag_handle, frame)
+            except Exception:
+                self.notify_failures += 1
+
+    def set_boot_timeline(self, data):
+        self._ble.gatts_write(self._boot_handle, data[:_BOOT_BUF])
+
     def set_version_info(self, version):
         version_bytes = version.encode('utf-8')[:20]
         self._ble.gatts_write(self._version_handle, version_bytes)
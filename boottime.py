@@ -0,0 +1,76 @@
+"""
+Boot Timeline
+Version: 4-19-2026-v1.3
+Timestamped boot phases from power-on to first light (BLE advertising or HTTP listener)
+"""
+
+import sys
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    from flow_rate import ticks_ms, ticks_diff
+
+# On the Pico ticks_ms() counts from reset, so phases include interpreter start-up and
+# compiling main.py. Elsewhere they count from this module's import.
+_T0 = 0 if sys.implementation.name == "micropython" else ticks_ms()
+_marks = []  # (phase, ms since power-on), in order
+
+
+def power_on_ticks():
+    """ticks_ms() value at power-on (at import of this module off the Pico)"""
+    return _T0
+
+
+def mark(phase):
+    """Record that phase finished now; returns ms since power-on"""
+    ms = ticks_diff(ticks_ms(), _T0)
+    _marks.append((phase, ms))
+    return ms
+
+
+def phases():
+    """[(phase, ms since power-on, ms the phase took)]"""
+    out = []
+    prev = 0
+    for phase, ms in _marks:
+        out.append((phase, ms, ms - prev))
+        prev = ms
+    return out
+
+
+def ready_ms():
+    """ms from power-on to the "ready" mark, or None before it"""
+    for phase, ms in _marks:
+        if phase == "ready":
+            return ms
+    return None
+
+
+def summary(budget_ms=None):
+    """JSON-friendly timeline for /api/boot"""
+    ready = ready_ms()
+    return {
+        "phases": [[p, ms, took] for p, ms, took in phases()],
+        "ready_ms": ready,
+        "budget_ms": budget_ms,
+        "over_budget": bool(budget_ms and ready is not None and ready > budget_ms),
+    }
+
+
+def encode(max_len=160):
+    """Compact text for the BLE boot characteristic: "ota=45;config=80;...;ready=812" """
+    return ";".join("%s=%d" % (p, ms) for p, ms in _marks).encode()[:max_len]
+
+
+def report(budget_ms=None):
+    """Print each phase and flag a boot slower than budget_ms"""
+    for phase, ms, took in phases():
+        print(f"  {ms:6d} ms  +{took:5d}  {phase}")
+    ready = ready_ms()
+    if ready is None:
+        return
+    if budget_ms and ready > budget_ms:
+        print(f"Boot: ready in {ready} ms - OVER BUDGET ({budget_ms} ms)")
+    else:
+        print(f"Boot: ready in {ready} ms" + (f" (budget {budget_ms} ms)" if budget_ms else ""))
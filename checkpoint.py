@@ -0,0 +1,160 @@
+"""
+Pulse Counter Checkpoints
+Version: 4-19-2026-v1.3
+Crash-safe persistence of flow meter counts across reboots and brown-outs
+"""
+
+import os
+import struct
+from binascii import crc32
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    from flow_rate import ticks_ms, ticks_diff
+
+# Record: magic, format version, channel count, sequence, counts, crc32 of the rest
+_MAGIC = 0xBA11
+_FORMAT = 1
+_CHANNELS = 8
+_RECORD = "<HBBI8II"
+RECORD_SIZE = struct.calcsize(_RECORD)  # 44 bytes
+_BODY_SIZE = RECORD_SIZE - 4
+
+
+class CheckpointStore:
+    """
+    Appends fixed-size binary records of all counts to one of several files, moving
+    to the next file (truncating it) once the current one holds records_per_file.
+    Spreading writes over the files levels wear; a torn final record only costs
+    that record because each one carries its own CRC.
+
+    A record is written when counts changed and period_ms has passed, or sooner
+    (but not within min_ms) once they moved by delta pulses in total - a reset
+    counts as movement, so resets persist quickly. restore() reads only the tail of
+    each file, so boot-time recovery is a handful of small reads.
+    """
+
+    def __init__(self, flow_meters, prefix="ckpt", files=4, records_per_file=64,
+                 period_ms=10000, min_ms=2000, delta=450):
+        self._fm = flow_meters
+        self._names = ["%s%d.bin" % (prefix, i) for i in range(files)]
+        self._records_per_file = records_per_file
+        self._period_ms = period_ms
+        self._min_ms = min_ms
+        self._delta = delta
+
+        self._counts = flow_meters.new_buffer()
+        self._saved = flow_meters.new_buffer()
+        self._record = bytearray(RECORD_SIZE)
+        self._seq = 0
+        self._file = files - 1  # first write rotates to file 0
+        self._in_file = records_per_file
+        self._last_ms = ticks_ms()
+        self._snapshot_seq = -1
+        self.writes = 0
+
+    def _read_last(self, name):
+        """Return (seq, counts) of the newest valid record in a file, or None"""
+        try:
+            n = os.stat(name)[6] // RECORD_SIZE
+        except OSError:
+            return None
+        buf = self._record
+        try:
+            with open(name, "rb") as f:
+                # The last record may be torn by a power cut; fall back to the one before
+                for k in (n - 1, n - 2):
+                    if k < 0:
+                        break
+                    f.seek(k * RECORD_SIZE)
+                    if f.readinto(buf) != RECORD_SIZE:
+                        continue
+                    rec = struct.unpack(_RECORD, buf)
+                    if rec[0] != _MAGIC or rec[1] != _FORMAT or rec[2] != _CHANNELS:
+                        continue
+                    if crc32(memoryview(buf)[:_BODY_SIZE]) & 0xFFFFFFFF != rec[-1]:
+                        continue
+                    return rec[3], rec[4:4 + _CHANNELS]
+        except OSError:
+            pass
+        return None
+
+    def restore(self):
+        """Load the newest good checkpoint into the flow meters; True if one was found"""
+        best = None
+        best_file = 0
+        for i, name in enumerate(self._names):
+            rec = self._read_last(name)
+            if rec and (best is None or rec[0] > best[0]):
+                best = rec
+                best_file = i
+        if best is None:
+            print("No counter checkpoint found")
+            return False
+        seq, counts = best
+        self._fm.set_counts(counts)
+        for i in range(_CHANNELS):
+            self._saved[i] = counts[i]
+        self._seq = seq
+        self._snapshot_seq = self._fm.snapshot_into(self._counts)
+        # Never append behind a possibly torn record: continue in the next file
+        self._file = best_file
+        self._in_file = self._records_per_file
+        print(f"Restored counters from checkpoint #{seq}: {list(counts)}")
+        return True
+
+    def _moved(self):
+        moved = 0
+        for i in range(_CHANNELS):
+            d = self._counts[i] - self._saved[i]
+            moved += d if d > 0 else -d
+        return moved
+
+    def tick(self, now_ms=None):
+        """Write a checkpoint if the thresholds are met; call about once a second"""
+        if now_ms is None:
+            now_ms = ticks_ms()
+        seq = self._fm.snapshot_into(self._counts)
+        if seq == self._snapshot_seq:
+            return False
+        elapsed = ticks_diff(now_ms, self._last_ms)
+        if elapsed < self._min_ms:
+            return False
+        if elapsed < self._period_ms and self._moved() < self._delta:
+            return False
+        self._snapshot_seq = seq
+        self._write(now_ms)
+        return True
+
+    def flush(self):
+        """Write immediately if anything changed (call before a deliberate reset)"""
+        seq = self._fm.snapshot_into(self._counts)
+        if seq != self._snapshot_seq:
+            self._snapshot_seq = seq
+            self._write(ticks_ms())
+
+    def _write(self, now_ms):
+        self._last_ms = now_ms
+        self._seq += 1
+        buf = self._record
+        c = self._counts
+        struct.pack_into(_RECORD, buf, 0, _MAGIC, _FORMAT, _CHANNELS, self._seq,
+                         c[0], c[1], c[2], c[3], c[4], c[5], c[6], c[7], 0)
+        struct.pack_into("<I", buf, _BODY_SIZE, crc32(memoryview(buf)[:_BODY_SIZE]) & 0xFFFFFFFF)
+
+        if self._in_file >= self._records_per_file:
+            self._file = (self._file + 1) % len(self._names)
+            self._in_file = 0
+            mode = "wb"
+        else:
+            mode = "ab"
+        try:
+            with open(self._names[self._file], mode) as f:
+                f.write(buf)
+            self._in_file += 1
+            self.writes += 1
+            for i in range(_CHANNELS):
+                self._saved[i] = c[i]
+        except OSError as e:
+            print(f"Checkpoint write failed: {e}")
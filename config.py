@@ -65,19 +65,36 @@ GITHUB_USER = "joelevy1"
 GITHUB_REPO = "ballast"
 GITHUB_BRANCH = "main"
 
-# Files to check for updates (only used in WiFi mode)
+# Files to check for updates (only used in WiFi mode) and listed in version banners
 UPDATE_FILES = [
     "main.py",
     "main_wifi.py",
     "ble_service.py",
     "ble_advertising.py",
     "flow_meters.py",
+    "flow_rate.py",
+    "pump_alerts.py",
+    "scheduler.py",
+    "settings_store.py",
+    "checkpoint.py",
+    "ota.py",
+    "boottime.py",
+    "diagnostics.py",
     "config.py"
 ]
 
 # Flow meter GPIO pins (GP0-GP7)
 FLOW_METER_PINS = [0, 1, 2, 3, 4, 5, 6, 7]
 
+# Glitch filter: minimum spacing in microseconds between accepted pulses, per channel
+# (same order as FLOW_METER_PINS). Closer pulses are rejected and counted; see
+# "rejects" in /api/info to tune. 2000 us = 500 Hz max (~66 gal/min at 450 pulses/gal).
+FLOW_METER_MIN_PULSE_US = [2000, 2000, 2000, 2000, 2000, 2000, 2000, 2000]
+
+# Pulse-counting engine: "irq" (Python pin interrupts), "hw" (rp2 PWM/PIO hardware
+# counters, no Python per pulse), or "sim" (software only, for host testing)
+FLOW_METER_ENGINE = "irq"
+
 # Tank configuration
 # Each tank has two pumps (top and bottom)
 TANKS = {
@@ -99,6 +116,9 @@ TANKS = {
     }
 }
 
+# Fixed tank order for BLE alert bits / telemetry (tank k -> bits 2k, 2k+1)
+TANK_ORDER = ["port", "starboard", "mid", "forward"]
+
 # Flow meter calibration
 PULSES_PER_GALLON = 450  # Estimated, needs physical calibration
 POUNDS_PER_GALLON = 8.34
@@ -107,6 +127,21 @@ LBS_PER_GALLON = POUNDS_PER_GALLON
 # main_wifi.py: minimum gal/min to consider a pump "running" for mismatch alerts
 MIN_FLOW_RATE = 0.5
 
+# Flow rate tracker (flow_rate.py): one sample per period, averaged over the window, for
+# the "avg_rates" of WiFi mode's /api/pulses and live stream (alerts and RUNNING/STOPPED
+# use the instantaneous rate). Set FLOW_RATE_EWMA_ALPHA (0-1) to use an exponentially
+# weighted average instead.
+FLOW_RATE_PERIOD_MS = 1000
+FLOW_RATE_WINDOW = 5
+FLOW_RATE_EWMA_ALPHA = None
+
+# Pump mismatch alerts (pump_alerts.py): a pump stops counting as running below
+# ALERT_OFF_RATE gal/min (hysteresis under MIN_FLOW_RATE). A mismatch must last
+# ALERT_RAISE_MS to raise an alert and be gone ALERT_CLEAR_MS to clear it.
+ALERT_OFF_RATE = 0.3
+ALERT_RAISE_MS = 5000
+ALERT_CLEAR_MS = 3000
+
 # Display layout for WiFi HTML (meters = flow meter indices; names = pump row labels)
 TANK_CONFIG = {
     "Port": {"meters": TANKS["port"]["pumps"], "names": ["Top (White)", "Btm (Green)"]},
@@ -115,5 +150,61 @@ TANK_CONFIG = {
     "Forward": {"meters": TANKS["forward"]["pumps"], "names": ["Port (Yellow)", "Mid (Yellow)"]},
 }
 
+# Counter checkpoints (checkpoint.py): counts survive reboots. A record is written when
+# counts changed and CHECKPOINT_PERIOD_MS passed, or after CHECKPOINT_MIN_MS once they
+# moved CHECKPOINT_DELTA pulses; writes rotate over CHECKPOINT_FILES files.
+CHECKPOINT_PERIOD_MS = 10000
+CHECKPOINT_MIN_MS = 2000
+CHECKPOINT_DELTA = 450
+CHECKPOINT_FILES = 4
+CHECKPOINT_RECORDS_PER_FILE = 64
+
+# Periodic tasks (scheduler.py): name -> (period ms, deadline ms). A run longer than its
+# deadline counts as an overrun; housekeeping prints new overruns. WiFi mode runs
+# "rates", "alerts", "persist" and "housekeeping" next to the web server.
+TASK_SCHEDULE = {
+    "sample": (50, 10),
+    "rates": (FLOW_RATE_PERIOD_MS, 20),
+    "notify": (100, 30),
+    "alerts": (250, 20),
+    "persist": (1000, 200),
+    "housekeeping": (10000, 100),
+}
+
+# Boot budget (boottime.py): ms from power-on to "ready" (BLE advertising / HTTP
+# listening). A slower boot is flagged on the console, /api/boot and the BLE boot value.
+# WiFi includes joining the network.
+BOOT_BUDGET_MS = {"ble": 2000, "wifi": 15000}
+
+# WiFi web server (main_wifi.py, asyncio): connections served at once (more get 503),
+# each connection's request buffer (request line and headers must fit, else 431), time
+# allowed to send a request once started, idle time before a keep-alive connection is
+# closed, largest accepted request body, and the timeout of outgoing requests (update
+# checks, notifications) that run in the background
+HTTP_MAX_CLIENTS = 4
+HTTP_BUFFER_SIZE = 2048
+HTTP_REQUEST_TIMEOUT_MS = 5000
+HTTP_KEEPALIVE_MS = 10000
+HTTP_MAX_BODY = 16384
+HTTP_FETCH_TIMEOUT_MS = 10000
+
+# Live stream (GET /api/stream, Server-Sent Events): at most STREAM_MAX_CLIENTS viewers
+# (they do not count against HTTP_MAX_CLIENTS). Values are checked every
+# STREAM_PERIOD_MS and sent when they changed; a heartbeat keeps idle streams open.
+# Each viewer buffers STREAM_QUEUE events (the oldest is dropped) and is disconnected
+# if it cannot take them within STREAM_SEND_TIMEOUT_MS.
+STREAM_MAX_CLIENTS = 3
+STREAM_PERIOD_MS = 500
+STREAM_HEARTBEAT_MS = 15000
+STREAM_QUEUE = 4
+STREAM_SEND_TIMEOUT_MS = 5000
+
 # BLE settings
 BLE_DEVICE_NAME = "Ballast Monitor"
+
+# Flow notifications are change-driven: at most every BLE_NOTIFY_ACTIVE_MS while counts
+# are moving, BLE_NOTIFY_IDLE_MS for the first change after an idle spell, and a
+# keepalive every BLE_NOTIFY_KEEPALIVE_MS. The app can set its own period (cmd 0x05).
+BLE_NOTIFY_ACTIVE_MS = 100
+BLE_NOTIFY_IDLE_MS = 500
+BLE_NOTIFY_KEEPALIVE_MS = 5000
@@ -0,0 +1,127 @@
+"""
+Runtime Diagnostics
+Version: 4-19-2026-v1.3
+Heap, GC, pulse ISR and loop timing counters packed for the BLE diagnostics characteristic
+"""
+
+import gc
+import struct
+
+import boottime
+
+try:
+    from time import ticks_ms, ticks_us, ticks_diff
+except ImportError:
+    from flow_rate import ticks_ms, ticks_diff
+
+    def ticks_us():
+        return ticks_ms() * 1000
+
+# Frame (little endian), 32 byte header then one <II> per channel:
+#   0  u8   format (DIAG_FORMAT)
+#   1  u8   channel count
+#   2  u32  uptime since power-on, s
+#   6  u32  heap free, bytes
+#  10  u32  largest free heap block, bytes (probed to LARGEST_STEP; 0 until first probe)
+#  14  u32  heap allocated, bytes
+#  18  u16  GC collections run by housekeeping
+#  20  u16  last collection, ms
+#  22  u16  slowest collection, ms
+#  24  u16  loop jitter: worst task start lateness since the previous frame, ms
+#  26  u16  task overruns + missed periods since boot
+#  28  u32  BLE notifications that failed to send
+#  32  per channel: u32 edges seen (ISR runs with the irq engine), u32 glitch rejects
+DIAG_FORMAT = 1
+_HEADER = "<BBIIIIHHHHHI"
+HEADER_SIZE = struct.calcsize(_HEADER)  # 32 bytes
+LARGEST_STEP = 256
+
+
+def _u16(v):
+    return v if v < 0xFFFF else 0xFFFF
+
+
+class Diagnostics:
+    """
+    Collects the counters from their owners (FlowMeters, Scheduler, BLEService) into
+    one preallocated frame. collect() replaces the plain gc.collect() of housekeeping
+    so collections are counted and timed; the largest free block is probed after
+    every probe_every-th collection, since probing allocates.
+    """
+
+    def __init__(self, flow_meters, scheduler=None, notify_failures_fn=None, probe_every=6):
+        self._fm = flow_meters
+        self._scheduler = scheduler
+        self._notify_failures_fn = notify_failures_fn
+        self._probe_every = probe_every
+        n = flow_meters.channels
+        self._edges = flow_meters.new_buffer()
+        self._rejects = flow_meters.new_buffer()
+        self.frame = bytearray(HEADER_SIZE + 8 * n)
+        self.gc_count = 0
+        self.gc_last_ms = 0
+        self.gc_max_ms = 0
+        self.largest_free = 0
+        # Counted from power-on (not from here), in steps so ticks_ms() wrapping is harmless
+        self._uptime_ms = 0
+        self._last_ms = boottime.power_on_ticks()
+
+    def collect(self):
+        """Run a timed gc.collect() (and now and then the largest-block probe)"""
+        t = ticks_us()
+        gc.collect()
+        ms = ticks_diff(ticks_us(), t) // 1000
+        self.gc_count += 1
+        self.gc_last_ms = ms
+        if ms > self.gc_max_ms:
+            self.gc_max_ms = ms
+        if (self.gc_count % self._probe_every == 1 or self._probe_every == 1) and hasattr(gc, "mem_free"):
+            self.largest_free = self._probe_largest()
+            gc.collect()
+
+    def _probe_largest(self):
+        """Largest bytearray that can be allocated now, found by binary search"""
+        lo = 0
+        hi = gc.mem_free() // LARGEST_STEP + 1
+        while lo + 1 < hi:
+            mid = (lo + hi) // 2
+            try:
+                b = bytearray(mid * LARGEST_STEP)
+                b = None
+                lo = mid
+            except MemoryError:
+                hi = mid
+        return lo * LARGEST_STEP
+
+    def uptime_s(self):
+        now = ticks_ms()
+        self._uptime_ms += ticks_diff(now, self._last_ms)
+        self._last_ms = now
+        return self._uptime_ms // 1000
+
+    def pack(self):
+        """Refresh the frame from the current counters and return it"""
+        buf = self.frame
+        fm = self._fm
+        n = fm.channels
+        jitter = 0
+        faults = 0
+        if self._scheduler:
+            jitter = self._scheduler.take_jitter()
+            for t in self._scheduler.tasks:
+                faults += t.overruns + t.missed
+        failures = self._notify_failures_fn() if self._notify_failures_fn else 0
+        try:
+            free = gc.mem_free()
+            alloc = gc.mem_alloc()
+        except AttributeError:
+            free = alloc = 0
+        struct.pack_into(
+            _HEADER, buf, 0, DIAG_FORMAT, n, self.uptime_s(), free, self.largest_free, alloc,
+            _u16(self.gc_count), _u16(self.gc_last_ms), _u16(self.gc_max_ms), _u16(jitter),
+            _u16(faults), failures & 0xFFFFFFFF,
+        )
+        fm.edges_into(self._edges, self._rejects)
+        for i in range(n):
+            struct.pack_into("<II", buf, HEADER_SIZE + 8 * i, self._edges[i], self._rejects[i])
+        return buf
@@ -1,57 +1,607 @@
 """
 Flow Meter Handler
 Version: 4-19-2026-v1.3
-Handles 8 flow meters with interrupt-based counting
+Handles 8 flow meters on a pluggable pulse-counting engine:
+  "irq" - Pin.irq per channel with a per-channel microsecond glitch filter
+  "hw"  - rp2 hardware counters (PWM slice edge counters on PWM B pins,
+          PIO state machines on the rest); counting runs outside Python
+  "sim" - pure software engine; runs the same API on a Linux host
 """
 
-from machine import Pin
 import time
+from array import array
 
-class FlowMeters:
-    def __init__(self, pins):
+try:
+    from machine import Pin, disable_irq, enable_irq
+except ImportError:
+    # Linux host: only the simulated engine is available
+    Pin = None
+
+    def disable_irq():
+        return 0
+
+    def enable_irq(state):
+        pass
+
+try:
+    import micropython
+
+    # Hard IRQ handlers cannot allocate, so reserve room for their tracebacks
+    micropython.alloc_emergency_exception_buf(100)
+except (ImportError, AttributeError):
+    pass
+
+try:
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+    _ticks_add = time.ticks_add
+except AttributeError:
+    # CPython has no ticks_*; emulate MicroPython's 30-bit wrapping ticks
+    _TICKS_MAX = (1 << 30) - 1
+
+    def _ticks_us():
+        return int(time.monotonic() * 1000000) & _TICKS_MAX
+
+    def _ticks_diff(a, b):
+        d = (a - b) & _TICKS_MAX
+        return d - _TICKS_MAX - 1 if d > (_TICKS_MAX >> 1) else d
+
+    def _ticks_add(a, b):
+        return (a + b) & _TICKS_MAX
+
+# Default glitch filter when no per-channel spacing is configured (microseconds)
+DEFAULT_MIN_PULSE_US = 2000
+
+# Raw counters are 32-bit and wrap; all differences are taken modulo 2**32
+_COUNT_MASK = 0xFFFFFFFF
+_SEQ_MASK = 0x3FFFFFFF
+
+# Recent (timestamp, count) samples kept per channel for period-based rates (power of 2)
+EDGE_RING_SIZE = 8
+_RING_MASK = EDGE_RING_SIZE - 1
+
+# Rate window: samples older than this relative to the newest are ignored, and a
+# channel with no edge for this long reads 0
+RATE_WINDOW_US = 2000000
+
+
+def _zeros(n):
+    return array("L", [0] * n)
+
+
+class CounterEngine:
+    """
+    Pulse-counting backend used by FlowMeters.
+    Engines only ever count up: raw totals since boot, one per channel. Resets are
+    offsets kept by FlowMeters, so nothing is swapped out from under an ISR.
+    """
+
+    name = "none"
+
+    def __init__(self, pins, min_pulse_us):
         self._pins = pins
-        self._counts = [0] * len(pins)
-        self._last_time = [0] * len(pins)
-        self._meters = []
-        
-        # Setup GPIO pins with pull-up and interrupts
+        self._min_us = min_pulse_us
+        n = len(pins)
+        # Per-channel ring of (ticks_us, raw count) samples, newest at head - 1
+        self._ring_t = _zeros(n * EDGE_RING_SIZE)
+        self._ring_c = _zeros(n * EDGE_RING_SIZE)
+        self._ring_head = _zeros(n)
+        self._ring_len = _zeros(n)
+
+    def _stamp(self, meter_id, t, count):
+        """Record a sample; called from the ISR, so it must not allocate"""
+        h = self._ring_head[meter_id]
+        j = meter_id * EDGE_RING_SIZE + h
+        self._ring_t[j] = t
+        self._ring_c[j] = count
+        self._ring_head[meter_id] = (h + 1) & _RING_MASK
+        if self._ring_len[meter_id] < EDGE_RING_SIZE:
+            self._ring_len[meter_id] += 1
+
+    def edge_span(self, meter_id, max_age_us=RATE_WINDOW_US):
+        """
+        Summarize the recent samples of one channel as (pulses, span_us, since_us):
+        pulses counted between the oldest usable and the newest sample, the time
+        between them, and the time from the newest to when the counts were last
+        checked (checked_us()). None with fewer than 2 samples.
+        """
+        state = disable_irq()
+        n = self._ring_len[meter_id]
+        base = meter_id * EDGE_RING_SIZE
+        newest = base + ((self._ring_head[meter_id] - 1) & _RING_MASK)
+        t_new = self._ring_t[newest]
+        c_new = self._ring_c[newest]
+        t_old = t_new
+        c_old = c_new
+        for k in range(2, n + 1):
+            j = base + ((self._ring_head[meter_id] - k) & _RING_MASK)
+            age = _ticks_diff(t_new, self._ring_t[j])
+            if age < 0 or age > max_age_us:
+                break
+            t_old = self._ring_t[j]
+            c_old = self._ring_c[j]
+        enable_irq(state)
+        span = _ticks_diff(t_new, t_old)
+        if span <= 0:
+            return None
+        return (c_new - c_old) & _COUNT_MASK, span, _ticks_diff(self.checked_us(), t_new)
+
+    def channels(self):
+        return len(self._pins)
+
+    def raw(self, meter_id):
+        return 0
+
+    def raw_into(self, buf):
+        """Copy all raw totals into buf in one consistent read, without allocating"""
+        for i in range(len(self._pins)):
+            buf[i] = self.raw(i)
+
+    def rejects(self):
+        """Pulses dropped by the glitch filter, per channel (0 if the engine cannot tell)"""
+        return [0] * len(self._pins)
+
+    def now_us(self):
+        return _ticks_us()
+
+    def checked_us(self):
+        """Time up to which no edge can be missing from the ring (now, with per-edge stamps)"""
+        return self.now_us()
+
+    def poll(self):
+        """Periodic housekeeping for engines that sample hardware (no-op for IRQ engines)"""
+        pass
+
+    def deinit(self):
+        pass
+
+
+class IrqEngine(CounterEngine):
+    """One hard Pin.irq per channel, filtered on ticks_us. The ISR path never allocates."""
+
+    name = "irq"
+
+    def __init__(self, pins, min_pulse_us):
+        super().__init__(pins, min_pulse_us)
+        n = len(pins)
+        self._counts = _zeros(n)
+        # Last accepted edge per channel; start "long ago" so the first edge is never filtered
+        self._last_time = array("L", [_ticks_add(self.now_us(), -(1 << 28))] * n)
+        self._rejects = _zeros(n)
+        self._min_us = array("L", min_pulse_us)
+        self._meters = ()
+        self._attach()
+
+    def _attach(self):
+        if Pin is None:
+            raise OSError("machine.Pin not available")
+        # Setup GPIO pins with pull-up and interrupts. One bound handler is shared by
+        # every pin; it finds the channel by identity instead of holding a closure.
+        self._meters = tuple(Pin(pin_num, Pin.IN, Pin.PULL_UP) for pin_num in self._pins)
+        for pin in self._meters:
+            pin.irq(trigger=Pin.IRQ_FALLING, handler=self._pulse_handler, hard=True)
+
+    def _pulse_handler(self, pin):
+        """Handle pulse interrupt with glitch filtering"""
+        now = _ticks_us()
+        meters = self._meters
+        for i in range(len(meters)):
+            if meters[i] is pin:
+                self._edge(i, now)
+                return
+
+    def _edge(self, meter_id, current_time):
+        # Reject edges closer than the channel's minimum spacing. A negative diff means the
+        # last pulse was long enough ago for ticks_us to wrap, so it is always accepted.
+        dt = _ticks_diff(current_time, self._last_time[meter_id])
+        if 0 <= dt < self._min_us[meter_id]:
+            self._rejects[meter_id] += 1
+            return
+        c = self._counts[meter_id] + 1
+        self._counts[meter_id] = c
+        self._last_time[meter_id] = current_time
+        self._stamp(meter_id, current_time, c)
+
+    def raw(self, meter_id):
+        return self._counts[meter_id]
+
+    def raw_into(self, buf):
+        counts = self._counts
+        state = disable_irq()
+        for i in range(len(counts)):
+            buf[i] = counts[i]
+        enable_irq(state)
+
+    def last_edge_us(self, meter_id):
+        """ticks_us of the last accepted edge"""
+        return self._last_time[meter_id]
+
+    def rejects(self):
+        return list(self._rejects)
+
+    def deinit(self):
+        for pin in self._meters:
+            pin.irq(handler=None)
+        self._meters = ()
+
+
+class SimEngine(IrqEngine):
+    """
+    Software-only engine with a virtual microsecond clock. Edges are injected with
+    pulse() and go through the same glitch filter as the IRQ engine.
+    """
+
+    name = "sim"
+
+    def __init__(self, pins, min_pulse_us):
+        self._now = 0
+        super().__init__(pins, min_pulse_us)
+
+    def _attach(self):
+        pass
+
+    def now_us(self):
+        return self._now
+
+    def advance(self, us):
+        """Move the virtual clock forward"""
+        self._now = _ticks_add(self._now, int(us))
+
+    def pulse(self, meter_id, count=1, period_us=0):
+        """Inject count falling edges on a channel, period_us apart on the virtual clock"""
+        for k in range(count):
+            if k:
+                self.advance(period_us)
+            self._edge(meter_id, self._now)
+
+
+# rp2 register map for the PWM edge counters (RP2040 datasheet, sections 2.19 and 4.5)
+_PWM_BASE = 0x40050000
+_PWM_SLICE_STRIDE = 0x14
+_PWM_CSR = 0x00
+_PWM_DIV = 0x04
+_PWM_CTR = 0x08
+_PWM_TOP = 0x10
+_PWM_CSR_EN = 0x01
+_PWM_DIVMODE_FALL = 3 << 4
+_IO_BANK0_BASE = 0x40014000
+_GPIO_FUNC_PWM = 4
+
+# PIO state machines claimed for channels without a PWM B input. PIO1 is left alone
+# because the Pico W wireless driver uses it.
+_PIO_SM_IDS = (0, 1, 2, 3)
+
+_HW_POLL_MS = 100
+
+_pio_edge_counter = None
+
+
+def _pio_program():
+    """Falling-edge counter: decrements X per edge, then holds off ~1024 cycles (glitch filter)"""
+    global _pio_edge_counter
+    if _pio_edge_counter is None:
+        import rp2
+
+        @rp2.asm_pio()
+        def edge_counter():
+            wrap_target()
+            wait(1, pin, 0)
+            wait(0, pin, 0)
+            jmp(x_dec, "hold")
+            label("hold")
+            set(y, 31)
+            label("delay")
+            jmp(y_dec, "delay")[31]
+            wrap()
+
+        _pio_edge_counter = edge_counter
+    return _pio_edge_counter
+
+
+class HardwareEngine(CounterEngine):
+    """
+    Counts in hardware so pulses are never lost to Python ISR latency or GC pauses.
+    Odd GPIOs are PWM B inputs: the slice counter runs in falling-edge mode (16-bit,
+    extended to 32 bits by polling). Other pins get a PIO state machine whose X register
+    counts down per edge. A soft timer polls often enough that the PWM counters cannot
+    wrap unseen. Glitch filtering: PIO channels hold off for their configured spacing;
+    PWM channels count every edge. Rejects are not observable on this engine.
+    """
+
+    name = "hw"
+
+    def __init__(self, pins, min_pulse_us):
+        super().__init__(pins, min_pulse_us)
+        import machine
+        import rp2
+
+        self._mem32 = machine.mem32
+        n = len(pins)
+        self._kind = [None] * n  # ("pwm", slice base address) or ("pio", StateMachine)
+        self._total = _zeros(n)  # PWM: 16-bit counter extended by polling
+        self._last16 = _zeros(n)
+        self._busy = False
+        self._checked_us = _ticks_us()
+        # Pre-encoded so reading a PIO counter does not compile (allocate) each time
+        self._op_mov = rp2.asm_pio_encode("mov(isr, invert(x))", 0)
+        self._op_push = rp2.asm_pio_encode("push(noblock)", 0)
+
+        sm_ids = list(_PIO_SM_IDS)
         for i, pin_num in enumerate(pins):
-            pin = Pin(pin_num, Pin.IN, Pin.PULL_UP)
-            pin.irq(trigger=Pin.IRQ_FALLING, handler=lambda p, idx=i: self._pulse_handler(idx))
-            self._meters.append(pin)
-        
-        print(f"Flow meters initialized: {len(pins)} channels (v4-18-2026-v1.2)")
-    
-    def _pulse_handler(self, meter_id):
-        """Handle pulse interrupt with debouncing"""
-        current_time = time.ticks_ms()
-        
-        # Debounce: ignore pulses within 50ms
-        if time.ticks_diff(current_time, self._last_time[meter_id]) > 50:
-            self._counts[meter_id] += 1
-            self._last_time[meter_id] = current_time
-    
+            if pin_num % 2 == 1 and pin_num < 30:
+                self._kind[i] = ("pwm", self._setup_pwm(pin_num))
+            else:
+                if not sm_ids:
+                    self.deinit()
+                    raise ValueError("no free PIO state machine for GP%d" % pin_num)
+                self._kind[i] = ("pio", self._setup_pio(sm_ids.pop(0), pin_num, min_pulse_us[i], rp2))
+
+        # The poll feeds the rate ring and keeps PWM counters from wrapping unseen
+        # (65536 pulses); there are no per-edge timestamps on this engine.
+        self._timer = machine.Timer(-1)
+        self._timer.init(period=_HW_POLL_MS, mode=machine.Timer.PERIODIC, callback=self._poll_cb)
+
+    def _setup_pwm(self, pin_num):
+        Pin(pin_num, Pin.IN, Pin.PULL_UP)
+        slice_num = (pin_num >> 1) & 7
+        base = _PWM_BASE + slice_num * _PWM_SLICE_STRIDE
+        self._mem32[base + _PWM_CSR] = 0
+        self._mem32[base + _PWM_DIV] = 1 << 4  # integer divider 1
+        self._mem32[base + _PWM_TOP] = 0xFFFF
+        self._mem32[base + _PWM_CTR] = 0
+        self._mem32[_IO_BANK0_BASE + 8 * pin_num + 4] = _GPIO_FUNC_PWM
+        self._mem32[base + _PWM_CSR] = _PWM_DIVMODE_FALL | _PWM_CSR_EN
+        return base
+
+    def _setup_pio(self, sm_id, pin_num, min_us, rp2):
+        pin = Pin(pin_num, Pin.IN, Pin.PULL_UP)
+        # ~1024 cycles per hold-off: run the SM at 1024 cycles per min spacing
+        freq = 125_000_000 if min_us <= 8 else max(2000, 1_024_000_000 // min_us)
+        sm = rp2.StateMachine(sm_id, _pio_program(), freq=min(freq, 125_000_000), in_base=pin)
+        # X counts down from 0xFFFFFFFF, so invert(X) is the edge count
+        sm.exec("mov(x, invert(null))")
+        sm.active(1)
+        return sm
+
+    def _read(self, i):
+        kind, hw = self._kind[i]
+        if kind == "pio":
+            hw.exec(self._op_mov)
+            hw.exec(self._op_push)
+            return hw.get()
+        cur = self._mem32[hw + _PWM_CTR] & 0xFFFF
+        self._total[i] = (self._total[i] + ((cur - self._last16[i]) & 0xFFFF)) & _COUNT_MASK
+        self._last16[i] = cur
+        return self._total[i]
+
+    def _poll_cb(self, _t):
+        # Soft timer callback; skip if the main code is already mid-read
+        if self._busy:
+            return
+        now = _ticks_us()
+        for i in range(len(self._kind)):
+            c = self._read(i)
+            last = self._ring_c[i * EDGE_RING_SIZE + ((self._ring_head[i] - 1) & _RING_MASK)]
+            if c != last or not self._ring_len[i]:
+                self._stamp(i, now, c)
+        self._checked_us = now
+
+    def checked_us(self):
+        # Samples are taken per poll, not per edge: edges since the last poll are not
+        # in the ring yet, so "no edge since" only holds up to the last poll
+        return self._checked_us
+
+    def poll(self):
+        self._poll_cb(None)
+
+    def raw(self, meter_id):
+        self._busy = True
+        try:
+            return self._read(meter_id)
+        finally:
+            self._busy = False
+
+    def raw_into(self, buf):
+        self._busy = True
+        try:
+            for i in range(len(self._kind)):
+                buf[i] = self._read(i)
+        finally:
+            self._busy = False
+
+    def deinit(self):
+        t = getattr(self, "_timer", None)
+        if t:
+            t.deinit()
+        for k in self._kind:
+            if k and k[0] == "pio":
+                k[1].active(0)
+            elif k:
+                self._mem32[k[1] + _PWM_CSR] = 0
+
+
+ENGINES = {"irq": IrqEngine, "hw": HardwareEngine, "sim": SimEngine}
+
+
+def make_engine(name, pins, min_pulse_us):
+    """Build a counting engine by name, falling back to "irq" (or "sim" off-device)"""
+    try:
+        return ENGINES[name](pins, min_pulse_us)
+    except KeyError:
+        print(f"Unknown flow meter engine '{name}', using irq")
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Flow meter engine '{name}' unavailable ({e})")
+    if Pin is None:
+        return SimEngine(pins, min_pulse_us)
+    return IrqEngine(pins, min_pulse_us)
+
+
+class FlowMeters:
+    def __init__(self, pins, min_pulse_us=None, engine="irq"):
+        self._pins = pins
+
+        # Per-channel minimum pulse spacing (us); a single int applies to every channel
+        if min_pulse_us is None:
+            min_pulse_us = DEFAULT_MIN_PULSE_US
+        if isinstance(min_pulse_us, int):
+            self._min_us = [min_pulse_us] * len(pins)
+        else:
+            self._min_us = [int(v) for v in min_pulse_us]
+            while len(self._min_us) < len(pins):
+                self._min_us.append(DEFAULT_MIN_PULSE_US)
+
+        # engine: a name from ENGINES or an already-built CounterEngine
+        if isinstance(engine, str):
+            engine = make_engine(engine, pins, self._min_us)
+        self._engine = engine
+
+        # count = raw - offset; a reset just moves the offset
+        self._offset = _zeros(len(pins))
+        self._resets = 0
+
+        print(f"Flow meters initialized: {len(pins)} channels, {engine.name} engine (v4-18-2026-v1.2)")
+
+    @property
+    def engine(self):
+        return self._engine
+
+    @property
+    def channels(self):
+        return len(self._pins)
+
+    def poll(self):
+        """Let the engine sample its counters; call often from the main loop"""
+        self._engine.poll()
+
+    def new_buffer(self):
+        """Preallocate a per-channel buffer for snapshot_into() / deltas_since()"""
+        return _zeros(len(self._pins))
+
     def get_count(self, meter_id):
         """Get pulse count for specific meter"""
-        if 0 <= meter_id < len(self._counts):
-            return self._counts[meter_id]
+        if 0 <= meter_id < len(self._pins):
+            return (self._engine.raw(meter_id) - self._offset[meter_id]) & _COUNT_MASK
         return 0
-    
+
     def get_all_counts(self):
         """Get all meter counts"""
-        return self._counts.copy()
-    
+        buf = self.new_buffer()
+        self.snapshot_into(buf)
+        return list(buf)
+
+    def snapshot_into(self, buf):
+        """
+        Fill buf with the count of every channel, read in one IRQ-masked pass so the
+        channels are consistent with each other. Allocates nothing. Returns the
+        sequence number, which changes whenever any count changes.
+        """
+        self._engine.raw_into(buf)
+        offset = self._offset
+        seq = self._resets
+        for i in range(len(offset)):
+            r = buf[i]
+            seq += r
+            buf[i] = (r - offset[i]) & _COUNT_MASK
+        return seq & _SEQ_MASK
+
+    def new_cursor(self):
+        """Return (seq, base) positioned at the current counts, for deltas_since()"""
+        base = self.new_buffer()
+        self._engine.raw_into(base)
+        seq = self._resets
+        for i in range(len(base)):
+            seq += base[i]
+        return seq & _SEQ_MASK, base
+
+    def deltas_since(self, seq, base, out):
+        """
+        Pulses counted per channel since the cursor (seq, base) from new_cursor() or a
+        previous call. base is advanced in place and out receives the deltas; resets do
+        not produce negative deltas. Returns the new seq. When nothing has changed, out
+        is zeroed and seq comes back unchanged. Allocates nothing.
+        """
+        self._engine.raw_into(out)
+        cur = self._resets
+        for i in range(len(base)):
+            cur += out[i]
+        cur &= _SEQ_MASK
+        if cur == seq:
+            for i in range(len(out)):
+                out[i] = 0
+            return seq
+        for i in range(len(base)):
+            r = out[i]
+            out[i] = (r - base[i]) & _COUNT_MASK
+            base[i] = r
+        return cur
+
+    def get_rate_hz(self, meter_id):
+        """
+        Instantaneous pulse rate (pulses/s) from the periods between recent edges.
+        Usable within a few pulses of a pump starting; once edges stop arriving the
+        time since the last one caps the rate (only once it is longer than the mean
+        period), and it reads 0 after RATE_WINDOW_US.
+        """
+        if not 0 <= meter_id < len(self._pins):
+            return 0.0
+        span = self._engine.edge_span(meter_id)
+        if not span:
+            return 0.0
+        pulses, span_us, since_us = span
+        if since_us > RATE_WINDOW_US:
+            return 0.0
+        return 1000000 * min(pulses / span_us, 1 / max(since_us, 1))
+
+    def get_rate_gpm(self, meter_id, pulses_per_gallon=450):
+        """Instantaneous flow rate in gal/min (see get_rate_hz)"""
+        return self.get_rate_hz(meter_id) * 60 / pulses_per_gallon
+
+    def get_rejects(self, meter_id):
+        """Get number of pulses dropped by the glitch filter for specific meter"""
+        if 0 <= meter_id < len(self._pins):
+            return self._engine.rejects()[meter_id]
+        return 0
+
+    def get_all_rejects(self):
+        """Get glitch filter reject counts for all meters (since boot)"""
+        return self._engine.rejects()
+
+    def edges_into(self, edges, rejects):
+        """
+        Raw edges seen per channel since boot (accepted + rejected: the ISR run count
+        with the irq engine) and glitch rejects, into two new_buffer() arrays
+        """
+        self._engine.raw_into(edges)
+        r = self._engine.rejects()
+        for i in range(len(self._pins)):
+            rejects[i] = r[i]
+            edges[i] = (edges[i] + r[i]) & 0xFFFFFFFF
+
+    def get_min_pulse_us(self):
+        """Get per-channel glitch filter spacing in microseconds"""
+        return self._min_us.copy()
+
     def reset_meter(self, meter_id):
         """Reset specific meter"""
-        if 0 <= meter_id < len(self._counts):
-            self._counts[meter_id] = 0
+        if 0 <= meter_id < len(self._pins):
+            self._offset[meter_id] = self._engine.raw(meter_id)
+            self._resets += 1
             print(f"Reset meter {meter_id}")
-    
+
     def reset_all(self):
         """Reset all meters"""
-        self._counts = [0] * len(self._counts)
+        self._engine.raw_into(self._offset)
+        self._resets += 1
         print("Reset all meters")
 
+    def set_counts(self, counts):
+        """Set every meter's count, e.g. restored from a checkpoint after a reboot"""
+        raw = self.new_buffer()
+        self._engine.raw_into(raw)
+        for i in range(len(self._offset)):
+            self._offset[i] = (raw[i] - counts[i]) & _COUNT_MASK
+        self._resets += 1
+
 
 class FlowMeterManager:
     """Used by main_wifi.py (WiFi web server). Wraps FlowMeters with that API."""
@@ -59,11 +609,27 @@ class FlowMeterManager:
     def __init__(self):
         import config
 
-        self._fm = FlowMeters(config.FLOW_METER_PINS)
+        self._fm = FlowMeters(
+            config.FLOW_METER_PINS,
+            getattr(config, "FLOW_METER_MIN_PULSE_US", None),
+            getattr(config, "FLOW_METER_ENGINE", "irq"),
+        )
+
+    @property
+    def meters(self):
+        """The underlying FlowMeters (snapshot_into / deltas_since)"""
+        return self._fm
 
     def get_all_pulse_counts(self):
         return self._fm.get_all_counts()
 
+    def get_all_reject_counts(self):
+        return self._fm.get_all_rejects()
+
+    def get_all_flow_rates(self, pulses_per_gallon):
+        """Instantaneous gal/min per meter, from pulse periods"""
+        return [self._fm.get_rate_gpm(i, pulses_per_gallon) for i in range(self._fm.channels)]
+
     def reset_counter(self, meter_id):
         self._fm.reset_meter(meter_id)
 
@@ -0,0 +1,123 @@
+"""
+Flow Rate Tracker
+Version: 4-19-2026-v1.3
+Per-channel flow rates averaged over a fixed window of samples (WiFi mode "avg_rates")
+"""
+
+import time
+from array import array
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # CPython host (sim engine): monotonic ms, no wrap to worry about
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+class FlowRateTracker:
+    """
+    Samples FlowMeters.deltas_since() once per period into fixed ring buffers.
+    Running sums make every rate read O(1); nothing is allocated per sample.
+    Rates come from pulse counts and real elapsed time, so a late sample does not
+    skew them. With ewma_alpha set, rate reads use an exponentially weighted
+    average instead of the window average.
+    """
+
+    def __init__(self, flow_meters, window=5, period_ms=1000, ewma_alpha=None):
+        n = flow_meters.channels
+        self._fm = flow_meters
+        self._n = n
+        self._window = window
+        self._period_ms = period_ms
+        self._alpha = ewma_alpha
+
+        # Ring of per-sample pulse counts (channel-major) and sample durations (ms)
+        self._pulses = array("L", [0] * (n * window))
+        self._dt = array("L", [0] * window)
+        self._sum = array("L", [0] * n)
+        self._dt_sum = 0
+        self._head = 0
+        self._len = 0
+        self._ewma = array("f", [0.0] * n)  # pulses/s
+
+        self._delta = flow_meters.new_buffer()
+        self._seq, self._base = flow_meters.new_cursor()
+        self._last_ms = ticks_ms()
+
+    @property
+    def period_ms(self):
+        return self._period_ms
+
+    def tick(self, now_ms=None):
+        """Take a sample if a period has elapsed. Safe to call as often as you like."""
+        if now_ms is None:
+            now_ms = ticks_ms()
+        if ticks_diff(now_ms, self._last_ms) < self._period_ms:
+            return False
+        self.sample(now_ms)
+        return True
+
+    def sample(self, now_ms=None):
+        """Push one sample (pulses since the previous sample) into every channel's window"""
+        if now_ms is None:
+            now_ms = ticks_ms()
+        dt = ticks_diff(now_ms, self._last_ms)
+        if dt <= 0:
+            return
+        self._last_ms = now_ms
+        self._seq = self._fm.deltas_since(self._seq, self._base, self._delta)
+
+        w = self._window
+        h = self._head
+        if self._len == w:
+            # Evict the oldest sample from the running sums
+            self._dt_sum -= self._dt[h]
+            for i in range(self._n):
+                self._sum[i] -= self._pulses[i * w + h]
+        else:
+            self._len += 1
+
+        self._dt[h] = dt
+        self._dt_sum += dt
+        alpha = self._alpha
+        for i in range(self._n):
+            d = self._delta[i]
+            self._pulses[i * w + h] = d
+            self._sum[i] += d
+            if alpha:
+                self._ewma[i] += alpha * (d * 1000 / dt - self._ewma[i])
+        self._head = (h + 1) % w
+
+    def ready(self):
+        """True once a full window of samples has been collected"""
+        return self._len >= self._window
+
+    def rate_hz(self, meter_id):
+        """Average pulses/s over the window (or EWMA)"""
+        if self._alpha:
+            return self._ewma[meter_id]
+        if not self._dt_sum:
+            return 0.0
+        return self._sum[meter_id] * 1000 / self._dt_sum
+
+    def rate_gpm(self, meter_id, pulses_per_gallon):
+        """Average gal/min over the window (or EWMA)"""
+        return self.rate_hz(meter_id) * 60 / pulses_per_gallon
+
+    def is_running(self, meter_id, pulses_per_gallon, min_rate):
+        return self.rate_gpm(meter_id, pulses_per_gallon) > min_rate
+
+    def reset(self):
+        """Forget all samples (rates read 0 until the window refills)"""
+        for i in range(len(self._pulses)):
+            self._pulses[i] = 0
+        for i in range(self._n):
+            self._sum[i] = 0
+            self._ewma[i] = 0.0
+        self._dt_sum = 0
+        self._head = 0
+        self._len = 0
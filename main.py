@@ -4,6 +4,24 @@ Version: 4-19-2026-v1.3
 Routes to WiFi or BLE mode based on config
 """
 
+# Firmware bundles: finish an interrupted install, roll back a release that failed its
+# trial boots, or start the trial timer (cleared by ota.mark_good() once ready).
+# Then prefer precompiled .mpy modules (mpy/) over compiling the .py sources.
+# This runs before anything else is imported, so a bundle that breaks any other module
+# (boottime.py included) still fails inside the trial and is rolled back.
+try:
+    import ota
+    ota.boot_check()
+    ota.use_bytecode()
+except Exception as _e:
+    print("OTA boot check:", _e)
+
+# Boot phases are timed from power-on to "ready" (boottime.py, config.BOOT_BUDGET_MS);
+# on the Pico that includes the OTA check above
+import boottime
+
+boottime.mark("ota")
+
 # One-shot WiFi session: BLE command 0x04 creates wifi_once.flag then reboots.
 # Next boot runs main_wifi once; flag is removed so following boots use config.MODE (default "ble").
 try:
@@ -26,20 +44,25 @@ import config
 print(f"Ballast Monitor v{config.VERSION}")
 print("=" * 50)
 print(f"Mode: {config.MODE.upper()}")
+boottime.mark("config")
 
-# Print file versions
-print("File Versions:")
-for fname in ["ble_service.py", "main.py", "main_wifi.py", "config.py", "ble_advertising.py", "flow_meters.py"]:
-    try:
-        v = config.read_py_file_version(fname)
-        print(f"  {fname}: {v}")
-    except Exception:
-        print(f"  {fname}: Not found")
 
-print("=" * 50)
+def print_file_versions():
+    """Version banner (from the saved device manifest; files are only read if changed)"""
+    print("File Versions:")
+    try:
+        installed = ota.device_manifest(config.UPDATE_FILES)
+    except Exception as e:
+        print(f"  (manifest unavailable: {e})")
+        installed = {fn: {"version": config.read_py_file_version(fn)} for fn in config.UPDATE_FILES}
+    for fname in config.UPDATE_FILES:
+        entry = installed.get(fname)
+        print(f"  {fname}: {entry['version'] if entry else 'Not found'}")
+    print("=" * 50)
 
 # Route to appropriate mode
 if config.MODE == "wifi":
+    print_file_versions()
     import main_wifi
     main_wifi.run()
 elif config.MODE == "ble":
@@ -47,29 +70,114 @@ elif config.MODE == "ble":
     from ble_service import BLEService
     from ble_advertising import BLEAdvertising
     from flow_meters import FlowMeters
-    import time
+    from pump_alerts import PumpAlertEngine
+    from scheduler import Scheduler
+    from checkpoint import CheckpointStore
+    from diagnostics import Diagnostics
+    import settings_store
     
     print("Starting BLE mode...")
+    boottime.mark("imports")
+    
+    # Calibration and tank sizes are edited in WiFi mode; BLE mode uses them for telemetry
+    settings = settings_store.load_settings()
     
     print("Initializing flow meters...")
-    flow_meters = FlowMeters(config.FLOW_METER_PINS)
+    flow_meters = FlowMeters(
+        config.FLOW_METER_PINS, config.FLOW_METER_MIN_PULSE_US, config.FLOW_METER_ENGINE
+    )
+    
+    checkpoints = CheckpointStore(
+        flow_meters,
+        files=config.CHECKPOINT_FILES,
+        records_per_file=config.CHECKPOINT_RECORDS_PER_FILE,
+        period_ms=config.CHECKPOINT_PERIOD_MS,
+        min_ms=config.CHECKPOINT_MIN_MS,
+        delta=config.CHECKPOINT_DELTA,
+    )
+    checkpoints.restore()
+    boottime.mark("meters")
+    
+    # Instantaneous (period-based) rates for alerts and BLE telemetry, so a failed
+    # pump is flagged within seconds and the app shows a stop right away
+    def rate_gpm(i):
+        return flow_meters.get_rate_gpm(i, settings["pulses_per_gallon"])
+    
+    alert_engine = PumpAlertEngine(
+        rate_gpm,
+        config.TANKS,
+        config.TANK_ORDER,
+        config.MIN_FLOW_RATE,
+        config.ALERT_OFF_RATE,
+        config.ALERT_RAISE_MS,
+        config.ALERT_CLEAR_MS,
+    )
+    
+    tank_pumps = [config.TANKS[key]["pumps"] for key in config.TANK_ORDER]
+    
+    def tank_level(k, counts):
+        pumps = tank_pumps[k]
+        total = counts[pumps[0]] + counts[pumps[1]]
+        return settings_store.tank_percent(settings, config.TANK_ORDER[k], total)
     
     print("Starting BLE service...")
     ble = bluetooth.BLE()
     ble.active(True)
     
-    ble_service = BLEService(ble, flow_meters, config.VERSION)
+    ble_service = BLEService(
+        ble,
+        flow_meters,
+        config.VERSION,
+        config.BLE_NOTIFY_ACTIVE_MS,
+        config.BLE_NOTIFY_IDLE_MS,
+        config.BLE_NOTIFY_KEEPALIVE_MS,
+        rate_fn=rate_gpm,
+        level_fn=tank_level,
+        manifest_fn=lambda: ota.device_manifest(config.UPDATE_FILES),
+    )
+    
+    ble_service.before_reset = checkpoints.flush
+    boottime.mark("ble")
     
     advertising = BLEAdvertising(ble, config.BLE_DEVICE_NAME)
     advertising.start_advertising(services=[bluetooth.UUID(0x181A)])
     
     print("System ready!")
+    boottime.mark("ready")
+    try:
+        ota.mark_good()
+    except Exception as e:
+        print("OTA confirm:", e)
     print("Connect with BLE app")
     print(f"Device name: {config.BLE_DEVICE_NAME}")
     print("=" * 50)
+    # Reporting waits until the device is already advertising
+    boottime.report(config.BOOT_BUDGET_MS.get("ble"))
+    ble_service.set_boot_timeline(boottime.encode())
+    print_file_versions()
+    
+    def check_alerts():
+        if alert_engine.evaluate():
+            ble_service.set_alerts(alert_engine.bits)
+    
+    def housekeeping():
+        diagnostics.collect()
+        ble_service.set_diagnostics(diagnostics.pack())
+        scheduler.report()
     
-    while True:
-        ble_service.update_flow_values()
-        time.sleep_ms(100)
+    # Independent periodic tasks instead of one 100 ms loop
+    scheduler = Scheduler()
+    diagnostics = Diagnostics(flow_meters, scheduler, lambda: ble_service.notify_failures)
+    jobs = {
+        "sample": flow_meters.poll,
+        "notify": ble_service.update_flow_values,
+        "alerts": check_alerts,
+        "persist": checkpoints.tick,
+        "housekeeping": housekeeping,
+    }
+    for name, fn in jobs.items():
+        period_ms, deadline_ms = config.TASK_SCHEDULE[name]
+        scheduler.add(name, fn, period_ms, deadline_ms)
+    scheduler.run()
 else:
     print(f"Unknown mode: {config.MODE}")
@@ -4,31 +4,28 @@ Version: 4-19-2026-v1.3
 Features: iOS-aligned UI, settings on Pico, pump alerts, GitHub OTA
 """
 
+import boottime
 import network
-import socket
-from time import sleep, time
+from time import sleep
 import json
-import urequests
+from binascii import crc32
 from config import *
+# urequests is imported by the functions that use it (installing updates); serving
+# pages does not need it, and background requests use _fetch() on asyncio streams
+
+from flow_meters import FlowMeterManager
+from flow_rate import FlowRateTracker
+from pump_alerts import PumpAlertEngine
+from checkpoint import CheckpointStore
+from scheduler import Scheduler
+import ota
+import settings_store
+from settings_store import default_settings
 
 try:
-    from flow_meters import FlowMeterManager
+    import asyncio
 except ImportError:
-    # Older flow_meters.py on device had only FlowMeters
-    from flow_meters import FlowMeters
-
-    class FlowMeterManager:
-        def __init__(self):
-            self._fm = FlowMeters(FLOW_METER_PINS)
-
-        def get_all_pulse_counts(self):
-            return self._fm.get_all_counts()
-
-        def reset_counter(self, meter_id):
-            self._fm.reset_meter(meter_id)
-
-        def reset_all_counters(self):
-            self._fm.reset_all()
+    import uasyncio as asyncio
 
 try:
     from urllib.parse import quote_plus, unquote_plus
@@ -39,79 +36,16 @@ except ImportError:
     def unquote_plus(s):
         return str(s).replace("+", " ")
 
-# Global settings — extended to match iOS app + ballast_settings.json on flash
-def _default_settings():
-    return {
-        "pulses_per_gallon": PULSES_PER_GALLON,
-        "pounds_per_gallon": POUNDS_PER_GALLON,
-        "unit_mode": "gallons",
-        "show_pounds": False,
-        "is_fill_mode": True,
-        "tank_fill": {"Port": True, "Starboard": True, "Mid": True, "Forward": True},
-        "tank_max": {"port": 10000, "starboard": 10000, "mid": 10000, "forward": 5000},
-        "calibration": [0] * 8,
-    }
-
-
-settings = _default_settings()
-
-# Flow rate tracking for alerts
-flow_history = {i: [] for i in range(8)}  # Last 5 seconds of flow data
-
-
-def migrate_settings(s):
-    """Merge legacy calibration-only settings into tank_max + unit_mode."""
-    d = _default_settings()
-    for k, v in d.items():
-        if k not in s:
-            s[k] = v
-    if "tank_max" not in s or not isinstance(s.get("tank_max"), dict):
-        s["tank_max"] = d["tank_max"].copy()
-    for key in ("port", "starboard", "mid", "forward"):
-        if key not in s["tank_max"]:
-            s["tank_max"][key] = d["tank_max"][key]
-    cal = s.get("calibration")
-    if not isinstance(cal, list) or len(cal) < 8:
-        s["calibration"] = [0] * 8
-    if "unit_mode" not in s:
-        s["unit_mode"] = "pounds" if s.get("show_pounds") else "gallons"
-    um = s["unit_mode"]
-    if um == "pounds":
-        s["show_pounds"] = True
-    elif um in ("gallons", "counter"):
-        s["show_pounds"] = False
-    if "is_fill_mode" not in s:
-        s["is_fill_mode"] = True
-    if "tank_fill" not in s or not isinstance(s.get("tank_fill"), dict):
-        s["tank_fill"] = d["tank_fill"].copy()
-    for tn in ("Port", "Starboard", "Mid", "Forward"):
-        if tn not in s["tank_fill"]:
-            s["tank_fill"][tn] = True
-    if "pounds_per_gallon" not in s:
-        s["pounds_per_gallon"] = POUNDS_PER_GALLON
-    return s
+settings = default_settings()
 
 
 def load_settings():
     global settings
-    try:
-        with open("ballast_settings.json", "r") as f:
-            settings = json.load(f)
-        settings = migrate_settings(settings)
-        print("Loaded saved settings")
-    except Exception:
-        print("No saved settings, using defaults")
-        settings = _default_settings()
-        save_settings()
+    settings = settings_store.load_settings()
 
 
 def save_settings():
-    try:
-        with open("ballast_settings.json", "w") as f:
-            json.dump(settings, f)
-        print("Settings saved")
-    except Exception as e:
-        print(f"Error saving settings: {e}")
+    settings_store.save_settings(settings)
 
 
 def settings_for_api():
@@ -199,17 +133,9 @@ def format_pump_display(pump_idx, tank_name, counts):
 
 
 def get_tank_percent_display(tank_name, counts):
-    tm = settings["tank_max"].get(tank_name.lower(), 0)
-    if not tm:
-        return 0
-    total = get_tank_total_pulses(tank_name, counts)
-    fill = min(1.0, total / tm) if tm else 0
-    drain = not settings["tank_fill"].get(tank_name, True)
-    if drain:
-        pct = round((1 - fill) * 100)
-    else:
-        pct = round(fill * 100)
-    return max(0, min(100, pct))
+    return settings_store.tank_percent(
+        settings, tank_name.lower(), get_tank_total_pulses(tank_name, counts)
+    )
 
 
 def format_total_line(counts):
@@ -228,11 +154,43 @@ def format_total_line(counts):
         label = "Remaining (all tanks)"
     return label, val, u
 
-# Initialize
-load_settings()
-flow_manager = FlowMeterManager()
-last_counts = [0] * 8
-last_check_time = time()
+# Meters, checkpoints, rates and alerts are created by setup() when run() starts, not
+# at import, so importing this module stays cheap
+flow_manager = None
+checkpoints = None
+rate_tracker = None
+alert_engine = None
+scheduler = None
+
+
+def setup():
+    global flow_manager, checkpoints, rate_tracker, alert_engine
+    load_settings()
+    flow_manager = FlowMeterManager()
+    # Restore counts saved before the last reboot (BLE mode and WiFi mode share the files)
+    checkpoints = CheckpointStore(
+        flow_manager.meters,
+        files=CHECKPOINT_FILES,
+        records_per_file=CHECKPOINT_RECORDS_PER_FILE,
+        period_ms=CHECKPOINT_PERIOD_MS,
+        min_ms=CHECKPOINT_MIN_MS,
+        delta=CHECKPOINT_DELTA,
+    )
+    checkpoints.restore()
+    # Averaged rates (window over the last few seconds), reported next to the instantaneous ones
+    rate_tracker = FlowRateTracker(
+        flow_manager.meters, FLOW_RATE_WINDOW, FLOW_RATE_PERIOD_MS, FLOW_RATE_EWMA_ALPHA
+    )
+    # Pump mismatch alerts, evaluated by a background task (not only on page loads)
+    alert_engine = PumpAlertEngine(
+        flow_rate_gpm,
+        TANKS,
+        TANK_ORDER,
+        MIN_FLOW_RATE,
+        ALERT_OFF_RATE,
+        ALERT_RAISE_MS,
+        ALERT_CLEAR_MS,
+    )
 
 # Connect to WiFi
 def connect_wifi():
@@ -269,437 +227,702 @@ def connect_wifi():
     
     raise RuntimeError('WiFi connection failed')
 
-# Update flow rate history
-def update_flow_history():
-    global last_counts, last_check_time
-    
-    current_time = time()
-    time_diff = current_time - last_check_time
-    
-    if time_diff >= 1.0:  # Update every second
-        counts = flow_manager.get_all_pulse_counts()
-        
-        for i in range(8):
-            pulses_per_sec = (counts[i] - last_counts[i]) / time_diff
-            gallons_per_min = (pulses_per_sec * 60) / settings["pulses_per_gallon"]
-            
-            # Keep last 5 seconds
-            flow_history[i].append(gallons_per_min)
-            if len(flow_history[i]) > 5:
-                flow_history[i].pop(0)
-        
-        last_counts = counts.copy()
-        last_check_time = current_time
+# Sample rates, evaluate alerts, save checkpoints and report task overruns on a fixed
+# cadence, independent of HTTP traffic. They run as asyncio tasks (as in BLE mode),
+# between requests, never in the middle of one the way a machine.Timer callback would.
+def start_tasks():
+    global scheduler
+    scheduler = Scheduler()
+    jobs = {
+        "rates": rate_tracker.sample,
+        "alerts": alert_engine.evaluate,
+        "persist": checkpoints.tick,
+        "housekeeping": scheduler.report,
+    }
+    for name, fn in jobs.items():
+        period_ms, deadline_ms = TASK_SCHEDULE[name]
+        scheduler.add(name, fn, period_ms, deadline_ms)
+    scheduler.start()
+
+
+# Instantaneous (period-based) rates drive alerts and RUNNING/STOPPED, so both agree and
+# a failed pump shows within seconds; the tracker's window average is reported alongside
+def flow_rate_gpm(meter_idx):
+    return flow_manager.meters.get_rate_gpm(meter_idx, settings["pulses_per_gallon"])
 
-# Check for pump failures
+
+def flow_rates():
+    return [round(r, 2) for r in flow_manager.get_all_flow_rates(settings["pulses_per_gallon"])]
+
+
+def avg_flow_rates():
+    ppg = settings["pulses_per_gallon"]
+    return [round(rate_tracker.rate_gpm(i, ppg), 2) for i in range(flow_manager.meters.channels)]
+
+# Check for pump failures (alert engine runs in the background; this just reads it)
 def check_pump_failures():
-    alerts = []
-    
-    for tank_name, tank_info in TANK_CONFIG.items():
-        meters = tank_info["meters"]
-        
-        if len(flow_history[meters[0]]) >= 5 and len(flow_history[meters[1]]) >= 5:
-            # Average flow rate over last 5 seconds
-            pump1_flow = sum(flow_history[meters[0]]) / len(flow_history[meters[0]])
-            pump2_flow = sum(flow_history[meters[1]]) / len(flow_history[meters[1]])
-            
-            # Check if one pump running but not the other
-            pump1_running = pump1_flow > MIN_FLOW_RATE
-            pump2_running = pump2_flow > MIN_FLOW_RATE
-            
-            if pump1_running and not pump2_running:
-                alerts.append(f"{tank_name} Tank: Only pump 1 running!")
-            elif pump2_running and not pump1_running:
-                alerts.append(f"{tank_name} Tank: Only pump 2 running!")
-    
-    return alerts
+    return alert_engine.messages()
+
+# Outgoing HTTP(S) on asyncio streams, so the web server keeps serving while it waits
+async def _fetch(url, method="GET", body=None, headers=None, limit=32768):
+    """Small HTTP/1.0 request -> (status, body bytes); body capped at limit bytes"""
+    proto, _, rest = url.partition("://")
+    host, _, path = rest.partition("/")
+    port = 443 if proto == "https" else 80
+    if ":" in host:
+        host, port = host.split(":", 1)
+        port = int(port)
+    timeout = HTTP_FETCH_TIMEOUT_MS / 1000
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=True if proto == "https" else None), timeout
+    )
+    try:
+        head = f"{method} /{path} HTTP/1.0\r\nHost: {host}\r\n"
+        for k, v in (headers or {}).items():
+            head += f"{k}: {v}\r\n"
+        if body is not None:
+            head += f"Content-Length: {len(body)}\r\n"
+        writer.write(head.encode() + b"\r\n")
+        if body:
+            writer.write(body)
+        await writer.drain()
+        return await asyncio.wait_for(_read_fetch_response(reader, limit), timeout)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def _read_fetch_response(reader, limit):
+    status = int((await reader.readline()).split()[1])
+    clen = None
+    while True:
+        line = await reader.readline()
+        if not line or line == b"\r\n":
+            break
+        if line[:15].lower() == b"content-length:":
+            clen = int(line[15:])
+    if clen is not None:
+        return status, await reader.readexactly(min(clen, limit))
+    data = b""
+    while len(data) < limit:
+        chunk = await reader.read(1024)
+        if not chunk:
+            break
+        data += chunk
+    return status, data[:limit]
+
+
+# Update check state for /updates: "idle", "running" or "done" (files = names to update)
+_update_check = {"state": "idle", "files": [], "error": ""}
+
 
 # Check GitHub for updates
-def check_github_updates():
+async def check_github_updates():
+    """
+    Names of UPDATE_FILES that differ from the published release. Compares the
+    device manifest's SHA-256 with the one firmware_versions.json publishes (under
+    "files" or "compressed"); a file without one is downloaded and hashed instead.
+    Version tags are not compared: they are often left unchanged by edits.
+    """
+    installed = ota.device_manifest(UPDATE_FILES)
     updates_available = []
-    
+    unknown = []
+    status, data = await _fetch(_github_url("firmware_versions.json"))
+    info = json.loads(data) if status == 200 else {}
+    files = info.get("files", {})
+    compressed = info.get("compressed", {})
+    for filename in UPDATE_FILES:
+        mine = installed.get(filename)
+        entry = files.get(filename)
+        remote = entry.get("sha256") if isinstance(entry, dict) else None
+        if not remote and filename in compressed:
+            remote = compressed[filename].get("sha256")
+        if mine is None:
+            updates_available.append(filename)
+        elif remote and mine.get("sha256"):
+            if remote != mine["sha256"]:
+                updates_available.append(filename)
+        else:
+            unknown.append(filename)
+    if not unknown:
+        return updates_available
+
+    from hashlib import sha256
+    from binascii import hexlify
+
+    for filename in unknown:
+        try:
+            status, data = await _fetch(_github_url(filename), limit=65536)
+            if status != 200:
+                continue
+            mine = installed.get(filename)
+            if mine is None or hexlify(sha256(data).digest()).decode() != mine.get("sha256"):
+                updates_available.append(filename)
+        except Exception as e:
+            print(f"Error checking {filename}: {e}")
+    return updates_available
+
+
+async def _run_update_check():
+    _update_check["state"] = "running"
     try:
-        for filename in UPDATE_FILES:
-            url = f"https://raw.githubusercontent.com/{GITHUB_USER}/{GITHUB_REPO}/{GITHUB_BRANCH}/{filename}"
-            
-            try:
-                response = urequests.get(url, timeout=5)
-                if response.status_code == 200:
-                    remote_content = response.text
-                    
-                    # Try to read local file
-                    try:
-                        with open(filename, 'r') as f:
-                            local_content = f.read()
-                        
-                        if remote_content != local_content:
-                            updates_available.append(filename)
-                    except:
-                        # File doesn't exist locally
-                        updates_available.append(filename)
-                
-                response.close()
-            except Exception as e:
-                print(f"Error checking {filename}: {e}")
-        
+        _update_check["files"] = await check_github_updates()
+        _update_check["error"] = ""
     except Exception as e:
         print(f"GitHub check failed: {e}")
-    
-    return updates_available
+        _update_check["files"] = []
+        _update_check["error"] = str(e)
+    _update_check["state"] = "done"
 
-# Download and install updates
-def install_github_updates(files):
-    results = []
-    
-    for filename in files:
-        url = f"https://raw.githubusercontent.com/{GITHUB_USER}/{GITHUB_REPO}/{GITHUB_BRANCH}/{filename}"
-        
+def _content_length(response):
+    try:
+        for k, v in response.headers.items():
+            if k.lower() == "content-length":
+                return int(v)
+    except (AttributeError, ValueError):
+        pass
+    return None
+
+def _github_url(path):
+    return f"https://raw.githubusercontent.com/{GITHUB_USER}/{GITHUB_REPO}/{GITHUB_BRANCH}/{path}"
+
+def _remote_release_info():
+    """firmware_versions.json from GitHub ({} if unavailable)"""
+    import urequests
+    try:
+        response = urequests.get(_github_url("firmware_versions.json"), timeout=5)
         try:
-            response = urequests.get(url, timeout=10)
             if response.status_code == 200:
-                with open(filename, 'w') as f:
-                    f.write(response.text)
-                results.append(f"OK {filename}")
-            else:
-                results.append(f"FAIL {filename} (HTTP {response.status_code})")
+                return response.json()
+        finally:
             response.close()
+    except Exception as e:
+        print(f"Release info unavailable: {e}")
+    return {}
+
+def _stage_delta(filename, versions):
+    """Stage filename from a delta patch against the installed copy; None to fall back"""
+    import urequests
+    if not versions:
+        return None
+    crc = ota.crc32_file(filename)
+    if crc is None:
+        return None
+    crc = "%08x" % crc
+    for d in versions.get(read_py_file_version(filename), ()):
+        if d["base_crc32"] != crc:
+            continue
+        try:
+            response = urequests.get(_github_url(d["path"]), timeout=10)
+            try:
+                if response.status_code == 200:
+                    ota.stage_patch(filename, response.raw, "zlib")
+                    return d
+            finally:
+                response.close()
         except Exception as e:
-            results.append(f"FAIL {filename} ({str(e)})")
+            print(f"Delta for {filename} failed, downloading full file: {e}")
+        break
+    return None
+
+def _stage_file(filename, z, versions, staged):
+    """Stage one source file (delta, compressed or plain); returns its result line"""
+    import urequests
+    if z:
+        d = _stage_delta(filename, versions)
+        if d:
+            staged[filename] = {"size": z["size"], "sha256": z["sha256"]}
+            return f"OK {filename} (delta, {d['zsize']} bytes)"
+    url = _github_url(z["path"] if z else filename)
     
-    return results
+    try:
+        response = urequests.get(url, timeout=10)
+        try:
+            if response.status_code != 200:
+                return f"FAIL {filename} (HTTP {response.status_code})"
+            if z:
+                size = ota.stage_stream(filename, response.raw, z["size"], "zlib")
+                staged[filename] = {"size": size, "sha256": z["sha256"]}
+                return f"OK {filename} ({z['zsize']} bytes compressed)"
+            size = _content_length(response)
+            if size is None:
+                data = response.content
+                size = ota.stage_stream(filename, _BytesReader(data), len(data))
+            else:
+                size = ota.stage_stream(filename, response.raw, size)
+            staged[filename] = {"size": size}
+            return f"OK {filename} ({size} bytes)"
+        finally:
+            response.close()
+    except Exception as e:
+        return f"FAIL {filename} ({str(e)})"
 
-def build_file_versions():
-    out = {}
-    for fn in ["main.py", "main_wifi.py", "flow_meters.py", "ble_service.py", "ble_advertising.py", "config.py"]:
-        out[fn] = read_py_file_version(fn)
-    return out
+def _stage_bytecode(filename, m, staged):
+    """Stage the precompiled .mpy of filename; the source alone still works if this fails"""
+    import urequests
+    name = filename[:-3] + ".mpy"
+    try:
+        response = urequests.get(_github_url(m["path"]), timeout=10)
+        try:
+            if response.status_code == 200:
+                ota.stage_stream(name, response.raw, m["size"], "zlib")
+                staged[name] = {"size": m["size"], "sha256": m["sha256"]}
+                return f"OK {name} ({m['zsize']} bytes compressed)"
+        finally:
+            response.close()
+    except Exception as e:
+        print(f"Bytecode for {filename} skipped: {e}")
+    return f"SKIP {name} (source will be compiled)"
 
-# Generate HTML
-def get_html():
-    update_flow_history()
-    counts = flow_manager.get_all_pulse_counts()
-    alerts = check_pump_failures()
+# Download updates into the staging directory, then install them together as one bundle
+def install_github_updates(files):
+    """Returns (result lines, installed). Nothing is installed unless every file downloaded."""
+    results = []
+    staged = {}
     
-    # Alert banner
-    alert_html = ""
-    if alerts:
-        alert_list = "<br>".join(f"WARNING: {alert}" for alert in alerts)
-        alert_html = f'''
-        <div class="alert-banner">
-            {alert_list}
-        </div>
-        '''
+    try:
+        ota.begin_bundle()
+    except OSError as e:
+        return [f"FAIL staging ({e})"], False
     
-    # Build tank cards
-    tank_cards = ""
-
-    for tank_name, tank_info in TANK_CONFIG.items():
-        meters = tank_info["meters"]
-        names = tank_info["names"]
-        
-        pump_data = []
-
-        for i, meter_idx in enumerate(meters):
-            pulses = counts[meter_idx]
+    # Files listed under "compressed" (tools/make_release.py) download as zlib and
+    # are inflated while streaming to flash. If "deltas" has a patch for the installed
+    # copy (same version tag and CRC32) only the patch is downloaded. Modules listed
+    # under "mpy" for this firmware's bytecode version also get their .mpy.
+    info = _remote_release_info()
+    compressed = info.get("compressed", {})
+    deltas = info.get("deltas", {})
+    bytecode = info.get("mpy", {})
+    mpy_version = ota.bytecode_version()
+    
+    failed = False
+    for filename in files:
+        results.append(_stage_file(filename, compressed.get(filename), deltas.get(filename), staged))
+        if filename not in staged:
+            failed = True
+            continue
+        m = bytecode.get(filename)
+        if m and mpy_version is not None and m.get("mpy_version") == mpy_version:
+            results.append(_stage_bytecode(filename, m, staged))
+    
+    if failed:
+        ota.begin_bundle()
+        results.append("Update aborted - nothing was installed")
+        return results, False
+    
+    try:
+        ota.write_manifest(f"github/{GITHUB_BRANCH}", staged)
+        ok, msg = ota.commit_bundle()
+    except Exception as e:
+        ok, msg = False, str(e)
+    results.append(("Installed " if ok else "FAIL install ") + msg)
+    return results, ok
 
-            if len(flow_history[meter_idx]) > 0:
-                flow_rate = sum(flow_history[meter_idx]) / len(flow_history[meter_idx])
-                is_running = flow_rate > MIN_FLOW_RATE
-            else:
-                is_running = False
 
-            pv, pun = format_pump_display(meter_idx, tank_name, counts)
-            display_val = f"{pv} {pun}".strip() if pun else pv
+class _BytesReader:
+    """readinto() over an in-memory body, for responses without Content-Length"""
 
-            status = "RUNNING" if is_running else "STOPPED"
-            status_class = "running" if is_running else "stopped"
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
 
-            pump_data.append({
-                "name": names[i],
-                "value": display_val,
-                "status": status,
-                "status_class": status_class,
-                "meter_idx": meter_idx,
-            })
+    def readinto(self, buf):
+        n = min(len(buf), len(self._data) - self._pos)
+        buf[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
 
-        percent = get_tank_percent_display(tank_name, counts)
+def build_file_versions():
+    installed = ota.device_manifest(UPDATE_FILES)
+    out = {}
+    for fn in UPDATE_FILES:
+        entry = installed.get(fn)
+        out[fn] = entry["version"] if entry else "unknown"
+    return out
 
-        um = settings["unit_mode"]
-        ppg = settings["pulses_per_gallon"]
-        ppg_lb = settings["pounds_per_gallon"]
-        tt_val, tt_unit = fmt_pulses(
-            get_tank_total_pulses(tank_name, counts), um, ppg, ppg_lb
-        )
-        tank_display = f"{tt_val} {tt_unit}".strip() if tt_unit else tt_val
-        
-        tf = settings["tank_fill"].get(tank_name, True)
-        f_cls = "mini-on" if tf else ""
-        d_cls = "" if tf else "mini-on"
-        pump_rows = ""
-        for pump in pump_data:
-            pump_rows += f'''
+# Dashboard HTML, split at import into static byte segments and slots
+class _Template:
+    """
+    An HTML template split once, at import, into pre-encoded static segments and
+    named slots ("@@name@@"). Values given as static are folded into the segments.
+    render() yields the segments as they are and each slot's value: a str (encoded
+    on the way out) or an iterable of chunks, so nothing builds the whole page.
+    """
+
+    def __init__(self, text, **static):
+        self._parts = []
+        names = []
+        pieces = text.split("@@")
+        seg = pieces[0]
+        for k in range(1, len(pieces), 2):
+            name, tail = pieces[k], pieces[k + 1]
+            if name in static:
+                seg += str(static[name]) + tail
+                continue
+            self._parts.append(seg.encode("utf-8"))
+            names.append(name)
+            seg = tail
+        self._parts.append(seg.encode("utf-8"))
+        self._names = tuple(names)
+
+    def render(self, values):
+        parts = self._parts
+        for k, name in enumerate(self._names):
+            yield parts[k]
+            v = values[name]
+            if isinstance(v, str):
+                yield v.encode("utf-8")
+            else:
+                yield from v
+        yield parts[-1]
+
+
+class _Asset:
+    """
+    A static file served from memory with an ETag. Pages link it as "<path>?v=<tag>",
+    so it can be cached for good: a new release changes the tag and the URL.
+    """
+
+    def __init__(self, body, ctype):
+        self.body = body
+        self.ctype = ctype
+        self.tag = "%08x" % (crc32(body) & 0xFFFFFFFF)
+        self.etag = f'"{self.tag}"'
+
+    def response(self, if_none_match=None):
+        headers = f"ETag: {self.etag}\r\nCache-Control: public, max-age=31536000, immutable\r\n"
+        if if_none_match == self.etag:
+            return Response(b"", None, "304 Not Modified", headers)
+        return Response(self.body, self.ctype, headers=headers)
+
+
+_APP_CSS = _Asset(b'''* { margin: 0; padding: 0; box-sizing: border-box; }
+body {
+    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
+    background: #fff;
+    color: #333;
+    padding-bottom: 72px;
+}
+.topbar {
+    background: #4CAF50;
+    color: #fff;
+    text-align: center;
+    padding: 14px 16px 12px;
+}
+.topbar h1 { font-size: 20px; font-weight: 500; }
+.topbar .sub { font-size: 11px; opacity: 0.95; margin-top: 4px; }
+.alert-banner {
+    background: #ff3b30;
+    color: #fff;
+    padding: 12px;
+    text-align: center;
+    font-weight: 600;
+    font-size: 14px;
+}
+.statusbar {
+    background: #f5f5f5;
+    padding: 12px;
+    border-bottom: 1px solid #eee;
+}
+.fill-row {
+    display: flex;
+    justify-content: center;
+    gap: 12px;
+}
+.toggle {
+    padding: 10px 28px;
+    border-radius: 10px;
+    border: 2px solid #c8e6c9;
+    background: #fff;
+    font-size: 15px;
+    font-weight: 600;
+    color: #555;
+    cursor: pointer;
+}
+.toggle-active {
+    background: #4CAF50;
+    border-color: #2E7D32;
+    color: #fff;
+}
+.units-row {
+    display: flex;
+    flex-wrap: wrap;
+    gap: 8px;
+    justify-content: center;
+    margin-top: 10px;
+}
+.seg {
+    padding: 8px 14px;
+    border-radius: 8px;
+    border: 1px solid #ddd;
+    background: #fff;
+    font-size: 13px;
+    cursor: pointer;
+}
+.seg-on {
+    background: #4CAF50;
+    border-color: #4CAF50;
+    color: #fff;
+}
+.toolbar {
+    display: flex;
+    flex-wrap: wrap;
+    gap: 8px;
+    padding: 12px;
+    justify-content: center;
+    border-bottom: 1px solid #eee;
+}
+.btn {
+    border: none;
+    padding: 10px 16px;
+    border-radius: 8px;
+    font-size: 14px;
+    font-weight: 600;
+    cursor: pointer;
+    color: #fff;
+}
+.btn-blue { background: #1976D2; }
+.btn-red { background: #c62828; }
+.btn-purple { background: #7b1fa2; }
+.total-card {
+    margin: 12px;
+    background: #E3F2FD;
+    border-radius: 12px;
+    padding: 16px;
+    text-align: center;
+}
+.total-card .lbl { font-size: 13px; color: #1976D2; margin-bottom: 4px; }
+.total-card .val { font-size: 28px; color: #1565C0; font-weight: 500; }
+.tank-grid {
+    display: flex;
+    flex-wrap: wrap;
+    padding: 6px;
+    gap: 8px;
+}
+.tank-card {
+    width: calc(50% - 8px);
+    min-width: 160px;
+    flex: 1 1 45%;
+    background: #f5f5f5;
+    border-radius: 12px;
+    padding: 10px;
+}
+.tank-mini {
+    display: flex;
+    justify-content: center;
+    gap: 6px;
+    margin-bottom: 8px;
+}
+.mini {
+    padding: 4px 10px;
+    border-radius: 6px;
+    border: 1px solid #ddd;
+    background: #fff;
+    font-size: 11px;
+    cursor: pointer;
+}
+.mini-on { background: #4CAF50; border-color: #4CAF50; color: #fff; }
+.tank-title {
+    display: flex;
+    justify-content: space-between;
+    margin-bottom: 6px;
+    font-weight: 600;
+    font-size: 15px;
+}
+.tank-pct { font-size: 13px; color: #666; font-weight: 400; }
+.pump-row {
+    display: flex;
+    align-items: stretch;
+    margin-bottom: 6px;
+}
+.pump-reset {
+    width: 36px;
+    min-height: 44px;
+    border: 1px solid #ccc;
+    border-radius: 18px 4px 4px 18px;
+    background: #eee;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    margin-right: 8px;
+    cursor: pointer;
+    font-size: 16px;
+    color: #666;
+}
+.pump-main {
+    flex: 1;
+    background: #fff;
+    border-radius: 8px;
+    padding: 8px;
+}
+.pump-main .lbl { font-size: 11px; color: #666; }
+.pump-main .num { font-size: 16px; color: #4CAF50; margin-top: 4px; font-weight: 500; }
+.tank-actions {
+    display: flex;
+    gap: 6px;
+    margin-top: 4px;
+}
+.tank-actions button {
+    flex: 1;
+    padding: 6px;
+    font-size: 11px;
+    border-radius: 6px;
+    border: 1px solid #ddd;
+    background: #fff;
+    cursor: pointer;
+}
+.footer {
+    text-align: center;
+    font-size: 12px;
+    color: #888;
+    padding: 16px;
+    line-height: 1.5;
+}
+.footer summary { cursor: pointer; color: #1565C0; }
+.footer code { font-size: 11px; display: block; margin-top: 8px; text-align: left; }
+@media (max-width: 520px) {
+    .tank-card { width: 100%; flex: 1 1 100%; }
+}
+''', "text/css")
+
+# Patches the page from the /api/stream events, or polls /api/live every 2 s (paused
+# while the tab is hidden) when streaming is unavailable; the forms work without it
+_APP_JS = _Asset(b'''(function () {
+    var PERIOD = 2000;
+    var lastAlerts = null;
+    function $(id) { return document.getElementById(id); }
+    function text(id, v) {
+        var e = $(id);
+        if (e && e.textContent !== v) e.textContent = v;
+    }
+    function on(id, cls, state) {
+        var e = $(id);
+        if (e) e.classList.toggle(cls, !!state);
+    }
+    function alerts(list) {
+        var key = list.join("\\n");
+        if (key === lastAlerts) return;
+        lastAlerts = key;
+        var box = $("alerts");
+        box.textContent = "";
+        if (!list.length) return;
+        var b = document.createElement("div");
+        b.className = "alert-banner";
+        list.forEach(function (m, i) {
+            if (i) b.appendChild(document.createElement("br"));
+            b.appendChild(document.createTextNode("WARNING: " + m));
+        });
+        box.appendChild(b);
+    }
+    function apply(d) {
+        alerts(d.alerts);
+        on("mf", "toggle-active", d.fill);
+        on("md", "toggle-active", !d.fill);
+        ["counter", "gallons", "pounds"].forEach(function (u) { on("u-" + u, "seg-on", d.unit === u); });
+        text("tot-lbl", d.total[0]);
+        text("tot", d.total[1]);
+        d.tanks.forEach(function (t, k) {
+            text("pct" + k, t[0] + "%");
+            text("tt" + k, t[1] + " total");
+            on("tf" + k, "mini-on", t[2]);
+            on("td" + k, "mini-on", !t[2]);
+            t[3].forEach(function (p) {
+                text("pv" + p[0], p[1]);
+                text("ps" + p[0], p[2] ? "RUNNING" : "STOPPED");
+                var s = $("ps" + p[0]);
+                if (s) s.className = p[2] ? "running" : "stopped";
+            });
+        });
+    }
+    function poll() {
+        if (document.hidden) return setTimeout(poll, PERIOD);
+        fetch("/api/live")
+            .then(function (r) { return r.json(); })
+            .then(apply)
+            .catch(function () {})
+            .then(function () { setTimeout(poll, PERIOD); });
+    }
+    if (!window.EventSource) return setTimeout(poll, PERIOD);
+    var es = new EventSource("/api/stream");
+    es.onmessage = function (e) { apply(JSON.parse(e.data)); };
+    es.onerror = function () {
+        // Refused (too many viewers) or gone: poll instead; transient drops reconnect
+        if (es.readyState === 2) setTimeout(poll, PERIOD);
+    };
+})();
+''', "application/javascript")
+
+_PUMP_ROW = _Template('''
             <div class="pump-row">
                 <form method="POST" action="/reset" style="display:flex;">
-                    <input type="hidden" name="meter" value="{pump["meter_idx"]}">
+                    <input type="hidden" name="meter" value="@@meter@@">
                     <button type="submit" class="pump-reset" title="Reset">&#8635;</button>
                 </form>
                 <div class="pump-main">
-                    <div class="lbl">{pump["name"]} &middot; <span class="{pump["status_class"]}">{pump["status"]}</span></div>
-                    <div class="num">{pump["value"]}</div>
+                    <div class="lbl">@@name@@ &middot; <span id="ps@@meter@@" class="@@status_class@@">@@status@@</span></div>
+                    <div class="num" id="pv@@meter@@">@@value@@</div>
                 </div>
             </div>
-            '''
+            ''')
 
-        tank_cards += f'''
+_TANK_CARD = _Template('''
         <div class="tank-card">
             <div class="tank-mini">
-                <form method="POST" action="/set_tank_fill"><input type="hidden" name="tank" value="{tank_name}"/><input type="hidden" name="fill" value="1"/>
-                    <button type="submit" class="mini {f_cls}">Fill</button></form>
-                <form method="POST" action="/set_tank_fill"><input type="hidden" name="tank" value="{tank_name}"/><input type="hidden" name="fill" value="0"/>
-                    <button type="submit" class="mini {d_cls}">Drain</button></form>
+                <form method="POST" action="/set_tank_fill"><input type="hidden" name="tank" value="@@tank@@"/><input type="hidden" name="fill" value="1"/>
+                    <button type="submit" id="tf@@k@@" class="mini @@f_cls@@">Fill</button></form>
+                <form method="POST" action="/set_tank_fill"><input type="hidden" name="tank" value="@@tank@@"/><input type="hidden" name="fill" value="0"/>
+                    <button type="submit" id="td@@k@@" class="mini @@d_cls@@">Drain</button></form>
             </div>
             <div class="tank-title">
-                <span>{tank_name}</span>
-                <span class="tank-pct">{percent:.0f}%</span>
+                <span>@@tank@@</span>
+                <span class="tank-pct" id="pct@@k@@">@@percent@@%</span>
             </div>
-            <div style="font-size:12px;color:#666;margin-bottom:6px;">{tank_display} total</div>
-            {pump_rows}
+            <div style="font-size:12px;color:#666;margin-bottom:6px;" id="tt@@k@@">@@total@@ total</div>
+            @@pumps@@
             <div class="tank-actions">
-                <form method="POST" action="/reset_tank" style="flex:1;"><input type="hidden" name="tank" value="{tank_name}"/>
+                <form method="POST" action="/reset_tank" style="flex:1;"><input type="hidden" name="tank" value="@@tank@@"/>
                     <button type="submit">&#8635; Tank</button></form>
-                <form method="POST" action="/set_full" style="flex:1;"><input type="hidden" name="tank" value="{tank_name}"/>
+                <form method="POST" action="/set_full" style="flex:1;"><input type="hidden" name="tank" value="@@tank@@"/>
                     <button type="submit">Set full</button></form>
             </div>
         </div>
+        ''')
+
+_ALERT_OPEN = b'''
+        <div class="alert-banner">
+            '''
+_ALERT_CLOSE = b'''
+        </div>
         '''
-    
-    tot_label, tot_val, tot_u = format_total_line(counts)
-    total_display = f"{tot_val} {tot_u}".strip() if tot_u else tot_val
-    fv = build_file_versions()
-    fill_on = "toggle-active" if settings["is_fill_mode"] else ""
-    drain_on = "" if settings["is_fill_mode"] else "toggle-active"
-    um = settings["unit_mode"]
-    c_on = "seg-on" if um == "counter" else ""
-    g_on = "seg-on" if um == "gallons" else ""
-    p_on = "seg-on" if um == "pounds" else ""
 
-    html = f'''<!DOCTYPE html>
+_PAGE = _Template('''<!DOCTYPE html>
 <html>
 <head>
-    <title>Ballast Monitor v{VERSION}</title>
+    <title>Ballast Monitor v@@VERSION@@</title>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1">
-    <meta http-equiv="refresh" content="2">
-    <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
-            background: #fff;
-            color: #333;
-            padding-bottom: 72px;
-        }}
-        .topbar {{
-            background: #4CAF50;
-            color: #fff;
-            text-align: center;
-            padding: 14px 16px 12px;
-        }}
-        .topbar h1 {{ font-size: 20px; font-weight: 500; }}
-        .topbar .sub {{ font-size: 11px; opacity: 0.95; margin-top: 4px; }}
-        .alert-banner {{
-            background: #ff3b30;
-            color: #fff;
-            padding: 12px;
-            text-align: center;
-            font-weight: 600;
-            font-size: 14px;
-        }}
-        .statusbar {{
-            background: #f5f5f5;
-            padding: 12px;
-            border-bottom: 1px solid #eee;
-        }}
-        .fill-row {{
-            display: flex;
-            justify-content: center;
-            gap: 12px;
-        }}
-        .toggle {{
-            padding: 10px 28px;
-            border-radius: 10px;
-            border: 2px solid #c8e6c9;
-            background: #fff;
-            font-size: 15px;
-            font-weight: 600;
-            color: #555;
-            cursor: pointer;
-        }}
-        .toggle-active {{
-            background: #4CAF50;
-            border-color: #2E7D32;
-            color: #fff;
-        }}
-        .units-row {{
-            display: flex;
-            flex-wrap: wrap;
-            gap: 8px;
-            justify-content: center;
-            margin-top: 10px;
-        }}
-        .seg {{
-            padding: 8px 14px;
-            border-radius: 8px;
-            border: 1px solid #ddd;
-            background: #fff;
-            font-size: 13px;
-            cursor: pointer;
-        }}
-        .seg-on {{
-            background: #4CAF50;
-            border-color: #4CAF50;
-            color: #fff;
-        }}
-        .toolbar {{
-            display: flex;
-            flex-wrap: wrap;
-            gap: 8px;
-            padding: 12px;
-            justify-content: center;
-            border-bottom: 1px solid #eee;
-        }}
-        .btn {{
-            border: none;
-            padding: 10px 16px;
-            border-radius: 8px;
-            font-size: 14px;
-            font-weight: 600;
-            cursor: pointer;
-            color: #fff;
-        }}
-        .btn-blue {{ background: #1976D2; }}
-        .btn-red {{ background: #c62828; }}
-        .btn-purple {{ background: #7b1fa2; }}
-        .total-card {{
-            margin: 12px;
-            background: #E3F2FD;
-            border-radius: 12px;
-            padding: 16px;
-            text-align: center;
-        }}
-        .total-card .lbl {{ font-size: 13px; color: #1976D2; margin-bottom: 4px; }}
-        .total-card .val {{ font-size: 28px; color: #1565C0; font-weight: 500; }}
-        .tank-grid {{
-            display: flex;
-            flex-wrap: wrap;
-            padding: 6px;
-            gap: 8px;
-        }}
-        .tank-card {{
-            width: calc(50% - 8px);
-            min-width: 160px;
-            flex: 1 1 45%;
-            background: #f5f5f5;
-            border-radius: 12px;
-            padding: 10px;
-        }}
-        .tank-mini {{
-            display: flex;
-            justify-content: center;
-            gap: 6px;
-            margin-bottom: 8px;
-        }}
-        .mini {{
-            padding: 4px 10px;
-            border-radius: 6px;
-            border: 1px solid #ddd;
-            background: #fff;
-            font-size: 11px;
-            cursor: pointer;
-        }}
-        .mini-on {{ background: #4CAF50; border-color: #4CAF50; color: #fff; }}
-        .tank-title {{
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 6px;
-            font-weight: 600;
-            font-size: 15px;
-        }}
-        .tank-pct {{ font-size: 13px; color: #666; font-weight: 400; }}
-        .pump-row {{
-            display: flex;
-            align-items: stretch;
-            margin-bottom: 6px;
-        }}
-        .pump-reset {{
-            width: 36px;
-            min-height: 44px;
-            border: 1px solid #ccc;
-            border-radius: 18px 4px 4px 18px;
-            background: #eee;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            margin-right: 8px;
-            cursor: pointer;
-            font-size: 16px;
-            color: #666;
-        }}
-        .pump-main {{
-            flex: 1;
-            background: #fff;
-            border-radius: 8px;
-            padding: 8px;
-        }}
-        .pump-main .lbl {{ font-size: 11px; color: #666; }}
-        .pump-main .num {{ font-size: 16px; color: #4CAF50; margin-top: 4px; font-weight: 500; }}
-        .tank-actions {{
-            display: flex;
-            gap: 6px;
-            margin-top: 4px;
-        }}
-        .tank-actions button {{
-            flex: 1;
-            padding: 6px;
-            font-size: 11px;
-            border-radius: 6px;
-            border: 1px solid #ddd;
-            background: #fff;
-            cursor: pointer;
-        }}
-        .footer {{
-            text-align: center;
-            font-size: 12px;
-            color: #888;
-            padding: 16px;
-            line-height: 1.5;
-        }}
-        .footer summary {{ cursor: pointer; color: #1565C0; }}
-        .footer code {{ font-size: 11px; display: block; margin-top: 8px; text-align: left; }}
-        @media (max-width: 520px) {{
-            .tank-card {{ width: 100%; flex: 1 1 100%; }}
-        }}
-    </style>
+    <link rel="stylesheet" href="/app.css?v=@@CSS_TAG@@">
 </head>
 <body>
     <div class="topbar">
         <h1>Ballast Monitor</h1>
-        <div class="sub">WiFi &middot; v{VERSION} &middot; refresh 2s</div>
+        <div class="sub">WiFi &middot; v@@VERSION@@ &middot; live</div>
     </div>
-    {alert_html}
+    <div id="alerts">@@alerts@@</div>
     <div class="statusbar">
         <div class="fill-row">
             <form method="POST" action="/set_master_fill"><input type="hidden" name="mode" value="fill"/>
-                <button type="submit" class="toggle {fill_on}">Fill</button></form>
+                <button type="submit" id="mf" class="toggle @@fill_on@@">Fill</button></form>
             <form method="POST" action="/set_master_fill"><input type="hidden" name="mode" value="drain"/>
-                <button type="submit" class="toggle {drain_on}">Drain</button></form>
+                <button type="submit" id="md" class="toggle @@drain_on@@">Drain</button></form>
         </div>
         <div class="units-row">
             <form method="POST" action="/set_unit_mode"><input type="hidden" name="mode" value="counter"/>
-                <button type="submit" class="seg {c_on}">Counter</button></form>
+                <button type="submit" id="u-counter" class="seg @@c_on@@">Counter</button></form>
             <form method="POST" action="/set_unit_mode"><input type="hidden" name="mode" value="gallons"/>
-                <button type="submit" class="seg {g_on}">Gallons</button></form>
+                <button type="submit" id="u-gallons" class="seg @@g_on@@">Gallons</button></form>
             <form method="POST" action="/set_unit_mode"><input type="hidden" name="mode" value="pounds"/>
-                <button type="submit" class="seg {p_on}">Pounds</button></form>
+                <button type="submit" id="u-pounds" class="seg @@p_on@@">Pounds</button></form>
         </div>
     </div>
     <div class="toolbar">
@@ -707,30 +930,229 @@ def get_html():
         <form method="POST" action="/check_updates"><button type="submit" class="btn btn-purple">Check updates</button></form>
     </div>
     <div class="total-card">
-        <div class="lbl">{tot_label}</div>
-        <div class="val">{total_display}</div>
+        <div class="lbl" id="tot-lbl">@@total_label@@</div>
+        <div class="val" id="tot">@@total@@</div>
     </div>
     <div class="tank-grid">
-        {tank_cards}
+        @@tanks@@
     </div>
     <div class="footer">
-        Pulses/gal: {settings["pulses_per_gallon"]:.0f} &middot; Saved on Pico as <code>ballast_settings.json</code>
+        Pulses/gal: @@ppg@@ &middot; Saved on Pico as <code>ballast_settings.json</code>
         <details>
             <summary>File versions</summary>
             <code>
-main.py: {fv.get("main.py", "?")}<br/>
-main_wifi.py: {fv.get("main_wifi.py", "?")}<br/>
-flow_meters.py: {fv.get("flow_meters.py", "?")}<br/>
-ble_service.py: {fv.get("ble_service.py", "?")}<br/>
-ble_advertising.py: {fv.get("ble_advertising.py", "?")}<br/>
-config.py: {fv.get("config.py", "?")}
+@@files@@
             </code>
         </details>
     </div>
+    <script src="/app.js?v=@@JS_TAG@@" defer></script>
 </body>
 </html>
-'''
-    return html
+''', VERSION=VERSION, CSS_TAG=_APP_CSS.tag, JS_TAG=_APP_JS.tag)
+
+
+def _render_alerts(alerts):
+    if not alerts:
+        return
+    yield _ALERT_OPEN
+    for k, alert in enumerate(alerts):
+        yield f"{'<br>' if k else ''}WARNING: {alert}".encode("utf-8")
+    yield _ALERT_CLOSE
+
+
+def _with_unit(val, unit):
+    return f"{val} {unit}".strip() if unit else val
+
+
+def _tank_total_display(tank_name, counts):
+    return _with_unit(*fmt_pulses(
+        get_tank_total_pulses(tank_name, counts),
+        settings["unit_mode"],
+        settings["pulses_per_gallon"],
+        settings["pounds_per_gallon"],
+    ))
+
+
+def _render_pumps(tank_name, tank_info, counts):
+    names = tank_info["names"]
+    for i, meter_idx in enumerate(tank_info["meters"]):
+        is_running = flow_rate_gpm(meter_idx) > MIN_FLOW_RATE
+        yield from _PUMP_ROW.render({
+            "meter": str(meter_idx),
+            "name": names[i],
+            "status_class": "running" if is_running else "stopped",
+            "status": "RUNNING" if is_running else "STOPPED",
+            "value": _with_unit(*format_pump_display(meter_idx, tank_name, counts)),
+        })
+
+
+def _render_tanks(counts):
+    for k, (tank_name, tank_info) in enumerate(TANK_CONFIG.items()):
+        tf = settings["tank_fill"].get(tank_name, True)
+        yield from _TANK_CARD.render({
+            "k": str(k),
+            "tank": tank_name,
+            "f_cls": "mini-on" if tf else "",
+            "d_cls": "" if tf else "mini-on",
+            "percent": f"{get_tank_percent_display(tank_name, counts):.0f}",
+            "total": _tank_total_display(tank_name, counts),
+            "pumps": _render_pumps(tank_name, tank_info, counts),
+        })
+
+
+def _render_file_versions():
+    sep = b""
+    for fn, v in build_file_versions().items():
+        yield sep
+        yield f"{fn}: {v}".encode("utf-8")
+        sep = b"<br/>\n"
+
+
+# Generate HTML: a generator of byte chunks (sent with chunked transfer encoding)
+def get_html():
+    counts = flow_manager.get_all_pulse_counts()
+    tot_label, tot_val, tot_u = format_total_line(counts)
+    um = settings["unit_mode"]
+    fill = settings["is_fill_mode"]
+    return _PAGE.render({
+        "alerts": _render_alerts(check_pump_failures()),
+        "fill_on": "toggle-active" if fill else "",
+        "drain_on": "" if fill else "toggle-active",
+        "c_on": "seg-on" if um == "counter" else "",
+        "g_on": "seg-on" if um == "gallons" else "",
+        "p_on": "seg-on" if um == "pounds" else "",
+        "total_label": tot_label,
+        "total": _with_unit(tot_val, tot_u),
+        "tanks": _render_tanks(counts),
+        "ppg": f"{settings['pulses_per_gallon']:.0f}",
+        "files": _render_file_versions(),
+    })
+
+def live_state():
+    """
+    Everything the dashboard shows that changes, for /api/live:
+    {"alerts", "fill", "unit", "total": [label, value],
+     "tanks": [[percent, total, fill, [[meter, value, running], ...]], ...]}
+    """
+    counts = flow_manager.get_all_pulse_counts()
+    tanks = []
+    for tank_name, tank_info in TANK_CONFIG.items():
+        pumps = []
+        for meter_idx in tank_info["meters"]:
+            pumps.append([
+                meter_idx,
+                _with_unit(*format_pump_display(meter_idx, tank_name, counts)),
+                1 if flow_rate_gpm(meter_idx) > MIN_FLOW_RATE else 0,
+            ])
+        tanks.append([
+            f"{get_tank_percent_display(tank_name, counts):.0f}",
+            _tank_total_display(tank_name, counts),
+            settings["tank_fill"].get(tank_name, True),
+            pumps,
+        ])
+    tot_label, tot_val, tot_u = format_total_line(counts)
+    return {
+        "alerts": check_pump_failures(),
+        "fill": settings["is_fill_mode"],
+        "unit": settings["unit_mode"],
+        "total": [tot_label, _with_unit(tot_val, tot_u)],
+        "tanks": tanks,
+    }
+
+# Server-Sent Events: one broadcaster task samples the live values and queues each
+# change (or a heartbeat) to every viewer; each viewer's task writes its own queue
+class _StreamClient:
+    def __init__(self):
+        self.pending = []
+        self.event = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+
+    async def watch(self, reader):
+        """Viewers send nothing after the request: any read result means they left"""
+        try:
+            await reader.read(1)
+        except Exception:
+            pass
+        self.closed = True
+        self.event.set()
+
+    def push(self, msg):
+        if len(self.pending) >= STREAM_QUEUE:
+            self.pending.pop(0)
+            self.dropped += 1
+        self.pending.append(msg)
+        self.event.set()
+
+
+_streams = []
+_last_event = None
+_broadcasting = False
+
+
+def stream_state():
+    """live_state() plus raw pulses and rates, as in /api/pulses"""
+    state = live_state()
+    state["pulses"] = flow_manager.get_all_pulse_counts()
+    state["rates"] = flow_rates()
+    state["avg_rates"] = avg_flow_rates()
+    return state
+
+
+async def _broadcast():
+    global _last_event, _broadcasting
+    quiet_ms = 0
+    try:
+        while _streams:
+            msg = b"data: " + json.dumps(stream_state()).encode("utf-8") + b"\n\n"
+            if msg != _last_event:
+                _last_event = msg
+                quiet_ms = 0
+                for c in _streams:
+                    c.push(msg)
+            elif quiet_ms >= STREAM_HEARTBEAT_MS:
+                quiet_ms = 0
+                for c in _streams:
+                    c.push(b": hb\n\n")
+            await asyncio.sleep(STREAM_PERIOD_MS / 1000)
+            quiet_ms += STREAM_PERIOD_MS
+    finally:
+        # Nobody watching: stop sampling; the next viewer starts from fresh values
+        _broadcasting = False
+        _last_event = None
+
+
+async def _stream_events(reader, writer):
+    """Serve GET /api/stream on this connection until the viewer goes away"""
+    global _broadcasting
+    if len(_streams) >= STREAM_MAX_CLIENTS:
+        writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        return
+    client = _StreamClient()
+    _streams.append(client)
+    watcher = asyncio.create_task(client.watch(reader))
+    try:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\nretry: 3000\n\n"
+        )
+        if _last_event:
+            client.push(_last_event)
+        if not _broadcasting:
+            _broadcasting = True
+            asyncio.create_task(_broadcast())
+        while not client.closed:
+            await client.event.wait()
+            client.event.clear()
+            while client.pending and not client.closed:
+                writer.write(client.pending.pop(0))
+            await asyncio.wait_for(writer.drain(), STREAM_SEND_TIMEOUT_MS / 1000)
+    finally:
+        watcher.cancel()
+        _streams.remove(client)
+        if client.dropped:
+            print(f"Stream viewer dropped {client.dropped} events")
 
 # Parse POST data (application/x-www-form-urlencoded)
 def parse_post(data):
@@ -746,235 +1168,572 @@ def parse_post(data):
     return params
 
 
-def read_http_request(cl):
-    """Read up to Content-Length so JSON POST bodies are not truncated."""
-    buf = b""
-    while len(buf) < 65536:
-        chunk = cl.recv(1024)
-        if not chunk:
-            break
-        buf += chunk
-        if b"\r\n\r\n" in buf:
-            header, _, rest = buf.partition(b"\r\n\r\n")
-            hdr = header.decode("utf-8")
-            clen = 0
-            for line in hdr.split("\r\n"):
-                if line.lower().startswith("content-length:"):
-                    try:
-                        clen = int(line.split(":", 1)[1].strip())
-                    except (ValueError, IndexError):
-                        pass
-            if clen <= 0:
-                return hdr + "\r\n\r\n" + rest.decode("utf-8", "replace")
-            body = rest
-            while len(body) < clen:
-                body += cl.recv(1024)
-            return hdr + "\r\n\r\n" + body[:clen].decode("utf-8")
-    return buf.decode("utf-8", "replace")
-
-
-def post_body(request):
-    """Return body after headers from a full HTTP request string."""
-    if "\r\n\r\n" not in request:
-        return ""
-    return request.split("\r\n\r\n", 1)[1]
-
-
-# Start web server
-def start_server(ip):
-    addr = socket.getaddrinfo("0.0.0.0", 80)[0][-1]
-    s = socket.socket()
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(addr)
-    s.listen(1)
+class Response:
+    """
+    What a route returns: status line, content type, body (str or bytes), extra
+    header lines, and an optional callable run once the response has been sent and
+    the connection closed (e.g. machine.reset). A response with stream set (an async
+    function of the reader and writer) instead hands the connection over to it entirely.
+    """
 
-    print(f'\n{"=" * 60}')
-    print(f"Web server running!")
-    print(f"Open: http://{ip}")
-    print(f'{"=" * 60}\n')
+    def __init__(self, body=b"", ctype="text/html", status="200 OK", headers="", after=None, stream=None):
+        self.body = body
+        self.ctype = ctype
+        self.status = status
+        self.headers = headers
+        self.after = after
+        self.stream = stream
 
-    while True:
+
+def _json(obj):
+    return Response(json.dumps(obj), "application/json")
+
+
+def _redirect(location="/"):
+    return Response(status="303 See Other", ctype=None, headers=f"Location: {location}\r\n")
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+def _find_blank_line(buf, start, end):
+    """Index of b"\r\n\r\n" in buf[start:end], or -1; searches in place, no copy"""
+    return buf.find(b"\r\n\r\n", start, end)
+
+
+if not hasattr(bytearray, "find"):  # MicroPython builds without bytearray.find
+
+    def _find_blank_line(buf, start, end):
+        # Checks where the terminator would end and skips ahead by what the byte rules out
+        i = start + 3
+        while i < end:
+            c = buf[i]
+            if c == 10:
+                if buf[i - 1] == 13 and buf[i - 2] == 10 and buf[i - 3] == 13:
+                    return i - 3
+                i += 2  # this "\n" can only be the terminator's second byte
+            elif c == 13:
+                i += 1
+            else:
+                i += 4  # no terminator can overlap this byte
+        return -1
+
+
+async def _readinto(reader, mv):
+    """reader.readinto() where available (MicroPython); CPython streams read and copy"""
+    if hasattr(reader, "readinto"):
+        return await reader.readinto(mv)
+    data = await reader.read(len(mv))
+    mv[:len(data)] = data
+    return len(data)
+
+
+class Request:
+    """
+    Requests read with readinto() into one buffer each connection allocates once.
+    Only the request line is decoded up front; header() searches the header block
+    when a header is asked for, and the body stays in the buffer (a memoryview,
+    valid until the next request is read) unless it is larger than the buffer.
+    """
+
+    def __init__(self, size=HTTP_BUFFER_SIZE):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self._n = 0  # bytes in buf
+        self._end = 0  # end of the current request in buf; anything after is the next one
+        self.method = ""
+        self.path = ""
+        self.http11 = True
+        self.body = b""
+        self._head = b""
+        self._lower = None
+
+    async def read(self, reader):
+        """Read the next request; False at end of stream, HTTPError if it is refused"""
+        buf = self.buf
+        mv = self.mv
+        # Keep bytes of a pipelined request that arrived with the previous one
+        n = self._n - self._end
+        if n > 0:
+            buf[0:n] = buf[self._end:self._n]
+        self._n = self._end = 0
+        self.body = b""
+        self._lower = None
+
+        # Only newly read bytes (plus 3 for a split terminator) are searched
+        start = 0
+        while True:
+            head_end = _find_blank_line(buf, start, n)
+            if head_end >= 0:
+                break
+            if n == len(buf):
+                raise HTTPError("431 Request Header Fields Too Large")
+            got = await _readinto(reader, mv[n:])
+            if not got:
+                if n:
+                    raise HTTPError("400 Bad Request")
+                return False
+            start = max(0, n - 3)
+            n += got
+
+        self._head = head = bytes(mv[:head_end + 2])
+        eol = head.find(b"\r\n")
+        parts = head[:eol].split(b" ")
+        if len(parts) < 2:
+            raise HTTPError("400 Bad Request")
+        self.method = parts[0].decode()
+        target = parts[1]
+        q = target.find(b"?")
+        self.path = (target[:q] if q >= 0 else target).decode() or "/"
+        self.http11 = len(parts) < 3 or parts[2] != b"HTTP/1.0"
+
+        clen = self.header(b"content-length")
         try:
-            cl, _addr = s.accept()
-            request = read_http_request(cl)
+            clen = int(clen) if clen else 0
+        except ValueError:
+            raise HTTPError("400 Bad Request")
+        if clen > HTTP_MAX_BODY:
+            raise HTTPError("413 Payload Too Large")
+        body_start = head_end + 4
+        if body_start + clen <= len(buf):
+            while n < body_start + clen:
+                got = await _readinto(reader, mv[n:])
+                if not got:
+                    raise HTTPError("400 Bad Request")
+                n += got
+            if clen:
+                self.body = mv[body_start:body_start + clen]
+            self._n = n
+            self._end = body_start + clen
+            return True
+        # Larger than the buffer: one allocation of exactly the body size
+        body = bytearray(clen)
+        have = n - body_start
+        body[:have] = mv[body_start:n]
+        bmv = memoryview(body)
+        while have < clen:
+            got = await _readinto(reader, bmv[have:])
+            if not got:
+                raise HTTPError("400 Bad Request")
+            have += got
+        self.body = body
+        return True
+
+    def header(self, name):
+        """Value of header name (lower-case bytes) as str, or None"""
+        if self._lower is None:
+            self._lower = self._head.lower()
+        i = self._lower.find(b"\r\n" + name + b":")
+        if i < 0:
+            return None
+        i += len(name) + 3
+        return self._head[i:self._head.find(b"\r\n", i)].strip().decode()
+
+    def text(self):
+        return str(self.body, "utf-8") if self.body else ""
+
+    def form(self):
+        return parse_post(self.text())
+
+    def keep_alive(self):
+        c = (self.header(b"connection") or "").lower()
+        return c != "close" if self.http11 else c == "keep-alive"
+
+
+# Streamed bodies: pieces smaller than this are gathered into one chunk (in a buffer
+# each connection allocates once), larger ones such as the pre-encoded template
+# segments are sent as they are
+_CHUNK_SIZE = 512
+
+
+async def _send(writer, resp, keep_alive, chunked=True, buf=None):
+    """
+    Write a response. A str/bytes body gets Content-Length; any other body is an
+    iterable of byte chunks, sent with chunked transfer encoding (or, for HTTP/1.0
+    clients, as-is with the connection closed after it). Returns whether the
+    connection stays open.
+    """
+    body = resp.body
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    streamed = not isinstance(body, (bytes, bytearray))
+    if streamed and not chunked:
+        keep_alive = False
+    head = f"HTTP/1.1 {resp.status}\r\n"
+    if resp.ctype:
+        head += f"Content-Type: {resp.ctype}\r\n"
+    if not streamed:
+        head += f"Content-Length: {len(body)}\r\n"
+    elif chunked:
+        head += "Transfer-Encoding: chunked\r\n"
+    head += f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+    writer.write((head + resp.headers + "\r\n").encode())
+    if not streamed:
+        if body:
+            writer.write(body)
+        await writer.drain()
+        return keep_alive
+
+    if buf is None:
+        buf = bytearray(_CHUNK_SIZE)
+    mv = memoryview(buf)
+    n = 0
+    for piece in body:
+        size = len(piece)
+        if n and n + size > _CHUNK_SIZE:
+            await _send_chunk(writer, mv[:n], chunked)
+            n = 0
+        if size >= _CHUNK_SIZE // 2:
+            await _send_chunk(writer, piece, chunked)
+        elif size:
+            buf[n:n + size] = piece
+            n += size
+    if n:
+        await _send_chunk(writer, mv[:n], chunked)
+    if chunked:
+        writer.write(b"0\r\n\r\n")
+    await writer.drain()
+    return keep_alive
+
+
+async def _send_chunk(writer, data, chunked):
+    if chunked:
+        writer.write(b"%x\r\n" % len(data))
+        writer.write(data)
+        writer.write(b"\r\n")
+    else:
+        writer.write(data)
+    # Drain each chunk: the connection's buffer is refilled next
+    await writer.drain()
 
-            lines = request.split("\r\n")
-            if len(lines) < 1:
-                cl.close()
-                continue
-            request_line = lines[0]
-            parts = request_line.split(" ")
-            if len(parts) < 2:
-                cl.close()
-                continue
-            method = parts[0]
-            path = parts[1].split("?")[0]
-
-            if path == "/" or path == "":
-                response = get_html()
-                cl.send(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n")
-                cl.sendall(response.encode("utf-8") if isinstance(response, str) else response)
-
-            elif path == "/set_master_fill" and method == "POST":
-                params = parse_post(post_body(request))
-                m = params.get("mode", "fill")
-                settings["is_fill_mode"] = m == "fill"
-                save_settings()
-                cl.send(b"HTTP/1.1 303 See Other\r\nLocation: /\r\nConnection: close\r\n\r\n")
-
-            elif path == "/set_unit_mode" and method == "POST":
-                params = parse_post(post_body(request))
-                m = params.get("mode", "gallons")
-                if m in ("counter", "gallons", "pounds"):
-                    settings["unit_mode"] = m
-                    settings["show_pounds"] = m == "pounds"
-                    save_settings()
-                cl.send(b"HTTP/1.1 303 See Other\r\nLocation: /\r\nConnection: close\r\n\r\n")
-
-            elif path == "/set_tank_fill" and method == "POST":
-                params = parse_post(post_body(request))
-                tn = params.get("tank", "")
-                if tn in settings["tank_fill"]:
-                    settings["tank_fill"][tn] = params.get("fill", "1") == "1"
-                    save_settings()
-                cl.send(b"HTTP/1.1 303 See Other\r\nLocation: /\r\nConnection: close\r\n\r\n")
-
-            elif path == "/reset_tank" and method == "POST":
-                params = parse_post(post_body(request))
-                tn = params.get("tank", "")
-                if tn in TANK_CONFIG:
-                    for mi in TANK_CONFIG[tn]["meters"]:
-                        flow_manager.reset_counter(mi)
-                cl.send(b"HTTP/1.1 303 See Other\r\nLocation: /\r\nConnection: close\r\n\r\n")
-
-            elif path == "/set_full" and method == "POST":
-                params = parse_post(post_body(request))
-                tn = params.get("tank", "")
-                if tn in TANK_CONFIG:
-                    counts = flow_manager.get_all_pulse_counts()
-                    total = get_tank_total_pulses(tn, counts)
-                    key = tn.lower()
-                    if key in settings["tank_max"]:
-                        settings["tank_max"][key] = max(1, int(total))
-                        save_settings()
-                cl.send(b"HTTP/1.1 303 See Other\r\nLocation: /\r\nConnection: close\r\n\r\n")
-
-            elif path == "/reset" and method == "POST":
-                params = parse_post(post_body(request))
-                if "meter" in params:
-                    meter = int(params["meter"])
-                    flow_manager.reset_counter(meter)
-                cl.send(b"HTTP/1.1 303 See Other\r\nLocation: /\r\nConnection: close\r\n\r\n")
-
-            elif path == "/reset_all" and method == "POST":
-                flow_manager.reset_all_counters()
-                cl.send(b"HTTP/1.1 303 See Other\r\nLocation: /\r\nConnection: close\r\n\r\n")
-
-            elif path == "/check_updates" and method == "POST":
-                updates = check_github_updates()
-                if updates:
-                    response = f"""<!DOCTYPE html>
-<html><head><title>Updates</title><meta name="viewport" content="width=device-width, initial-scale=1"></head>
+
+_clients = 0
+
+
+async def _serve_client(reader, writer):
+    """One connection: requests are served in turn until close, idle timeout or error"""
+    global _clients
+    after = None
+    if _clients >= HTTP_MAX_CLIENTS:
+        try:
+            await _send(writer, Response("Busy", "text/plain", "503 Service Unavailable"), False)
+        except Exception:
+            pass
+        writer.close()
+        await writer.wait_closed()
+        return
+    _clients += 1
+    streaming = False
+    req = Request()
+    chunk_buf = bytearray(_CHUNK_SIZE)
+    try:
+        first = True
+        while True:
+            # The first request has the request timeout; later ones may idle until keep-alive expires
+            wait_ms = HTTP_REQUEST_TIMEOUT_MS if first else HTTP_KEEPALIVE_MS
+            first = False
+            try:
+                if not await asyncio.wait_for(req.read(reader), wait_ms / 1000):
+                    break
+            except HTTPError as e:
+                await _send(writer, Response(e.status, "text/plain", e.status), False)
+                break
+            try:
+                resp = dispatch(req)
+            except Exception as e:
+                print(f"Error: {req.method} {req.path}: {e}")
+                resp = Response("Internal error", "text/plain", "500 Internal Server Error")
+            if resp.stream:
+                # Long-lived: counted against STREAM_MAX_CLIENTS instead
+                streaming = True
+                _clients -= 1
+                await resp.stream(reader, writer)
+                break
+            keep_alive = req.keep_alive() and resp.after is None
+            keep_alive = await _send(writer, resp, keep_alive, req.http11, chunk_buf)
+            if not keep_alive:
+                after = resp.after
+                break
+    except Exception as e:
+        # Timeouts and dropped connections end up here; neither needs a reply
+        if not isinstance(e, (asyncio.TimeoutError, OSError, EOFError)):
+            print(f"Error: {e}")
+    finally:
+        if not streaming:
+            _clients -= 1
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+    if after:
+        await asyncio.sleep(0.5)
+        after()
+
+
+def _reset_device():
+    import machine
+
+    checkpoints.flush()
+    machine.reset()
+
+
+_ip = ""
+
+
+def _page(title, body, head=""):
+    return f"""<!DOCTYPE html>
+<html><head><title>{title}</title><meta name="viewport" content="width=device-width, initial-scale=1">{head}</head>
 <body style="font-family:system-ui;padding:20px;background:#fff;color:#333;">
-<h2>Updates available</h2>
+{body}
+</body></html>"""
+
+
+def _updates_page():
+    if _update_check["state"] == "running":
+        return _page("Updates", "<h2>Checking for updates…</h2>", '<meta http-equiv="refresh" content="2">')
+    updates = _update_check["files"]
+    if _update_check["error"]:
+        return _page("Updates", f"<h2>Update check failed</h2>\n<p>{_update_check['error']}</p>\n<p><a href=\"/\">Back</a></p>")
+    if not updates:
+        return _page("Updates", '<h2>Up to date</h2>\n<p><a href="/">Back</a></p>')
+    return _page("Updates", f"""<h2>Updates available</h2>
 <p>{", ".join(updates)}</p>
 <form method="POST" action="/install_updates">
 <input type="hidden" name="files" value="{",".join(updates)}">
 <button type="submit" style="background:#4CAF50;color:#fff;border:none;padding:12px 20px;border-radius:8px;font-size:16px;">Install</button>
 </form>
-<p><a href="/">Back</a></p>
-</body></html>"""
-                else:
-                    response = """<!DOCTYPE html>
-<html><head><title>Updates</title><meta name="viewport" content="width=device-width, initial-scale=1"></head>
-<body style="font-family:system-ui;padding:20px;background:#fff;color:#333;">
-<h2>Up to date</h2>
-<p><a href="/">Back</a></p>
-</body></html>"""
-                cl.send(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n")
-                cl.sendall(response.encode("utf-8"))
-
-            elif path == "/install_updates" and method == "POST":
-                params = parse_post(post_body(request))
-                if "files" in params:
-                    files = params["files"].split(",")
-                    results = install_github_updates(files)
-                    result_html = "<br>".join(results)
-                    response = f"""<!DOCTYPE html>
+<p><a href="/">Back</a></p>""")
+
+
+# Route table: path -> {method: handler(request) -> Response}, filled by @route
+_ROUTES = {}
+
+
+def route(method, path):
+    def register(fn):
+        _ROUTES.setdefault(path, {})[method] = fn
+        return fn
+
+    return register
+
+
+def dispatch(req):
+    """Find the handler with one dict lookup, however many routes there are"""
+    methods = _ROUTES.get(req.path)
+    if methods is None:
+        return Response(b"", None, "404 Not Found")
+    handler = methods.get(req.method)
+    if handler is None:
+        return Response(b"", None, "405 Method Not Allowed", f"Allow: {', '.join(methods)}\r\n")
+    return handler(req)
+
+
+@route("GET", "/")
+def _index(req):
+    # The shell is small and always current; its CSS and JS are cached
+    return Response(get_html(), headers="Cache-Control: no-cache\r\n")
+
+
+@route("GET", "/app.css")
+def _app_css(req):
+    return _APP_CSS.response(req.header(b"if-none-match"))
+
+
+@route("GET", "/app.js")
+def _app_js(req):
+    return _APP_JS.response(req.header(b"if-none-match"))
+
+
+@route("GET", "/api/live")
+def _api_live(req):
+    return _json(live_state())
+
+
+@route("GET", "/api/stream")
+def _api_stream(req):
+    return Response(stream=_stream_events)
+
+
+@route("POST", "/set_master_fill")
+def _set_master_fill(req):
+    m = req.form().get("mode", "fill")
+    settings["is_fill_mode"] = m == "fill"
+    save_settings()
+    return _redirect()
+
+
+@route("POST", "/set_unit_mode")
+def _set_unit_mode(req):
+    m = req.form().get("mode", "gallons")
+    if m in ("counter", "gallons", "pounds"):
+        settings["unit_mode"] = m
+        settings["show_pounds"] = m == "pounds"
+        save_settings()
+    return _redirect()
+
+
+@route("POST", "/set_tank_fill")
+def _set_tank_fill(req):
+    params = req.form()
+    tn = params.get("tank", "")
+    if tn in settings["tank_fill"]:
+        settings["tank_fill"][tn] = params.get("fill", "1") == "1"
+        save_settings()
+    return _redirect()
+
+
+@route("POST", "/reset_tank")
+def _reset_tank(req):
+    tn = req.form().get("tank", "")
+    if tn in TANK_CONFIG:
+        for mi in TANK_CONFIG[tn]["meters"]:
+            flow_manager.reset_counter(mi)
+    return _redirect()
+
+
+@route("POST", "/set_full")
+def _set_full(req):
+    tn = req.form().get("tank", "")
+    if tn in TANK_CONFIG:
+        counts = flow_manager.get_all_pulse_counts()
+        total = get_tank_total_pulses(tn, counts)
+        key = tn.lower()
+        if key in settings["tank_max"]:
+            settings["tank_max"][key] = max(1, int(total))
+            save_settings()
+    return _redirect()
+
+
+@route("POST", "/reset")
+def _reset(req):
+    params = req.form()
+    if "meter" in params:
+        meter = int(params["meter"])
+        flow_manager.reset_counter(meter)
+    return _redirect()
+
+
+@route("POST", "/reset_all")
+def _reset_all(req):
+    flow_manager.reset_all_counters()
+    return _redirect()
+
+
+@route("POST", "/check_updates")
+def _check_updates(req):
+    # Runs in the background; /updates shows progress, then the result
+    if _update_check["state"] != "running":
+        _update_check["state"] = "running"
+        asyncio.create_task(_run_update_check())
+    return _redirect("/updates")
+
+
+@route("GET", "/updates")
+def _updates(req):
+    return Response(_updates_page())
+
+
+@route("POST", "/install_updates")
+def _install_updates(req):
+    # Blocks the server while it downloads; the device restarts right after
+    params = req.form()
+    if "files" not in params:
+        return Response("<html><body>Error</body></html>")
+    results, installed = install_github_updates(params["files"].split(","))
+    result_html = "<br>".join(results)
+    response = f"""<!DOCTYPE html>
 <html><head><title>Done</title><meta http-equiv="refresh" content="3;url=/"></head>
 <body style="font-family:system-ui;padding:20px;background:#fff;color:#333;">
 <h2>Update results</h2>
 <p>{result_html}</p>
-<p>Restarting…</p>
+<p>{"Restarting…" if installed else "No changes made."}</p>
 </body></html>"""
-                    cl.send(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n")
-                    cl.sendall(response.encode("utf-8"))
-                    cl.close()
-                    import machine
-                    sleep(3)
-                    machine.reset()
-                else:
-                    cl.send(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: close\r\n\r\n")
-                    cl.sendall(b"<html><body>Error</body></html>")
-
-            elif path == "/api/pulses" and method == "GET":
-                update_flow_history()
-                counts = flow_manager.get_all_pulse_counts()
-                body = json.dumps({"pulses": counts})
-                cl.send(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n")
-                cl.sendall(body.encode("utf-8"))
-
-            elif path == "/api/settings" and method == "GET":
-                body = json.dumps(settings_for_api())
-                cl.send(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n")
-                cl.sendall(body.encode("utf-8"))
-
-            elif path == "/api/settings" and method == "POST":
-                raw = post_body(request)
-                try:
-                    data = json.loads(raw)
-                    apply_settings_from_json(data)
-                    body = json.dumps({"ok": True, "settings": settings_for_api()})
-                except Exception as e:
-                    body = json.dumps({"ok": False, "error": str(e)})
-                cl.send(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n")
-                cl.sendall(body.encode("utf-8"))
-
-            elif path == "/api/info" and method == "GET":
-                update_flow_history()
-                counts = flow_manager.get_all_pulse_counts()
-                body = json.dumps(
-                    {
-                        "version": VERSION,
-                        "ip": ip,
-                        "pulses": counts,
-                        "files": build_file_versions(),
-                        "settings": settings_for_api(),
-                    }
-                )
-                cl.send(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n\r\n")
-                cl.sendall(body.encode("utf-8"))
-
-            elif path == "/reboot_to_ble" and method == "POST":
-                cl.send(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nConnection: close\r\n\r\nOK")
-                cl.close()
-                import machine
-                sleep(0.3)
-                machine.reset()
+    return Response(response, after=_reset_device if installed else None)
 
-            else:
-                cl.send(b"HTTP/1.1 404 Not Found\r\nConnection: close\r\n\r\n")
 
-            cl.close()
-            
-        except Exception as e:
-            print(f'Error: {e}')
-            try:
-                cl.close()
-            except:
-                pass
+@route("GET", "/api/pulses")
+def _api_pulses(req):
+    return _json(
+        {"pulses": flow_manager.get_all_pulse_counts(), "rates": flow_rates(), "avg_rates": avg_flow_rates()}
+    )
+
+
+@route("GET", "/api/settings")
+def _api_settings(req):
+    return _json(settings_for_api())
+
+
+@route("POST", "/api/settings")
+def _api_settings_post(req):
+    try:
+        data = json.loads(req.text())
+        apply_settings_from_json(data)
+        return _json({"ok": True, "settings": settings_for_api()})
+    except Exception as e:
+        return _json({"ok": False, "error": str(e)})
+
+
+@route("GET", "/api/info")
+def _api_info(req):
+    counts = flow_manager.get_all_pulse_counts()
+    return _json(
+        {
+            "version": VERSION,
+            "ip": _ip,
+            "pulses": counts,
+            "rejects": flow_manager.get_all_reject_counts(),
+            "files": build_file_versions(),
+            "ota": ota.load_state(),
+            "ota_encodings": ota.ENCODINGS,
+            "settings": settings_for_api(),
+        }
+    )
+
+
+@route("GET", "/api/boot")
+def _api_boot(req):
+    return _json(boottime.summary(BOOT_BUDGET_MS.get("wifi")))
+
 
-def notify_wifi_ip(ip_addr):
+@route("GET", "/api/manifest")
+def _api_manifest(req):
+    return _json({"release": VERSION, "files": ota.device_manifest(UPDATE_FILES)})
+
+
+@route("POST", "/reboot_to_ble")
+def _reboot_to_ble(req):
+    return Response("OK", "text/plain", after=_reset_device)
+
+
+async def serve(ip):
+    global _ip
+    _ip = ip
+    start_tasks()
+    await asyncio.start_server(_serve_client, "0.0.0.0", 80, backlog=HTTP_MAX_CLIENTS)
+
+    print(f'\n{"=" * 60}')
+    print(f"Web server running!")
+    print(f"Open: http://{ip}")
+    print(f'{"=" * 60}\n')
+    print("System ready!")
+    boottime.mark("ready")
+    boottime.report(BOOT_BUDGET_MS.get("wifi"))
+    # After the listener is up, in the background: the services can take seconds to answer
+    asyncio.create_task(notify_wifi_ip(ip))
+    while True:
+        await asyncio.sleep(3600)
+
+
+# Start web server (asyncio: several clients at once, keep-alive, background tasks)
+def start_server(ip):
+    asyncio.run(serve(ip))
+
+
+async def notify_wifi_ip(ip_addr):
     msg = "Ballast WiFi " + str(ip_addr) + " — open http://" + str(ip_addr) + "/ (v" + VERSION + ")"
     title = "Ballast Monitor"
 
@@ -984,9 +1743,7 @@ def notify_wifi_ip(ip_addr):
         topic = ""
     if topic:
         try:
-            url = "https://ntfy.sh/" + topic
-            r = urequests.post(url, data=msg.encode("utf-8"), timeout=10)
-            r.close()
+            await _fetch("https://ntfy.sh/" + topic, "POST", msg.encode("utf-8"))
             print("ntfy notification sent")
         except Exception as e:
             print("ntfy notify failed:", e)
@@ -1009,13 +1766,12 @@ def notify_wifi_ip(ip_addr):
                 + "&message="
                 + quote_plus(msg)
             )
-            r = urequests.post(
+            await _fetch(
                 "https://api.pushover.net/1/messages.json",
-                data=body.encode("utf-8"),
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-                timeout=12,
+                "POST",
+                body.encode("utf-8"),
+                {"Content-Type": "application/x-www-form-urlencoded"},
             )
-            r.close()
             print("Pushover notification sent")
         except Exception as e:
             print("Pushover notify failed:", e)
@@ -1023,8 +1779,17 @@ def notify_wifi_ip(ip_addr):
 def run():
     print(f"\nBallast Monitor v{VERSION} - WiFi Mode")
     print("=" * 60)
+    boottime.mark("imports")
+    setup()
+    boottime.mark("meters")
+    # Confirm a trial release once the app is initialized, before joining the network:
+    # an access point that is down or wrong credentials say nothing about the firmware
+    try:
+        ota.mark_good()
+    except Exception as e:
+        print("OTA confirm:", e)
     ip = connect_wifi()
-    notify_wifi_ip(ip)
+    boottime.mark("wifi")
     start_server(ip)
 
 if __name__ == "__main__":
@@ -0,0 +1,921 @@
+"""
+OTA Updates
+Version: 4-19-2026-v1.3
+Streams update files to flash with flat memory use; installs verified bundles atomically with rollback
+"""
+
+import json
+import os
+import struct
+from binascii import crc32, hexlify
+
+try:
+    from hashlib import sha256
+except ImportError:
+    sha256 = None
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    from flow_rate import ticks_ms, ticks_diff
+
+# Compressed payloads: zlib streams made with a 1 KB window (wbits 10, see
+# tools/make_release.py), so inflating never needs more than ~1 KB of history
+ZLIB_SUFFIX = ".z"
+ZLIB_WBITS = 10
+
+try:
+    from deflate import DeflateIO, ZLIB
+
+    def inflate_stream(stream):
+        """Readable stream of the decompressed bytes of a zlib stream"""
+        return DeflateIO(stream, ZLIB, ZLIB_WBITS)
+except ImportError:
+    try:
+        from zlib import DecompIO  # MicroPython before 1.21
+
+        def inflate_stream(stream):
+            return DecompIO(stream, ZLIB_WBITS)
+    except ImportError:
+        import zlib as _zlib  # CPython host
+
+        class _HostInflater:
+            def __init__(self, stream):
+                self._src = stream
+                self._d = _zlib.decompressobj()
+                self._out = b""
+
+            def readinto(self, buf):
+                while not self._out and not self._d.eof:
+                    data = self._src.read(len(buf))
+                    self._out = self._d.decompress(data) if data else self._d.flush()
+                    if not data:
+                        break
+                n = min(len(buf), len(self._out))
+                buf[:n] = self._out[:n]
+                self._out = self._out[n:]
+                return n
+
+        def inflate_stream(stream):
+            return _HostInflater(stream)
+
+ENCODINGS = ["zlib"]
+
+# Bytes gathered in RAM before each flash write
+WRITE_BUFFER_SIZE = 1024
+TEMP_SUFFIX = ".part"
+# Sidecar describing a suspended transfer: {"size": n, "hash": hex digest}
+RESUME_SUFFIX = ".resume"
+
+# Expected digests are identified by length: 4 bytes = CRC32 (little-endian), 32 = SHA-256
+CRC32_SIZE = 4
+SHA256_SIZE = 32
+
+
+def replace_file(src, dst):
+    """Rename src over dst (LittleFS replaces in one step; FAT needs dst removed first)"""
+    try:
+        os.rename(src, dst)
+    except OSError:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        os.rename(src, dst)
+
+
+def remove_quiet(name):
+    try:
+        os.remove(name)
+    except OSError:
+        pass
+
+
+def _ensure_dir(path):
+    try:
+        os.mkdir(path)
+    except OSError:
+        pass  # exists
+
+
+def file_size(name):
+    try:
+        return os.stat(name)[6]
+    except OSError:
+        return -1
+
+
+class _Crc32:
+    """hashlib-style wrapper so CRC32 and SHA-256 are fed the same way"""
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = crc32(data, self.value)
+
+    def digest(self):
+        return struct.pack("<I", self.value & 0xFFFFFFFF)
+
+
+def new_hasher(expected):
+    """Hasher matching an expected digest (CRC32 when there is none)"""
+    if expected is not None and len(expected) == SHA256_SIZE:
+        if sha256 is None:
+            raise ValueError("SHA-256 not available")
+        return sha256()
+    return _Crc32()
+
+
+class FileSink:
+    """
+    Receives one file in chunks of any size. Chunks are copied into a fixed write
+    buffer and flushed to "<target>.part" whenever it fills, and a running hash is
+    kept, so nothing grows with the file size. finish() checks the byte count and
+    the expected digest (CRC32 or SHA-256, if one was given) and only then renames
+    the temp file over the target; on any failure the target is left untouched.
+    A target ending in ".z" is a zlib stream: once verified it is inflated into the
+    name without ".z" (the digest covers the compressed bytes as sent). A target
+    ending in ".d" is a delta patch, applied to the installed file of that name.
+    With size None the length is not checked.
+
+    suspend() keeps the temp file plus a small ".resume" sidecar. A later sink for
+    the same target, size and digest picks up where it stopped: the hash is rebuilt
+    from the bytes already on flash and received starts at their length. Resuming
+    needs an expected digest, so a different file can never be appended to.
+    """
+
+    def __init__(self, target, size, expected_hash=None, buf_size=WRITE_BUFFER_SIZE):
+        if expected_hash is not None and len(expected_hash) not in (CRC32_SIZE, SHA256_SIZE):
+            raise ValueError("digest must be 4 (CRC32) or 32 (SHA-256) bytes")
+        self.target = target
+        self.temp = target + TEMP_SUFFIX
+        self.size = size
+        self.expected_hash = expected_hash
+        self.received = 0
+        self._hash = new_hasher(expected_hash)
+        self._buf = bytearray(buf_size)
+        self._mv = memoryview(self._buf)
+        self._fill = 0
+        if "/" in target:
+            _ensure_dir(target.rsplit("/", 1)[0])
+        self.resumed_from = self._resume() if expected_hash is not None else 0
+        if self.resumed_from:
+            self._f = open(self.temp, "ab")
+        else:
+            self._f = open(self.temp, "wb")
+            self._save_resume_info()
+        self._t0 = ticks_ms()
+
+    def _resume_info(self):
+        return {"size": self.size, "hash": hexlify(self.expected_hash).decode()}
+
+    def _save_resume_info(self):
+        name = self.target + RESUME_SUFFIX
+        if self.expected_hash is None:
+            remove_quiet(name)
+            return
+        with open(name, "w") as f:
+            json.dump(self._resume_info(), f)
+
+    def _resume(self):
+        """Rehash a matching partial temp file; returns its length (0 = start over)"""
+        try:
+            with open(self.target + RESUME_SUFFIX) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        have = file_size(self.temp)
+        if info != self._resume_info() or have <= 0 or have > self.size:
+            return 0
+        buf = self._buf
+        mv = self._mv
+        with open(self.temp, "rb") as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                self._hash.update(mv[:n])
+        self.received = have
+        print(f"OTA {self.target}: resuming at {have}/{self.size} bytes")
+        return have
+
+    def rate_bps(self):
+        """Average bytes/s since the sink was opened (resumed bytes excluded)"""
+        ms = ticks_diff(ticks_ms(), self._t0)
+        return (self.received - self.resumed_from) * 1000 // ms if ms > 0 else 0
+
+    def write(self, data):
+        """Append a chunk; returns False (and aborts) if it would overrun the declared size"""
+        n = len(data)
+        if self._f is None:
+            return False
+        if self.size is not None and self.received + n > self.size:
+            print(f"OTA {self.target}: {self.received + n} bytes exceeds declared {self.size}")
+            self.abort()
+            return False
+        self._hash.update(data)
+        self.received += n
+        src = memoryview(data)
+        buf_size = len(self._buf)
+        pos = 0
+        while pos < n:
+            take = min(buf_size - self._fill, n - pos)
+            self._mv[self._fill:self._fill + take] = src[pos:pos + take]
+            self._fill += take
+            pos += take
+            if self._fill == buf_size:
+                self._flush()
+        return True
+
+    def _flush(self):
+        if self._fill:
+            self._f.write(self._mv[:self._fill])
+            self._fill = 0
+
+    def _close(self):
+        """Flush and close the temp file; False (after aborting) if the write fails"""
+        try:
+            self._flush()
+            self._f.close()
+        except OSError as e:
+            print(f"OTA {self.target}: write failed: {e}")
+            self.abort()
+            return False
+        self._f = None
+        return True
+
+    def suspend(self):
+        """Keep what arrived so a later sink can resume (only with an expected digest)"""
+        if self._f is None:
+            return
+        if self.expected_hash is None:
+            self.abort()
+            return
+        if self._close():
+            print(f"OTA {self.target}: suspended at {self.received}/{self.size} bytes")
+
+    def finish(self):
+        """Flush, verify and install; returns True when the target was replaced"""
+        if self._f is None or not self._close():
+            return False
+        remove_quiet(self.target + RESUME_SUFFIX)
+        digest = self._hash.digest()
+        print(f"OTA {self.target}: {self.received} bytes in "
+              f"{ticks_diff(ticks_ms(), self._t0)} ms ({self.rate_bps()} B/s)")
+        if self.size is not None and self.received != self.size:
+            print(f"OTA {self.target}: got {self.received} of {self.size} bytes")
+            remove_quiet(self.temp)
+            return False
+        if self.expected_hash is not None and digest != self.expected_hash:
+            print(f"OTA {self.target}: hash {hexlify(digest).decode()} != expected "
+                  f"{hexlify(self.expected_hash).decode()}, rejected")
+            remove_quiet(self.temp)
+            return False
+        if self.target.endswith(ZLIB_SUFFIX):
+            return inflate_file(self.temp, self.target[:-len(ZLIB_SUFFIX)])
+        if self.target.endswith(PATCH_SUFFIX):
+            return patch_file(self.temp, self.target[:-len(PATCH_SUFFIX)])
+        replace_file(self.temp, self.target)
+        if self.target.endswith(".py") and not self.target.startswith(STAGING_DIR + "/"):
+            invalidate_bytecode(self.target)
+            note_installed((self.target,))
+        print(f"OTA {self.target}: installed {self.received} bytes, hash {hexlify(digest).decode()}")
+        return True
+
+    def abort(self):
+        """Drop the partial temp file"""
+        if self._f is not None:
+            try:
+                self._f.close()
+            except OSError:
+                pass
+            self._f = None
+        remove_quiet(self.temp)
+        remove_quiet(self.target + RESUME_SUFFIX)
+
+
+# ---------------------------------------------------------------------------
+# Firmware bundles: every file of a release is staged, verified, then swapped in
+# together under a journal, and the first boots run on trial with rollback.
+# ---------------------------------------------------------------------------
+
+STAGING_DIR = "ota_new"
+BACKUP_DIR = "ota_old"
+MANIFEST_NAME = "manifest.json"
+STATE_FILE = "ota_state.json"
+# A trial boot must call mark_good() within this long, or it resets; after
+# TRIAL_BOOTS such boots the previous files are restored
+TRIAL_TIMEOUT_MS = 90000
+TRIAL_BOOTS = 2
+
+_trial_timer = None
+
+
+def _exists(name):
+    return file_size(name) >= 0
+
+
+def _clear_dir(path):
+    """Empty (or create) a flat directory"""
+    try:
+        names = os.listdir(path)
+    except OSError:
+        os.mkdir(path)
+        return
+    for n in names:
+        remove_quiet(path + "/" + n)
+
+
+def stage_path(name):
+    return STAGING_DIR + "/" + name
+
+
+def install_path(name):
+    """Where a bundle file lives once installed: .mpy files go to MPY_DIR"""
+    return MPY_DIR + "/" + name if name.endswith(".mpy") else name
+
+
+def load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(state):
+    with open(STATE_FILE + ".tmp", "w") as f:
+        json.dump(state, f)
+    replace_file(STATE_FILE + ".tmp", STATE_FILE)
+
+
+def begin_bundle():
+    """Start a new bundle: empty the staging directory"""
+    _clear_dir(STAGING_DIR)
+    print("OTA bundle: staging cleared")
+
+
+def stage_stream(name, stream, size, encoding=None):
+    """Copy a readable stream (e.g. an HTTP body) into the staging directory"""
+    if encoding == "zlib":
+        # size is the inflated length; read the compressed body to its end
+        return copy_stream(inflate_stream(stream), stage_path(name), size, bounded=False)
+    return copy_stream(stream, stage_path(name), size)
+
+
+def copy_stream(stream, target, size=None, bounded=True):
+    """
+    Copy a readable stream into target through a FileSink; returns the byte count or
+    raises OSError. With bounded, reads stop at size (an HTTP body may stay open).
+    """
+    sink = FileSink(target, size)
+    buf = bytearray(WRITE_BUFFER_SIZE)
+    mv = memoryview(buf)
+    try:
+        while True:
+            want = len(buf)
+            if bounded and size is not None:
+                want = min(want, size - sink.received)
+                if want <= 0:
+                    break
+            n = stream.readinto(mv[:want])
+            if not n:
+                break
+            if not sink.write(mv[:n]):
+                break
+    except Exception:
+        sink.abort()
+        raise
+    if not sink.finish():
+        raise OSError("incomplete file")
+    return sink.received
+
+
+def inflate_file(src, dst):
+    """Decompress a zlib file into dst (replaced only when complete), then delete src"""
+    try:
+        with open(src, "rb") as f:
+            size = copy_stream(inflate_stream(f), dst)
+    except (OSError, ValueError) as e:
+        print(f"OTA {dst}: inflate failed: {e}")
+        return False
+    finally:
+        remove_quiet(src)
+    print(f"OTA {dst}: inflated to {size} bytes")
+    return True
+
+
+def write_manifest(release, files):
+    """Write the staging manifest: files maps name -> {"size": n[, "sha256": hex]}"""
+    with open(stage_path(MANIFEST_NAME), "w") as f:
+        json.dump({"release": release, "files": files}, f)
+
+
+def _hash_file(name, hasher):
+    buf = bytearray(WRITE_BUFFER_SIZE)
+    mv = memoryview(buf)
+    with open(name, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(mv[:n])
+    return hexlify(hasher.digest()).decode()
+
+
+def verify_staged():
+    """Return (manifest, None) if every staged file matches the manifest, else (None, error)"""
+    try:
+        with open(stage_path(MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        files = manifest["files"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, "no valid manifest"
+    if not files:
+        return None, "empty bundle"
+    for name, meta in files.items():
+        if "/" in name or name.startswith(".") or name == MANIFEST_NAME:
+            return None, f"bad file name {name}"
+        path = stage_path(name)
+        size = file_size(path)
+        if size < 0:
+            return None, f"{name} missing"
+        if "size" in meta and size != meta["size"]:
+            return None, f"{name} is {size} bytes, expected {meta['size']}"
+        if "sha256" in meta and sha256 is not None:
+            if _hash_file(path, sha256()) != meta["sha256"].lower():
+                return None, f"{name} SHA-256 mismatch"
+    return manifest, None
+
+
+def _swap(state):
+    """Move staged files into place, backing up the old ones. Safe to repeat after a crash."""
+    names = state["files"]
+    if any(n.endswith(".mpy") for n in names):
+        _ensure_dir(MPY_DIR)
+    for name in names:
+        staged = stage_path(name)
+        if not _exists(staged):
+            continue  # already swapped
+        dest = install_path(name)
+        backup = BACKUP_DIR + "/" + name
+        if _exists(dest) and not _exists(backup):
+            os.rename(dest, backup)
+        replace_file(staged, dest)
+        if name.endswith(".py") and name[:-3] + ".mpy" not in names:
+            invalidate_bytecode(name)
+    note_installed(names)
+    note_bytecode(names)
+
+
+def commit_bundle():
+    """Verify the staged bundle and swap it in; returns (ok, message). Reboot afterwards."""
+    manifest, err = verify_staged()
+    if err:
+        print(f"OTA bundle rejected: {err}")
+        return False, err
+    names = list(manifest["files"])
+    _clear_dir(BACKUP_DIR)
+    state = {
+        "state": "swapping",
+        "release": manifest.get("release", "unknown"),
+        "files": names,
+        "new": [n for n in names if not _exists(install_path(n))],
+    }
+    # The journal is written before the first rename, so a power cut mid-swap is
+    # finished by boot_check() instead of leaving a mix of versions
+    _save_state(state)
+    _swap(state)
+    state["state"] = "trial"
+    state["boots"] = 0
+    _save_state(state)
+    remove_quiet(stage_path(MANIFEST_NAME))
+    msg = f"release {state['release']} installed ({len(names)} files), trial boot next"
+    print(f"OTA bundle: {msg}")
+    return True, msg
+
+
+def rollback(state=None):
+    """Put the backed-up files of the last bundle back"""
+    state = state or load_state()
+    if not state or "files" not in state:
+        return False
+    for name in state["files"]:
+        backup = BACKUP_DIR + "/" + name
+        if _exists(backup):
+            replace_file(backup, install_path(name))
+        elif name in state.get("new", ()):
+            remove_quiet(install_path(name))
+    note_installed(state["files"])
+    note_bytecode(state["files"])
+    _save_state({"state": "rolled_back", "release": state.get("release", "unknown")})
+    print(f"OTA: rolled back release {state.get('release')}")
+    return True
+
+
+def _trial_expired(_t):
+    print("OTA: trial boot did not reach ready in time - resetting")
+    import machine
+
+    machine.reset()
+
+
+def boot_check(timeout_ms=TRIAL_TIMEOUT_MS, max_boots=TRIAL_BOOTS):
+    """
+    Call first thing at boot. Finishes an interrupted swap, rolls back a release
+    that failed max_boots trial boots (and resets), otherwise arms the trial timer.
+    """
+    global _trial_timer
+    state = load_state()
+    if not state:
+        return
+    if state.get("state") == "swapping":
+        print("OTA: finishing interrupted swap")
+        _swap(state)
+        state["state"] = "trial"
+        state["boots"] = 0
+    if state.get("state") != "trial":
+        return
+    state["boots"] = state.get("boots", 0) + 1
+    if state["boots"] > max_boots:
+        rollback(state)
+        import machine
+
+        machine.reset()
+        return
+    _save_state(state)
+    print(f"OTA: trial boot {state['boots']}/{max_boots} of release {state['release']}")
+    try:
+        from machine import Timer
+
+        _trial_timer = Timer(-1)
+        _trial_timer.init(mode=Timer.ONE_SHOT, period=timeout_ms, callback=_trial_expired)
+    except ImportError:
+        pass
+
+
+def mark_good():
+    """Call once the system is up; confirms a trial release"""
+    global _trial_timer
+    if _trial_timer is not None:
+        _trial_timer.deinit()
+        _trial_timer = None
+    state = load_state()
+    if state and state.get("state") == "trial":
+        _save_state({"state": "good", "release": state["release"], "files": state["files"],
+                     "new": state.get("new", [])})
+        print(f"OTA: release {state['release']} confirmed")
+
+
+# ---------------------------------------------------------------------------
+# Delta patches (tools/make_release.py --delta-from): rebuild a file from the
+# installed copy plus the changed bytes, streamed with a fixed buffer.
+# ---------------------------------------------------------------------------
+
+PATCH_SUFFIX = ".d"
+PATCH_MAGIC = b"BMD1"
+# Header: magic, base size, base CRC32, target size, base version length (+ version)
+_PATCH_HEADER = "<4sIIIB"
+_PATCH_HEADER_SIZE = 17
+# Ops: END | COPY <u32 base offset><u32 length> | INSERT <u32 length><bytes>
+OP_END = 0
+OP_COPY = 1
+OP_INSERT = 2
+
+
+def crc32_file(name):
+    """CRC32 of a file as an int, or None if it is missing"""
+    if file_size(name) < 0:
+        return None
+    h = _Crc32()
+    _hash_file(name, h)
+    return h.value & 0xFFFFFFFF
+
+
+def _read_exact(stream, mv):
+    got = 0
+    while got < len(mv):
+        n = stream.readinto(mv[got:])
+        if not n:
+            raise OSError("patch truncated")
+        got += n
+
+
+def apply_patch(base, patch, target):
+    """
+    Write target from the base file plus a patch stream (a file, an inflating
+    stream or an HTTP body). The base must match the size and CRC32 the patch was
+    made against; target is replaced only when complete. Returns the target size.
+    """
+    scratch = bytearray(_PATCH_HEADER_SIZE)
+    smv = memoryview(scratch)
+    _read_exact(patch, smv)
+    magic, base_size, base_crc, target_size, vlen = struct.unpack(_PATCH_HEADER, scratch)
+    if magic != PATCH_MAGIC:
+        raise ValueError("not a delta patch")
+    # The base version can be up to 255 bytes, longer than scratch
+    vbuf = bytearray(vlen)
+    _read_exact(patch, memoryview(vbuf))
+    version = bytes(vbuf).decode()
+    if file_size(base) != base_size or crc32_file(base) != base_crc:
+        raise ValueError(f"{base} is not the patch base ({version})")
+
+    sink = FileSink(target, target_size)
+    buf = bytearray(WRITE_BUFFER_SIZE)
+    mv = memoryview(buf)
+    try:
+        with open(base, "rb") as src:
+            while True:
+                _read_exact(patch, smv[:1])
+                op = scratch[0]
+                if op == OP_END:
+                    break
+                if op == OP_COPY:
+                    _read_exact(patch, smv[:8])
+                    offset, n = struct.unpack_from("<II", scratch)
+                    src.seek(offset)
+                    stream = src
+                elif op == OP_INSERT:
+                    _read_exact(patch, smv[:4])
+                    n = struct.unpack_from("<I", scratch)[0]
+                    stream = patch
+                else:
+                    raise ValueError(f"bad patch op {op}")
+                while n:
+                    k = min(n, len(buf))
+                    _read_exact(stream, mv[:k])
+                    if not sink.write(mv[:k]):
+                        raise ValueError("patch output too long")
+                    n -= k
+    except Exception:
+        sink.abort()
+        raise
+    if not sink.finish():
+        raise OSError("patch output incomplete")
+    print(f"OTA {target}: patched from {version} ({target_size} bytes)")
+    return target_size
+
+
+def _patch_base(target):
+    """The installed file a patch for target applies to (staged files patch the live copy)"""
+    prefix = STAGING_DIR + "/"
+    return target[len(prefix):] if target.startswith(prefix) else target
+
+
+def patch_file(src, dst):
+    """Apply a received patch file to dst's installed copy, then delete the patch"""
+    try:
+        with open(src, "rb") as f:
+            apply_patch(_patch_base(dst), f, dst)
+    except (OSError, ValueError) as e:
+        print(f"OTA {dst}: patch failed: {e}")
+        return False
+    finally:
+        remove_quiet(src)
+    return True
+
+
+def stage_patch(name, stream, encoding=None):
+    """Rebuild name in the staging directory from the installed copy and a patch stream"""
+    if encoding == "zlib":
+        stream = inflate_stream(stream)
+    return apply_patch(name, stream, stage_path(name))
+
+
+# ---------------------------------------------------------------------------
+# Precompiled modules (tools/make_release.py --mpy): .mpy files live in MPY_DIR,
+# which goes first on sys.path so they load instead of compiling the .py sources.
+# The sources stay for version tags, update checks and as the fallback.
+# ---------------------------------------------------------------------------
+
+MPY_DIR = "mpy"
+# module -> {"size", "mtime", "hash"} of the .py each installed .mpy was compiled from
+MPY_SOURCES = MPY_DIR + "/sources.json"
+
+
+def bytecode_version():
+    """The .mpy format version this firmware loads, or None (CPython)"""
+    import sys
+
+    mpy = getattr(sys.implementation, "_mpy", None)
+    return None if mpy is None else mpy & 0xFF
+
+
+def _load_sources():
+    try:
+        with open(MPY_SOURCES) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_sources(sources):
+    try:
+        with open(MPY_SOURCES + ".tmp", "w") as f:
+            json.dump(sources, f)
+        replace_file(MPY_SOURCES + ".tmp", MPY_SOURCES)
+    except OSError as e:
+        print(f"{MPY_SOURCES} not saved: {e}")
+
+
+def _source_hash(py_name):
+    return _hash_file(py_name, sha256() if sha256 else _Crc32())
+
+
+def _source_info(py_name):
+    """Size, mtime (0 where the filesystem keeps none) and hash of a module source"""
+    st = os.stat(py_name)
+    return {"size": st[6], "mtime": st[8], "hash": _source_hash(py_name)}
+
+
+def note_bytecode(names):
+    """Record the installed source of every .mpy among names (after a swap or rollback)"""
+    modules = [n.rsplit("/", 1)[-1][:-4] for n in names if n.endswith(".mpy")]
+    if not modules:
+        return  # source-only bundle: nothing to record
+    _ensure_dir(MPY_DIR)
+    sources = _load_sources()
+    for module in modules:
+        try:
+            if not _exists(MPY_DIR + "/" + module + ".mpy"):
+                raise OSError
+            sources[module] = _source_info(module + ".py")
+        except OSError:
+            sources.pop(module, None)
+    _save_sources(sources)
+
+
+def invalidate_bytecode(py_name):
+    """Drop the .mpy of a module whose source was just replaced, so it cannot shadow it"""
+    if py_name.startswith(STAGING_DIR + "/"):
+        return  # staged, not installed yet
+    name = py_name.rsplit("/", 1)[-1]
+    remove_quiet(MPY_DIR + "/" + name[:-3] + ".mpy")
+
+
+def _bytecode_problem(module, want, rec):
+    """Why mpy/<module>.mpy must not load, or None if it matches its source"""
+    if want is not None:
+        with open(MPY_DIR + "/" + module + ".mpy", "rb") as f:
+            header = f.read(2)
+        if len(header) < 2 or header[0] != ord("M") or header[1] != want:
+            return f"not .mpy v{want} bytecode"
+    try:
+        st = os.stat(module + ".py")
+    except OSError:
+        return None  # no source to shadow
+    if rec is None:
+        return "source it was built from unknown"
+    if st[6] != rec["size"]:
+        return "source changed"
+    if st[8] and rec["mtime"]:
+        return "source changed" if st[8] != rec["mtime"] else None
+    # No mtimes on this filesystem: compare the contents
+    return "source changed" if _source_hash(module + ".py") != rec["hash"] else None
+
+
+def use_bytecode():
+    """
+    Put MPY_DIR first on sys.path if it holds .mpy files this firmware can load.
+    Every .mpy is checked first: one of the wrong format, or whose .py was changed
+    since it was installed (e.g. copied over USB), is deleted so the source loads.
+    """
+    import sys
+
+    try:
+        names = [n for n in os.listdir(MPY_DIR) if n.endswith(".mpy")]
+    except OSError:
+        return False
+    want = bytecode_version()
+    sources = _load_sources()
+    kept = {}
+    for name in names:
+        module = name[:-4]
+        rec = sources.get(module)
+        try:
+            problem = _bytecode_problem(module, want, rec)
+        except (OSError, KeyError, TypeError):
+            problem = "unreadable"
+        if problem:
+            print(f"Removing {MPY_DIR}/{name}: {problem}")
+            remove_quiet(MPY_DIR + "/" + name)
+        else:
+            kept[module] = rec
+    known = {m: r for m, r in kept.items() if r is not None}
+    if known != sources:
+        _save_sources(known)
+    if not kept:
+        return False
+    if MPY_DIR not in sys.path:
+        sys.path.insert(0, MPY_DIR)
+    print(f"Using {len(kept)} precompiled modules from {MPY_DIR}/")
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Device manifest: version, size and SHA-256 of every installed file, kept in
+# DEVICE_MANIFEST so boot and /api/info need not read the files each time.
+# ---------------------------------------------------------------------------
+
+DEVICE_MANIFEST = "device_manifest.json"
+_device = None  # RAM copy: name -> {"version", "size", "mtime", "sha256"}
+
+
+def _scan_file(name):
+    """Manifest entry from the file itself (the slow path: reads it twice)"""
+    from config import read_py_file_version
+
+    try:
+        st = os.stat(name)
+    except OSError:
+        return None
+    return {
+        "version": read_py_file_version(name),
+        "size": st[6],
+        "mtime": st[8],
+        "sha256": _hash_file(name, sha256()) if sha256 else "",
+    }
+
+
+def _entry_stale(name, e, st):
+    """True if a saved manifest entry no longer describes the file (st: its os.stat)"""
+    if e.get("size") != st[6]:
+        return True
+    if st[8] and e.get("mtime"):
+        return st[8] != e["mtime"]
+    # No mtimes on this filesystem (or none saved yet): compare the contents
+    if sha256 is None:
+        from config import read_py_file_version
+
+        return read_py_file_version(name) != e.get("version")
+    return _hash_file(name, sha256()) != e.get("sha256")
+
+
+def _load_device_manifest():
+    try:
+        with open(DEVICE_MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_device_manifest(entries):
+    with open(DEVICE_MANIFEST + ".tmp", "w") as f:
+        json.dump(entries, f)
+    replace_file(DEVICE_MANIFEST + ".tmp", DEVICE_MANIFEST)
+
+
+def device_manifest(names):
+    """
+    name -> {"version", "size", "mtime", "sha256"} for the installed files among
+    names. Read from DEVICE_MANIFEST once per boot; only a file missing from it or
+    changed since (e.g. copied over USB: size or mtime differ, or where there are no
+    mtimes the SHA-256) is scanned, and the result is saved.
+    """
+    global _device
+    if _device is not None:
+        return _device
+    cached = _load_device_manifest()
+    entries = {}
+    dirty = False
+    for name in names:
+        e = cached.get(name)
+        try:
+            st = os.stat(name)
+        except OSError:
+            dirty = dirty or e is not None
+            continue
+        if not e or _entry_stale(name, e, st):
+            e = _scan_file(name)
+            dirty = True
+        elif st[8] and e.get("mtime") != st[8]:
+            e["mtime"] = st[8]  # unchanged by its hash; saved before mtimes were kept
+            dirty = True
+        entries[name] = e
+    if dirty or len(entries) != len(cached):
+        try:
+            _save_device_manifest(entries)
+        except OSError as e:
+            print(f"Device manifest not saved: {e}")
+    _device = entries
+    return entries
+
+
+def note_installed(names):
+    """Rescan files an OTA install (or rollback) just replaced into the saved manifest"""
+    global _device
+    entries = _load_device_manifest()
+    for name in names:
+        if not name.endswith(".py"):
+            continue
+        e = _scan_file(name)
+        if e:
+            entries[name] = e
+        else:
+            entries.pop(name, None)
+    try:
+        _save_device_manifest(entries)
+    except OSError as e:
+        print(f"Device manifest not saved: {e}")
+    _device = None
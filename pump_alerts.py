@@ -0,0 +1,105 @@
+"""
+Pump Mismatch Alerts
+Version: 4-19-2026-v1.3
+Always-on check that both pumps of each tank pair run together
+"""
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    from flow_rate import ticks_ms, ticks_diff
+
+# Per-tank alert state
+ALERT_NONE = 0
+ALERT_ONLY_FIRST = 1  # pumps[0] running, pumps[1] not
+ALERT_ONLY_SECOND = 2  # pumps[1] running, pumps[0] not
+
+
+class PumpAlertEngine:
+    """
+    Evaluates every tank pair from a rate source (meter index -> gal/min).
+
+    A pump counts as running once its rate rises above on_rate and stops only when
+    it falls below off_rate (hysteresis). A mismatch must persist for raise_ms before
+    the alert is raised, and be gone for clear_ms before it clears.
+
+    bits packs the state for BLE: tank k (in tank_order) uses bit 2k when only its
+    first pump is running and bit 2k+1 when only its second is.
+    """
+
+    def __init__(self, rate_fn, tanks, tank_order, on_rate, off_rate=None, raise_ms=5000, clear_ms=3000):
+        self._rate_fn = rate_fn
+        self._tanks = [(key, tanks[key]["name"], tanks[key]["pumps"]) for key in tank_order]
+        self._on_rate = on_rate
+        self._off_rate = on_rate * 0.6 if off_rate is None else off_rate
+        self._raise_ms = raise_ms
+        self._clear_ms = clear_ms
+
+        n = len(self._tanks)
+        self._running = {}
+        self._active = [ALERT_NONE] * n
+        self._pending = [ALERT_NONE] * n
+        self._since = [0] * n
+        self.bits = 0
+
+    def _pump_running(self, meter_idx):
+        rate = self._rate_fn(meter_idx)
+        if self._running.get(meter_idx, False):
+            running = rate >= self._off_rate
+        else:
+            running = rate > self._on_rate
+        self._running[meter_idx] = running
+        return running
+
+    def evaluate(self, now_ms=None):
+        """Update alert state; returns True when any tank's alert was raised or cleared"""
+        if now_ms is None:
+            now_ms = ticks_ms()
+        changed = False
+        for k, (_key, name, pumps) in enumerate(self._tanks):
+            first = self._pump_running(pumps[0])
+            second = self._pump_running(pumps[1])
+            if first and not second:
+                cond = ALERT_ONLY_FIRST
+            elif second and not first:
+                cond = ALERT_ONLY_SECOND
+            else:
+                cond = ALERT_NONE
+
+            if cond == self._active[k]:
+                self._pending[k] = cond
+                continue
+            if cond != self._pending[k]:
+                self._pending[k] = cond
+                self._since[k] = now_ms
+                continue
+            hold = self._raise_ms if cond else self._clear_ms
+            if ticks_diff(now_ms, self._since[k]) >= hold:
+                self._active[k] = cond
+                changed = True
+                if cond:
+                    print(f"ALERT {self._message(name, cond)}")
+                else:
+                    print(f"Alert cleared: {name}")
+
+        if changed:
+            bits = 0
+            for k, state in enumerate(self._active):
+                if state == ALERT_ONLY_FIRST:
+                    bits |= 1 << (2 * k)
+                elif state == ALERT_ONLY_SECOND:
+                    bits |= 1 << (2 * k + 1)
+            self.bits = bits
+        return changed
+
+    def _message(self, name, state):
+        which = "1" if state == ALERT_ONLY_FIRST else "2"
+        return f"{name}: Only pump {which} running!"
+
+    def messages(self):
+        """Active alerts as display strings"""
+        return [
+            self._message(name, self._active[k])
+            for k, (_key, name, _pumps) in enumerate(self._tanks)
+            if self._active[k]
+        ]
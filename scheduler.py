@@ -0,0 +1,149 @@
+"""
+Cooperative Task Scheduler
+Version: 4-19-2026-v1.3
+Runs periodic tasks on asyncio with per-task period, deadline and overrun accounting
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+try:
+    _sleep_ms = asyncio.sleep_ms
+except AttributeError:
+    # CPython asyncio (sim engine on a host) has no sleep_ms
+    def _sleep_ms(ms):
+        return asyncio.sleep(ms / 1000)
+
+try:
+    from time import ticks_ms, ticks_diff, ticks_add
+except ImportError:
+    from flow_rate import ticks_ms, ticks_diff
+
+    def ticks_add(a, b):
+        return a + b
+
+
+class PeriodicTask:
+    """One scheduled job plus its timing statistics (all in ms)"""
+
+    def __init__(self, name, fn, period_ms, deadline_ms=None):
+        self.name = name
+        self.fn = fn
+        self.period_ms = period_ms
+        self.deadline_ms = period_ms if deadline_ms is None else deadline_ms
+        self.runs = 0
+        self.overruns = 0  # took longer than deadline_ms
+        self.missed = 0  # periods skipped because a run started a full period late
+        self.max_ms = 0
+        self.total_ms = 0
+        self.max_late_ms = 0  # worst start jitter
+        self.recent_late_ms = 0  # worst start jitter since Scheduler.take_jitter()
+        self._reported = 0
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "missed": self.missed,
+            "max_ms": self.max_ms,
+            "avg_ms": self.total_ms // self.runs if self.runs else 0,
+            "max_late_ms": self.max_late_ms,
+        }
+
+
+class Scheduler:
+    """
+    Each task runs in its own asyncio coroutine on a fixed cadence, so a slow task
+    (e.g. a flash write) only delays others for the time it actually runs. Task
+    functions are plain callables; if one returns a coroutine it is awaited.
+    Exceptions are printed and the task keeps its schedule.
+    """
+
+    def __init__(self):
+        self._tasks = []
+
+    def add(self, name, fn, period_ms, deadline_ms=None):
+        task = PeriodicTask(name, fn, period_ms, deadline_ms)
+        self._tasks.append(task)
+        return task
+
+    def task(self, name):
+        for t in self._tasks:
+            if t.name == name:
+                return t
+        return None
+
+    @property
+    def tasks(self):
+        return self._tasks
+
+    async def _loop(self, t):
+        due = ticks_ms()
+        while True:
+            start = ticks_ms()
+            late = ticks_diff(start, due)
+            if late > t.max_late_ms:
+                t.max_late_ms = late
+            if late > t.recent_late_ms:
+                t.recent_late_ms = late
+            try:
+                r = t.fn()
+                if r is not None and hasattr(r, "send"):
+                    await r
+            except Exception as e:
+                print(f"Task {t.name} error: {e}")
+            now = ticks_ms()
+            elapsed = ticks_diff(now, start)
+            t.runs += 1
+            t.total_ms += elapsed
+            if elapsed > t.max_ms:
+                t.max_ms = elapsed
+            if elapsed > t.deadline_ms:
+                t.overruns += 1
+
+            due = ticks_add(due, t.period_ms)
+            wait = ticks_diff(due, now)
+            if wait < 0:
+                # Fell behind: drop the missed periods instead of bursting to catch up
+                t.missed += -wait // t.period_ms + 1
+                due = ticks_add(now, t.period_ms)
+                wait = t.period_ms
+            await _sleep_ms(wait)
+
+    def take_jitter(self):
+        """Worst start lateness of any task (ms) since the previous call"""
+        worst = 0
+        for t in self._tasks:
+            if t.recent_late_ms > worst:
+                worst = t.recent_late_ms
+            t.recent_late_ms = 0
+        return worst
+
+    def report(self, only_new=True):
+        """Print tasks that overran or missed periods (since the last report if only_new)"""
+        for t in self._tasks:
+            bad = t.overruns + t.missed
+            if only_new and bad == t._reported:
+                continue
+            t._reported = bad
+            st = t.stats()
+            print(
+                f"Task {t.name}: {st['overruns']} overruns, {st['missed']} missed, "
+                f"max {st['max_ms']} ms / deadline {t.deadline_ms} ms, late {st['max_late_ms']} ms"
+            )
+
+    def start(self):
+        """Start every task on the running event loop (e.g. next to a server)"""
+        for t in self._tasks:
+            asyncio.create_task(self._loop(t))
+
+    async def _main(self):
+        self.start()
+        while True:
+            await _sleep_ms(60000)
+
+    def run(self):
+        """Start every task and run forever"""
+        asyncio.run(self._main())
@@ -0,0 +1,95 @@
+"""
+Ballast Settings Store
+Version: 4-19-2026-v1.3
+ballast_settings.json on flash, shared by WiFi and BLE modes
+"""
+
+import json
+from config import PULSES_PER_GALLON, POUNDS_PER_GALLON
+
+SETTINGS_FILE = "ballast_settings.json"
+
+
+# Settings — extended to match iOS app + ballast_settings.json on flash
+def default_settings():
+    return {
+        "pulses_per_gallon": PULSES_PER_GALLON,
+        "pounds_per_gallon": POUNDS_PER_GALLON,
+        "unit_mode": "gallons",
+        "show_pounds": False,
+        "is_fill_mode": True,
+        "tank_fill": {"Port": True, "Starboard": True, "Mid": True, "Forward": True},
+        "tank_max": {"port": 10000, "starboard": 10000, "mid": 10000, "forward": 5000},
+        "calibration": [0] * 8,
+    }
+
+
+def migrate_settings(s):
+    """Merge legacy calibration-only settings into tank_max + unit_mode."""
+    d = default_settings()
+    for k, v in d.items():
+        if k not in s:
+            s[k] = v
+    if "tank_max" not in s or not isinstance(s.get("tank_max"), dict):
+        s["tank_max"] = d["tank_max"].copy()
+    for key in ("port", "starboard", "mid", "forward"):
+        if key not in s["tank_max"]:
+            s["tank_max"][key] = d["tank_max"][key]
+    cal = s.get("calibration")
+    if not isinstance(cal, list) or len(cal) < 8:
+        s["calibration"] = [0] * 8
+    if "unit_mode" not in s:
+        s["unit_mode"] = "pounds" if s.get("show_pounds") else "gallons"
+    um = s["unit_mode"]
+    if um == "pounds":
+        s["show_pounds"] = True
+    elif um in ("gallons", "counter"):
+        s["show_pounds"] = False
+    if "is_fill_mode" not in s:
+        s["is_fill_mode"] = True
+    if "tank_fill" not in s or not isinstance(s.get("tank_fill"), dict):
+        s["tank_fill"] = d["tank_fill"].copy()
+    for tn in ("Port", "Starboard", "Mid", "Forward"):
+        if tn not in s["tank_fill"]:
+            s["tank_fill"][tn] = True
+    if "pounds_per_gallon" not in s:
+        s["pounds_per_gallon"] = POUNDS_PER_GALLON
+    return s
+
+
+def load_settings():
+    """Return settings from flash (migrated), or defaults (saved) if there are none"""
+    try:
+        with open(SETTINGS_FILE, "r") as f:
+            s = json.load(f)
+        s = migrate_settings(s)
+        print("Loaded saved settings")
+        return s
+    except Exception:
+        print("No saved settings, using defaults")
+        s = default_settings()
+        save_settings(s)
+        return s
+
+
+def save_settings(s):
+    try:
+        with open(SETTINGS_FILE, "w") as f:
+            json.dump(s, f)
+        print("Settings saved")
+    except Exception as e:
+        print(f"Error saving settings: {e}")
+
+
+def tank_percent(s, tank_key, total_pulses):
+    """Percent full (fill mode) or remaining (drain mode) for a tank ("port", ...)"""
+    tm = s["tank_max"].get(tank_key, 0)
+    if not tm:
+        return 0
+    fill = min(1.0, total_pulses / tm)
+    drain = not s["tank_fill"].get(tank_key[:1].upper() + tank_key[1:], True)
+    if drain:
+        pct = round((1 - fill) * 100)
+    else:
+        pct = round(fill * 100)
+    return max(0, min(100, pct))
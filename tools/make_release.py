@@ -0,0 +1,247 @@
+"""
+Release Builder (run on the host with CPython, not on the Pico)
+Version: 4-19-2026-v1.3
+Compresses the device files for OTA and records them in firmware_versions.json
+
+Usage: python tools/make_release.py [--delta-from TAG ...] [--mpy]
+Run from the repo root before pushing a release. Writes release/<file>.z (zlib,
+1 KB window so the Pico inflates with ~1 KB of RAM) and refreshes firmware_versions.json:
+  "files":      file -> {"version", "sha256"} (the device's update check compares the
+                SHA-256; older manifests had just the version tag)
+  "compressed": file -> {"path", "size", "zsize", "sha256"} (size/sha256 of the
+                inflated file, which the device checks before installing)
+  "deltas":     file -> base version -> [{"path", "zsize", "base_crc32"}], one per
+                git TAG given with --delta-from whose copy of the file differs
+                (several when tags share a version tag but not the same bytes)
+Deltas (release/delta/<file>.<version>.<crc32>.d.z) are zlib-compressed patches in the
+format ota.apply_patch() reads; the device uses one when its installed copy has that
+version and CRC32, and downloads the full file otherwise.
+
+--mpy also compiles the modules with mpy-cross (pip install mpy-cross, matching the
+Pico's MicroPython version) into release/mpy/<module>.mpy.z and records them under
+  "mpy":        file.py -> {"path", "size", "zsize", "sha256", "mpy_version"}
+Devices with a matching .mpy version install them next to the sources in mpy/ and
+import them instead. main.py (the entry script), config.py (edited on the device)
+and ota.py (loaded before the bytecode path is set up) always stay source.
+"""
+
+import argparse
+import difflib
+import hashlib
+import io
+import json
+import os
+import runpy
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RELEASE_DIR = "release"
+MANIFEST = "firmware_versions.json"
+ZLIB_WBITS = 10  # must match ota.ZLIB_WBITS
+PATCH_MAGIC = b"BMD1"  # patch format: see ota.py "Delta patches"
+OP_END, OP_COPY, OP_INSERT = 0, 1, 2
+MPY_EXCLUDE = ("main.py", "config.py", "ota.py")  # imported before mpy/ is on sys.path
+
+
+def compress(data):
+    c = zlib.compressobj(9, zlib.DEFLATED, ZLIB_WBITS)
+    return c.compress(data) + c.flush()
+
+
+def make_patch(base, target, base_version):
+    """Line-level diff of two file versions as COPY (from base) and INSERT ops"""
+    a = base.splitlines(keepends=True)
+    b = target.splitlines(keepends=True)
+    a_off = [0]
+    for line in a:
+        a_off.append(a_off[-1] + len(line))
+    version = base_version.encode()[:255]
+    out = [struct.pack("<4sIIIB", PATCH_MAGIC, len(base), zlib.crc32(base), len(target), len(version)), version]
+    sm = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        if tag == "equal":
+            out.append(struct.pack("<BII", OP_COPY, a_off[i1], a_off[i2] - a_off[i1]))
+        elif j2 > j1:
+            data = b"".join(b[j1:j2])
+            out.append(struct.pack("<BI", OP_INSERT, len(data)) + data)
+    out.append(bytes([OP_END]))
+    return b"".join(out)
+
+
+def apply_patch(base, patch):
+    """Host-side check of a patch (mirrors ota.apply_patch)"""
+    pos = struct.calcsize("<4sIIIB")
+    _, _, _, size, vlen = struct.unpack_from("<4sIIIB", patch)
+    pos += vlen
+    out = []
+    while patch[pos] != OP_END:
+        op = patch[pos]
+        if op == OP_COPY:
+            off, n = struct.unpack_from("<II", patch, pos + 1)
+            out.append(base[off:off + n])
+            pos += 9
+        else:
+            n = struct.unpack_from("<I", patch, pos + 1)[0]
+            out.append(patch[pos + 5:pos + 5 + n])
+            pos += 5 + n
+    data = b"".join(out)
+    assert len(data) == size
+    return data
+
+
+def device_apply_patch(base, patch):
+    """Apply a patch with the device code (ota.apply_patch), in a scratch directory"""
+    sys.path.insert(0, ROOT)
+    try:
+        import ota
+    finally:
+        sys.path.remove(ROOT)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # the device manifest ota keeps is written to the cwd
+        try:
+            with open("base", "wb") as f:
+                f.write(base)
+            ota.apply_patch("base", io.BytesIO(patch), "target")
+            with open("target", "rb") as f:
+                return f.read()
+        finally:
+            os.chdir(cwd)
+
+
+def check_patch_format():
+    """Round-trip a patch with a maximum-length base version through both appliers"""
+    base = b"".join(b"line %d\n" % i for i in range(200))
+    target = base.replace(b"line 50\n", b"changed\n") + b"appended\n"
+    patch = make_patch(base, target, "v" * 300)
+    assert apply_patch(base, patch) == target
+    assert device_apply_patch(base, patch) == target
+
+
+def mpy_cross(name):
+    """Compile a module with mpy-cross; returns the .mpy bytes"""
+    exe = shutil.which("mpy-cross")
+    cmd = [exe] if exe else [sys.executable, "-m", "mpy_cross"]
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, name[:-3] + ".mpy")
+        try:
+            subprocess.run(cmd + ["-o", out, name], check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            sys.exit(f"mpy-cross failed for {name} ({e}); install it with: pip install mpy-cross")
+        with open(out, "rb") as f:
+            return f.read()
+
+
+def git_show(tag, name):
+    try:
+        return subprocess.run(["git", "show", f"{tag}:{name}"], capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError:
+        return None
+
+
+def file_version(config, data):
+    with tempfile.NamedTemporaryFile("wb", suffix=".py", delete=False) as f:
+        f.write(data)
+    try:
+        return config["read_py_file_version"](f.name)
+    finally:
+        os.remove(f.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--delta-from", nargs="*", default=[], metavar="TAG",
+                        help="git tags of installed releases to build delta patches from")
+    parser.add_argument("--mpy", action="store_true", help="also build precompiled .mpy modules")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    if args.delta_from:
+        check_patch_format()
+    config = runpy.run_path("config.py")
+    os.makedirs(RELEASE_DIR, exist_ok=True)
+
+    try:
+        with open(MANIFEST) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest["release"] = config["VERSION"]
+    manifest["files"] = {}
+    manifest["compressed"] = {}
+    manifest["deltas"] = {}
+    manifest["mpy"] = {}
+
+    total = ztotal = 0
+    for name in config["UPDATE_FILES"]:
+        with open(name, "rb") as f:
+            data = f.read()
+        packed = compress(data)
+        assert zlib.decompress(packed) == data
+        path = f"{RELEASE_DIR}/{name}.z"
+        with open(path, "wb") as f:
+            f.write(packed)
+        manifest["files"][name] = {
+            "version": config["read_py_file_version"](name),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+        manifest["compressed"][name] = {
+            "path": path,
+            "size": len(data),
+            "zsize": len(packed),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+        total += len(data)
+        ztotal += len(packed)
+        print(f"{name:24} {len(data):7} -> {len(packed):6} bytes ({len(data) / len(packed):.1f}:1)")
+
+        for tag in args.delta_from:
+            base = git_show(tag, name)
+            if base is None or base == data:
+                continue
+            base_version = file_version(config, base)
+            patch = make_patch(base, data, base_version)
+            assert apply_patch(base, patch) == data
+            assert device_apply_patch(base, patch) == data
+            zpatch = compress(patch)
+            os.makedirs(f"{RELEASE_DIR}/delta", exist_ok=True)
+            base_crc = "%08x" % zlib.crc32(base)
+            dpath = f"{RELEASE_DIR}/delta/{name}.{base_version}.{base_crc}.d.z"
+            with open(dpath, "wb") as f:
+                f.write(zpatch)
+            entries = manifest["deltas"].setdefault(name, {}).setdefault(base_version, [])
+            if all(e["base_crc32"] != base_crc for e in entries):
+                entries.append({"path": dpath, "zsize": len(zpatch), "base_crc32": base_crc})
+            print(f"  delta from {tag} ({base_version}): {len(zpatch)} bytes")
+
+        if args.mpy and name not in MPY_EXCLUDE:
+            mpy = mpy_cross(name)
+            zmpy = compress(mpy)
+            os.makedirs(f"{RELEASE_DIR}/mpy", exist_ok=True)
+            mpath = f"{RELEASE_DIR}/mpy/{name[:-3]}.mpy.z"
+            with open(mpath, "wb") as f:
+                f.write(zmpy)
+            manifest["mpy"][name] = {
+                "path": mpath,
+                "size": len(mpy),
+                "zsize": len(zmpy),
+                "sha256": hashlib.sha256(mpy).hexdigest(),
+                "mpy_version": mpy[1],
+            }
+            print(f"  mpy v{mpy[1]}: {len(mpy)} bytes ({len(zmpy)} compressed)")
+
+    with open(MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    print(f"{'total':24} {total:7} -> {ztotal:6} bytes ({total / ztotal:.1f}:1)")
+    print(f"Updated {MANIFEST}; commit {RELEASE_DIR}/ with it")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())